@@ -6,7 +6,10 @@
 import uvicorn
 import os
 import logging
-from src.api.main import app
+# Процессы пула кадров (spawn/forkserver) выполняют этот скрипт как __mp_main__:
+# приложение с глобальным VideoProcessor им не нужно
+if __name__ != "__mp_main__":
+    from src.api.main import app
 
 # Настройка логирования
 logging.basicConfig(
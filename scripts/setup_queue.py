@@ -1,209 +1,110 @@
 #!/usr/bin/env python3
 """
 Настройка очереди обработки видео для высоких нагрузок
+
+Состояние очереди хранится в SQLite (src/services/job_queue.py, режим WAL) -
+той же базе, что использует сервер (QUEUE_DB_PATH). Задачи переживают падение
+воркера: аренда истекает, и задачу забирает другой воркер.
 """
 
 import asyncio
-import aiofiles
-import json
 import os
-from datetime import datetime
-from typing import List, Dict, Any
+import socket
+import sys
+from typing import Dict, Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.config.settings import settings
+from src.services.job_queue import JobQueue
+
+# Вид задачи в общей очереди
+JOB_KIND = "video"
 
 class VideoProcessingQueue:
     """Очередь обработки видео"""
-    
-    def __init__(self, max_concurrent=3):
+
+    def __init__(self, max_concurrent=3, db_path=settings.QUEUE_DB_PATH, poll_interval=1.0):
         self.max_concurrent = max_concurrent
-        self.queue_file = "video_queue.json"
-        self.processing_file = "processing_status.json"
-        self.completed_file = "completed_videos.json"
-        
+        self.poll_interval = poll_interval
+        self.queue = JobQueue(
+            db_path,
+            lease_seconds=settings.QUEUE_LEASE_SECONDS,
+            max_attempts=settings.QUEUE_MAX_ATTEMPTS,
+            retry_backoff=settings.QUEUE_RETRY_BACKOFF,
+            retention_seconds=settings.QUEUE_RETENTION_HOURS * 3600
+        )
+
     async def add_to_queue(self, video_path: str, priority: int = 1) -> str:
         """Добавляет видео в очередь"""
-        task_id = f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{hash(video_path) % 10000}"
-        
-        task = {
-            "id": task_id,
-            "video_path": video_path,
-            "priority": priority,
-            "status": "queued",
-            "created_at": datetime.now().isoformat(),
-            "started_at": None,
-            "completed_at": None,
-            "error": None
-        }
-        
-        # Загружаем текущую очередь
-        queue = await self._load_queue()
-        queue.append(task)
-        
-        # Сортируем по приоритету
-        queue.sort(key=lambda x: x['priority'], reverse=True)
-        
-        # Сохраняем очередь
-        await self._save_queue(queue)
-        
+        task_id = await asyncio.to_thread(
+            self.queue.enqueue, JOB_KIND, {"video_path": os.path.abspath(video_path)}, priority
+        )
         print(f"✅ Видео добавлено в очередь: {task_id}")
         return task_id
-    
+
     async def process_queue(self):
         """Обрабатывает очередь видео"""
         print(f"🚀 Запуск обработки очереди (макс. {self.max_concurrent} параллельно)...")
-        
+        worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        await asyncio.gather(*(self._worker(f"{worker_prefix}:{i}") for i in range(self.max_concurrent)))
+
+    async def _worker(self, worker_id: str):
+        """Забирает задачи из очереди по одной, пока не остановят"""
+        while True:
+            task = await asyncio.to_thread(self.queue.claim, worker_id, [JOB_KIND])
+            if task is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            print(f"🎬 Начата обработка: {task['id']} (попытка {task['attempts']})")
+            heartbeat = asyncio.create_task(self._heartbeat(task['id'], worker_id))
+            try:
+                result = await asyncio.to_thread(self._process_video, task)
+                await asyncio.to_thread(self.queue.complete, task['id'], worker_id, result)
+                print(f"✅ Обработка завершена: {task['id']}")
+            except Exception as e:
+                status = await asyncio.to_thread(self.queue.fail, task['id'], worker_id, str(e))
+                print(f"❌ Ошибка обработки {task['id']} ({status}): {str(e)}")
+            finally:
+                heartbeat.cancel()
+
+    async def _heartbeat(self, task_id: str, worker_id: str):
+        """Продлевает аренду задачи, пока она обрабатывается"""
         while True:
-            queue = await self._load_queue()
-            processing = await self._load_processing()
-            
-            # Находим задачи для обработки
-            queued_tasks = [t for t in queue if t['status'] == 'queued']
-            active_tasks = [t for t in processing if t['status'] == 'processing']
-            
-            # Запускаем новые задачи если есть свободные слоты
-            available_slots = self.max_concurrent - len(active_tasks)
-            
-            for task in queued_tasks[:available_slots]:
-                await self._start_processing(task)
-            
-            # Проверяем завершенные задачи
-            await self._check_completed_tasks()
-            
-            if not queued_tasks and not active_tasks:
-                print("✅ Очередь пуста, ожидание новых задач...")
-                await asyncio.sleep(5)
-            else:
-                await asyncio.sleep(2)
-    
-    async def _start_processing(self, task: Dict[str, Any]):
-        """Запускает обработку задачи"""
-        task['status'] = 'processing'
-        task['started_at'] = datetime.now().isoformat()
-        
-        # Перемещаем в processing
-        processing = await self._load_processing()
-        processing.append(task)
-        await self._save_processing(processing)
-        
-        # Удаляем из очереди
-        queue = await self._load_queue()
-        queue = [t for t in queue if t['id'] != task['id']]
-        await self._save_queue(queue)
-        
-        # Запускаем обработку в фоне
-        asyncio.create_task(self._process_video(task))
-        
-        print(f"🎬 Начата обработка: {task['id']}")
-    
-    async def _process_video(self, task: Dict[str, Any]):
-        """Обрабатывает видео"""
-        try:
-            import sys
-            sys.path.append('src')
-            from dive_color_corrector.mobile_correct import analyze_video_mobile, process_video_mobile
-            
-            # Генерируем путь для выходного файла
-            input_path = task['video_path']
-            output_path = input_path.replace('.mp4', '_processed.mp4')
-            
-            # Анализируем видео
-            video_data = analyze_video_mobile(input_path, output_path)
-            
-            # Обрабатываем видео
-            result = process_video_mobile(video_data)
-            
-            # Обновляем статус
-            task['status'] = 'completed'
-            task['completed_at'] = datetime.now().isoformat()
-            task['output_path'] = output_path
-            task['result'] = result
-            
-            # Перемещаем в completed
-            completed = await self._load_completed()
-            completed.append(task)
-            await self._save_completed(completed)
-            
-            # Удаляем из processing
-            processing = await self._load_processing()
-            processing = [t for t in processing if t['id'] != task['id']]
-            await self._save_processing(processing)
-            
-            print(f"✅ Обработка завершена: {task['id']}")
-            
-        except Exception as e:
-            # Обрабатываем ошибку
-            task['status'] = 'error'
-            task['error'] = str(e)
-            task['completed_at'] = datetime.now().isoformat()
-            
-            # Перемещаем в completed с ошибкой
-            completed = await self._load_completed()
-            completed.append(task)
-            await self._save_completed(completed)
-            
-            # Удаляем из processing
-            processing = await self._load_processing()
-            processing = [t for t in processing if t['id'] != task['id']]
-            await self._save_processing(processing)
-            
-            print(f"❌ Ошибка обработки {task['id']}: {str(e)}")
-    
-    async def _check_completed_tasks(self):
-        """Проверяет завершенные задачи"""
-        # Здесь можно добавить логику для очистки старых задач
-        pass
-    
-    async def _load_queue(self) -> List[Dict[str, Any]]:
-        """Загружает очередь"""
-        if os.path.exists(self.queue_file):
-            async with aiofiles.open(self.queue_file, 'r') as f:
-                content = await f.read()
-                return json.loads(content)
-        return []
-    
-    async def _save_queue(self, queue: List[Dict[str, Any]]):
-        """Сохраняет очередь"""
-        async with aiofiles.open(self.queue_file, 'w') as f:
-            await f.write(json.dumps(queue, indent=2))
-    
-    async def _load_processing(self) -> List[Dict[str, Any]]:
-        """Загружает список обрабатываемых задач"""
-        if os.path.exists(self.processing_file):
-            async with aiofiles.open(self.processing_file, 'r') as f:
-                content = await f.read()
-                return json.loads(content)
-        return []
-    
-    async def _save_processing(self, processing: List[Dict[str, Any]]):
-        """Сохраняет список обрабатываемых задач"""
-        async with aiofiles.open(self.processing_file, 'w') as f:
-            await f.write(json.dumps(processing, indent=2))
-    
-    async def _load_completed(self) -> List[Dict[str, Any]]:
-        """Загружает список завершенных задач"""
-        if os.path.exists(self.completed_file):
-            async with aiofiles.open(self.completed_file, 'r') as f:
-                content = await f.read()
-                return json.loads(content)
-        return []
-    
-    async def _save_completed(self, completed: List[Dict[str, Any]]):
-        """Сохраняет список завершенных задач"""
-        async with aiofiles.open(self.completed_file, 'w') as f:
-            await f.write(json.dumps(completed, indent=2))
-    
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            if not await asyncio.to_thread(self.queue.heartbeat, task_id, worker_id):
+                print(f"⚠️ Аренда задачи {task_id} потеряна")
+                return
+
+    @staticmethod
+    def _process_video(task: Dict[str, Any]) -> Dict[str, Any]:
+        """Обрабатывает видео (синхронно, в отдельном потоке)"""
+        from src.dive_color_corrector.mobile_correct import analyze_video_mobile, process_video_mobile
+
+        # Генерируем путь для выходного файла
+        input_path = task['payload']['video_path']
+        output_path = input_path.replace('.mp4', '_processed.mp4')
+
+        # Анализируем видео
+        video_data = analyze_video_mobile(input_path, output_path)
+
+        # Обрабатываем видео
+        result = process_video_mobile(video_data)
+        result['output_path'] = output_path
+        return result
+
     async def get_status(self) -> Dict[str, Any]:
         """Возвращает статус очереди"""
-        queue = await self._load_queue()
-        processing = await self._load_processing()
-        completed = await self._load_completed()
-        
+        counts = await asyncio.to_thread(self.queue.stats)
         return {
-            "queued": len(queue),
-            "processing": len(processing),
-            "completed": len(completed),
-            "queue_tasks": queue,
-            "processing_tasks": processing,
-            "recent_completed": completed[-10:] if completed else []
+            "queued": counts["queued"],
+            "processing": counts["running"],
+            "completed": counts["completed"],
+            "failed": counts["failed"],
+            "queue_tasks": await asyncio.to_thread(self.queue.list_jobs, "queued"),
+            "processing_tasks": await asyncio.to_thread(self.queue.list_jobs, "running"),
+            "recent_completed": await asyncio.to_thread(self.queue.list_jobs, "completed")
         }
 
 async def main():
@@ -211,16 +112,18 @@ async def main():
     import argparse
     parser = argparse.ArgumentParser(description='Video processing queue')
     parser.add_argument('--add', help='Add video to queue')
+    parser.add_argument('--priority', type=int, default=1, help='Priority of the added video (higher first)')
     parser.add_argument('--status', action='store_true', help='Show queue status')
     parser.add_argument('--start', action='store_true', help='Start processing queue')
     parser.add_argument('--max-concurrent', type=int, default=3, help='Max concurrent tasks')
-    
+    parser.add_argument('--db', default=settings.QUEUE_DB_PATH, help='Queue database path')
+
     args = parser.parse_args()
-    
-    queue = VideoProcessingQueue(max_concurrent=args.max_concurrent)
-    
+
+    queue = VideoProcessingQueue(max_concurrent=args.max_concurrent, db_path=args.db)
+
     if args.add:
-        task_id = await queue.add_to_queue(args.add)
+        task_id = await queue.add_to_queue(args.add, args.priority)
         print(f"Task added: {task_id}")
     elif args.status:
         status = await queue.get_status()
@@ -228,6 +131,7 @@ async def main():
         print(f"  • В очереди: {status['queued']}")
         print(f"  • Обрабатывается: {status['processing']}")
         print(f"  • Завершено: {status['completed']}")
+        print(f"  • С ошибкой: {status['failed']}")
     elif args.start:
         await queue.process_queue()
     else:
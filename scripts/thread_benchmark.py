@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк бюджета потоков: обработка батчей кадров в пуле процессов
+без ограничения потоков, с бюджетом потоков и с бюджетом и привязкой к ядрам
+
+Пример: python scripts/thread_benchmark.py --width 3840 --height 2160 --frames 192
+"""
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Добавляем путь к модулям
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from dive_color_corrector.mobile_correct import _process_frame_batch, get_filter_matrix
+from dive_color_corrector.threads import ThreadBudget
+
+
+def make_batches(width, height, frames, batch_size):
+    """Синтетические подводные кадры (синий фон с шумом) в JPEG, как в конвейере"""
+    rng = np.random.default_rng(0)
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+    base[..., 0] = 170
+    base[..., 1] = 120
+    base[..., 2] = 40
+    noise = rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8)
+    image = cv2.add(base, noise)
+    _, encoded = cv2.imencode('.jpg', image)
+    frame = encoded.tobytes()
+
+    # Два семпла фильтра на все видео - интерполяция как при обычном рендере
+    filter_matrix = np.asarray(get_filter_matrix(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+    filter_matrices = np.array([filter_matrix, filter_matrix])
+    filter_indices = [1, frames]
+
+    batches = []
+    for start in range(1, frames + 1, batch_size):
+        numbers = list(range(start, min(start + batch_size, frames + 1)))
+        batches.append(([frame] * len(numbers), numbers, filter_matrices, filter_indices, 0))
+    return batches
+
+
+def count_threads():
+    """Число потоков в процессах пула (нужен psutil)"""
+    if psutil is None:
+        return None
+    total = 0
+    for process in psutil.Process().children():
+        try:
+            total += process.num_threads()
+        except psutil.Error:
+            pass
+    return total
+
+
+def run(batches, workers, initializer=None, initargs=()):
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        # Прогрев: процессы запущены и инициализированы до замера
+        list(executor.map(_process_frame_batch, batches[:workers]))
+        threads = count_threads()
+        started = time.perf_counter()
+        frames = sum(len(result) for result in executor.map(_process_frame_batch, batches))
+        elapsed = time.perf_counter() - started
+    return frames / elapsed, threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Thread budget benchmark')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--frames', type=int, default=240)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None, help='Процессов пула (по умолчанию - по бюджету)')
+    parser.add_argument('--budget', type=int, default=None, help='Бюджет потоков (по умолчанию - ядра)')
+    args = parser.parse_args()
+
+    batches = make_batches(args.width, args.height, args.frames, args.batch_size)
+    budget = ThreadBudget(args.budget)
+    workers = args.workers or budget.total
+
+    print(f"📊 {args.frames} кадров {args.width}x{args.height}, {workers} процессов, бюджет {budget.total} потоков")
+    # Инициализатор создается непосредственно перед замером: он ограничивает
+    # и основной процесс, а форкнутые процессы наследуют его настройки
+    modes = [
+        ("без ограничения", lambda: (None, ())),
+        ("бюджет потоков", lambda: budget.pool_initializer(workers)),
+        ("бюджет + привязка", lambda: ThreadBudget(args.budget, pin_workers=True).pool_initializer(workers)),
+    ]
+    for name, make_initializer in modes:
+        initializer, initargs = make_initializer()
+        fps, threads = run(batches, workers, initializer, initargs)
+        threads_info = f", потоков в пуле: {threads}" if threads is not None else ""
+        print(f"  {name:<20} {fps:8.1f} кадров/с{threads_info}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ import logging
 
 from .routes import router
 from ..config.settings import settings
+from ..services.video_processor import video_processor
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +33,18 @@ app.add_middleware(
 # Подключаем роуты
 app.include_router(router)
 
+@app.on_event("startup")
+async def start_background_tasks():
+    """Запускает фоновую очистку хранилища и прогревает пул процессов кадров"""
+    video_processor.janitor.start()
+    video_processor.start_frame_pool()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    """Останавливает фоновые задачи и пул процессов кадров"""
+    await video_processor.janitor.stop()
+    video_processor.stop_frame_pool()
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8080))
     host = os.getenv("HOST", "0.0.0.0")
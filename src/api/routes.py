@@ -1,13 +1,21 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Request
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request, WebSocket
+from fastapi.responses import StreamingResponse, FileResponse, Response, PlainTextResponse
 import logging
 from datetime import datetime
 import os
+import io
+import shutil
 import json
+import numpy as np
+from starlette.concurrency import run_in_threadpool
 
 from ..models.schemas import HealthResponse
 from ..services.video_processor import video_processor
-from ..dive_color_corrector.mobile_correct import configure_performance, get_performance_info
+from ..services.storage import path_size
+from ..services.uploads import check_content_length, iter_upload_file
+from ..services.live import LiveSession, LIVE_FORMATS
+from ..dive_color_corrector.mobile_correct import configure_performance, get_performance_info, get_filter_timeline
+from ..dive_color_corrector.lut import filter_to_cube, DEFAULT_LUT_SIZE
 from ..config.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -15,7 +23,10 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 async def check_file_size(file: UploadFile) -> None:
-    """Проверка размера загружаемого файла"""
+    """Быстрая предварительная проверка размера (если клиент его сообщил)
+
+    Окончательно лимит проверяется при потоковой записи на диск.
+    """
     if hasattr(file, 'size') and file.size and file.size > settings.MAX_FILE_SIZE:
         raise HTTPException(
             status_code=413, 
@@ -56,6 +67,8 @@ async def process_image(file: UploadFile = File(...)):
     try:
         result = await video_processor.process_image(file)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -67,9 +80,17 @@ async def process_video(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="File must be a video")
     
     try:
+        # Загрузка и допуск - до ответа: 413 и 429 с Retry-After приходят обычным ответом
+        job = await video_processor.start_video(file)
+
         async def generate():
-            async for result in video_processor.process_video(file):
-                yield f"data: {json.dumps(result)}\n\n"
+            try:
+                async for result in video_processor.process_video(job):
+                    yield f"data: {json.dumps(result)}\n\n"
+            except HTTPException as e:
+                # Ответ уже начат - ошибка передается последним событием
+                error = {"status": "error", "status_code": e.status_code, "detail": e.detail}
+                yield f"data: {json.dumps(error)}\n\n"
         
         return StreamingResponse(
             generate(),
@@ -81,6 +102,8 @@ async def process_video(file: UploadFile = File(...)):
                 "Access-Control-Allow-Headers": "*"
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -93,26 +116,55 @@ async def download_file(filename: str):
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
+    # Отмечаем обращение для LRU-вытеснения
+    video_processor.output_store.touch(file_path)
+    
     return FileResponse(
         path=file_path,
         filename=filename,
         media_type='application/octet-stream'
     )
 
+# Раздача пакетов HLS без nginx (в docker-compose их отдает nginx напрямую из outputs)
+HLS_CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t"
+}
+
+@router.get(settings.HLS_URL_PREFIX + "/{package}/{path:path}")
+async def serve_hls(package: str, path: str):
+    """Плейлисты и сегменты HLS из хранилища результатов"""
+    _, ext = os.path.splitext(path)
+    package_dir = os.path.realpath(video_processor.output_store.path_for(package))
+    file_path = os.path.realpath(os.path.join(package_dir, path))
+    if (not package.endswith("_hls") or ext not in HLS_CONTENT_TYPES
+            or not file_path.startswith(package_dir + os.sep) or not os.path.isfile(file_path)):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if ext == ".m3u8":
+        # Отмечаем обращение к пакету для LRU-вытеснения
+        video_processor.output_store.touch(package_dir)
+    return FileResponse(path=file_path, media_type=HLS_CONTENT_TYPES[ext])
+
 @router.get("/api/files")
 async def list_files():
     """Получение списка обработанных файлов"""
     try:
         files = []
-        for filename in os.listdir(video_processor.output_dir):
+        for filename in sorted(os.listdir(video_processor.output_dir)):
+            if filename.startswith('.'):
+                continue
             file_path = os.path.join(video_processor.output_dir, filename)
-            if os.path.isfile(file_path):
-                file_size = os.path.getsize(file_path)
+            # Результат может быть каталогом (пакет HLS, набор вариантов)
+            try:
                 files.append({
                     "filename": filename,
-                    "size": file_size,
-                    "path": file_path
+                    "size": path_size(file_path),
+                    "path": file_path,
+                    "is_dir": os.path.isdir(file_path)
                 })
+            except FileNotFoundError:
+                continue
         return {"files": files}
     except Exception as e:
         logger.error(f"Error listing files: {str(e)}")
@@ -120,14 +172,18 @@ async def list_files():
 
 @router.delete("/api/files/{filename}")
 async def delete_file(filename: str):
-    """Удаление обработанного файла"""
+    """Удаление обработанного файла или каталога результата"""
     file_path = os.path.join(video_processor.output_dir, filename)
     
-    if not os.path.exists(file_path):
+    # Служебные записи (индекс кеша) и выход за пределы хранилища недоступны
+    if filename.startswith('.') or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
     try:
-        os.remove(file_path)
+        if os.path.isdir(file_path):
+            shutil.rmtree(file_path)
+        else:
+            os.remove(file_path)
         return {"message": "File deleted successfully"}
     except Exception as e:
         logger.error(f"Error deleting file: {str(e)}")
@@ -172,6 +228,14 @@ async def mobile_process_image(file: UploadFile = File(...)):
             "success": True,
             "data": result
         }
+    except HTTPException as e:
+        if e.status_code in (413, 429):
+            raise
+        logger.error(f"Error processing image: {e.detail}")
+        return {
+            "success": False,
+            "error": str(e.detail)
+        }
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         return {
@@ -180,63 +244,349 @@ async def mobile_process_image(file: UploadFile = File(...)):
         }
 
 @router.post("/api/mobile/process/video")
-async def mobile_process_video(file: UploadFile = File(...)):
-    """Обработка видео для мобильного клиента"""
+async def mobile_process_video(file: UploadFile = File(...), proxy: UploadFile = File(None), proxy_hash: str = None,
+                               review: bool = False, start: float = None, end: float = None, stream: bool = False,
+                               hls: bool = False, variants: str = None):
+    """Обработка видео для мобильного клиента
+
+    proxy - необязательная уменьшенная копия (например, 360p): анализ выполняется
+    по ней, а оригинал декодируется один раз - при коррекции. Вместо файла можно
+    передать proxy_hash прокси, уже отправленной в /api/mobile/analyze/video.
+    review=true - быстро вернуть уменьшенную копию для просмотра; полное
+    разрешение рендерится при первом запросе full_download_url.
+    start, end - обработать и вернуть только отрезок (в секундах от начала).
+    stream=true - ответ приходит сразу после загрузки, а результат (фрагментированный
+    MP4) можно смотреть по stream_url, пока обработка еще идет.
+    hls=true - результат упаковывается в HLS (несколько качеств), ссылка в hls_url.
+    variants - JSON-список вариантов (name, max_dimension, codec, bitrate, strength):
+    все они рендерятся за один проход декодирования, ссылки в data.variants.
+    """
     if not file.content_type or not file.content_type.startswith('video/'):
         raise HTTPException(status_code=400, detail="File must be a video")
+    if proxy is not None and (not proxy.content_type or not proxy.content_type.startswith('video/')):
+        raise HTTPException(status_code=400, detail="Proxy must be a video")
     
     # Проверяем размер файла
     await check_file_size(file)
+    options = video_processor.render_options(review=review, start=start, end=end, stream=stream, hls=hls,
+                                             variants=variants)
     
     try:
-        # Очищаем все старые файлы перед обработкой нового
-        cleaned_files = video_processor.cleanup_all_files()
-        logger.info(f"Cleaned {len(cleaned_files)} old files before processing new video")
-        
-        # Сохраняем загруженный файл
-        input_path = video_processor._get_temp_path(file.filename)
-        output_path = video_processor._get_output_path(file.filename)
-        
-        with open(input_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Импортируем функции обработки
-        from ..dive_color_corrector.mobile_correct import analyze_video_mobile, process_video_mobile
-        
-        # Анализируем видео
-        video_data = analyze_video_mobile(input_path, output_path)
-        
-        # Обрабатываем видео
-        result = process_video_mobile(video_data)
-        
-        # Удаляем временный файл
-        os.remove(input_path)
-        
-        # Добавляем информацию о файле
-        result.update({
-            "input_filename": file.filename,
-            "output_filename": os.path.basename(output_path),
-            "file_size": os.path.getsize(output_path) if os.path.exists(output_path) else 0,
-            "cleaned_files_count": len(cleaned_files)
-        })
+        result = await video_processor.process_video_upload(file, proxy=proxy, proxy_hash=proxy_hash, options=options)
         
         return {
             "success": True,
             "data": result
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error processing video: {str(e)}")
-        error_message = str(e)
-        if "index 0 is out of bounds" in error_message:
-            error_message = "Ошибка обработки видео: не удалось проанализировать видеофайл. Проверьте корректность файла."
-        elif "Не удалось получить ни одного кадра" in error_message:
-            error_message = "Ошибка обработки видео: не удалось прочитать кадры из видеофайла. Проверьте формат и целостность файла."
+        return _mobile_video_error(e)
+
+@router.put("/api/mobile/process/video")
+async def mobile_process_video_raw(request: Request, filename: str = "video.mp4", proxy_hash: str = None,
+                                   review: bool = False, start: float = None, end: float = None, stream: bool = False,
+                                   hls: bool = False, variants: str = None):
+    """Обработка видео, переданного телом запроса (application/octet-stream) без multipart"""
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    if not (content_type.startswith("application/octet-stream") or content_type.startswith("video/")):
+        raise HTTPException(status_code=415, detail="Body must be application/octet-stream or video/*")
+    
+    # Отклоняем заранее, если заявленный размер превышает лимит
+    check_content_length(request.headers.get("content-length"), settings.MAX_FILE_SIZE)
+    options = video_processor.render_options(review=review, start=start, end=end, stream=stream, hls=hls,
+                                             variants=variants)
+    
+    try:
+        content_length = request.headers.get("content-length")
+        result = await video_processor.process_video_stream(
+            request.stream(), filename,
+            expected_size=int(content_length) if content_length else None,
+            proxy_hash=proxy_hash,
+            options=options
+        )
         
+        return {
+            "success": True,
+            "data": result
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        return _mobile_video_error(e)
+
+def _mobile_video_error(e: Exception):
+    """Формирует ответ об ошибке обработки видео для мобильного клиента"""
+    logger.error(f"Error processing video: {str(e)}")
+    error_message = str(e)
+    if "index 0 is out of bounds" in error_message:
+        error_message = "Ошибка обработки видео: не удалось проанализировать видеофайл. Проверьте корректность файла."
+    elif "Не удалось получить ни одного кадра" in error_message:
+        error_message = "Ошибка обработки видео: не удалось прочитать кадры из видеофайла. Проверьте формат и целостность файла."
+    
+    return {
+        "success": False,
+        "error": error_message
+    }
+
+# Только анализ: клиент применяет коррекцию сам (матрица или 3D LUT на GPU)
+@router.post("/api/mobile/analyze/video")
+async def mobile_analyze_video(
+    file: UploadFile = File(...),
+    format: str = "json",
+    lut: bool = False,
+    lut_size: int = DEFAULT_LUT_SIZE
+):
+    """Анализ видео (или его уменьшенной копии) без рендера: матрицы фильтра с метками времени
+
+    format=json - JSON с матрицами (4x5, построчно) и опционально .cube на каждый семпл;
+    format=npz - компактный бинарный ответ (frames, timestamps, matrices, fps).
+    Между семплами матрицы интерполируются линейно.
+    """
+    if not file.content_type or not file.content_type.startswith('video/'):
+        raise HTTPException(status_code=400, detail="File must be a video")
+    if format not in ("json", "npz"):
+        raise HTTPException(status_code=400, detail="format must be json or npz")
+    
+    await check_file_size(file)
+    
+    try:
+        video_data = await video_processor.analyze_video_stream(iter_upload_file(file), file.filename)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return _mobile_video_error(e)
+    
+    timeline = get_filter_timeline(video_data)
+    
+    if format == "npz":
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            frames=np.array([s["frame"] for s in timeline], dtype=np.int32),
+            timestamps=np.array([s["timestamp"] for s in timeline], dtype=np.float32),
+            matrices=np.array([s["matrix"] for s in timeline], dtype=np.float32).reshape(-1, 20),
+            fps=np.float32(video_data["fps"])
+        )
+        return Response(
+            content=buffer.getvalue(),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{video_data["content_hash"][:16]}_filters.npz"'}
+        )
+    
+    data = {
+        "content_hash": video_data["content_hash"],
+        "fps": video_data["fps"],
+        "frame_count": video_data["frame_count"],
+        "duration": video_data["frame_count"] / video_data["fps"] if video_data["fps"] else None,
+        "rotation_angle": video_data.get("rotation_angle", 0),
+        "samples": timeline
+    }
+    if lut:
+        data["luts"] = [filter_to_cube(sample["matrix"], lut_size) for sample in timeline]
+    
+    return {
+        "success": True,
+        "data": data
+    }
+
+@router.post("/api/mobile/analyze/image")
+async def mobile_analyze_image(file: UploadFile = File(...), format: str = "json", lut_size: int = DEFAULT_LUT_SIZE):
+    """Анализ изображения без коррекции: матрица фильтра (format=json) или 3D LUT (format=cube)"""
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    if format not in ("json", "cube"):
+        raise HTTPException(status_code=400, detail="format must be json or cube")
+    
+    await check_file_size(file)
+    
+    try:
+        result = await video_processor.analyze_image(file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing image: {str(e)}")
         return {
             "success": False,
-            "error": error_message
+            "error": str(e)
         }
+    
+    if format == "cube":
+        return PlainTextResponse(filter_to_cube(result["filter"], lut_size))
+    
+    return {
+        "success": True,
+        "data": {
+            "width": result["width"],
+            "height": result["height"],
+            "matrix": [float(v) for v in result["filter"]]
+        }
+    }
+
+# Возобновляемая загрузка видео по частям
+@router.post("/api/mobile/uploads")
+async def mobile_create_upload(filename: str, size: int, chunk_size: int = None):
+    """Создает возобновляемую загрузку видео"""
+    return {
+        "success": True,
+        "data": video_processor.uploads.create(filename, size, chunk_size)
+    }
+
+@router.put("/api/mobile/uploads/{upload_id}/chunks/{index}")
+async def mobile_upload_chunk(upload_id: str, index: int, request: Request):
+    """Принимает часть загрузки (части можно отправлять параллельно и повторно)"""
+    check_content_length(request.headers.get("content-length"), video_processor.uploads.max_chunk_size)
+    
+    return {
+        "success": True,
+        "data": await video_processor.uploads.put_chunk(upload_id, index, request.stream())
+    }
+
+@router.get("/api/mobile/uploads/{upload_id}")
+async def mobile_upload_status(upload_id: str):
+    """Возвращает принятые диапазоны и недостающие части загрузки"""
+    return {
+        "success": True,
+        "data": video_processor.uploads.status(upload_id)
+    }
+
+@router.post("/api/mobile/uploads/{upload_id}/complete")
+async def mobile_complete_upload(upload_id: str, review: bool = False, start: float = None, end: float = None,
+                                 stream: bool = False, hls: bool = False, variants: str = None):
+    """Завершает загрузку и запускает обработку видео"""
+    options = video_processor.render_options(review=review, start=start, end=end, stream=stream, hls=hls,
+                                             variants=variants)
+    try:
+        result = await video_processor.process_resumable_upload(upload_id, options=options)
+        
+        return {
+            "success": True,
+            "data": result
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        return _mobile_video_error(e)
+
+@router.delete("/api/mobile/uploads/{upload_id}")
+async def mobile_abort_upload(upload_id: str):
+    """Отменяет загрузку и удаляет принятые данные"""
+    video_processor.uploads.abort(upload_id)
+    return {"success": True, "message": "Upload aborted"}
+
+@router.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Сведения о видео-задаче: готовые файлы и параметры
+
+    Для задачи в обработке (stream) - последнее событие прогресса (progress, в том
+    числе от воркера Redis) и eta_seconds по прогнозу длительности.
+    """
+    return {
+        "success": True,
+        "data": video_processor.job_status(job_id)
+    }
+
+@router.get("/api/jobs/{job_id}/download")
+async def download_job_video(job_id: str):
+    """Скачивание результата в полном разрешении
+
+    Если задача выполнялась в режиме review, полноразмерный рендер запускается
+    при первом запросе и использует уже сохраненный анализ.
+    """
+    file_path = await video_processor.render_full_video(job_id)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # Отмечаем обращение для LRU-вытеснения
+    video_processor.output_store.touch(file_path)
+    
+    return FileResponse(
+        path=file_path,
+        filename=os.path.basename(file_path),
+        media_type='application/octet-stream'
+    )
+
+@router.get("/api/jobs/{job_id}/variants/{name}")
+async def download_job_variant(job_id: str, name: str):
+    """Скачивание одного из вариантов задачи с variants"""
+    file_path = video_processor.variant_path(job_id, name)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # Отмечаем обращение к каталогу вариантов для LRU-вытеснения
+    video_processor.output_store.touch(os.path.dirname(file_path))
+    
+    return FileResponse(
+        path=file_path,
+        filename=os.path.basename(file_path),
+        media_type='application/octet-stream'
+    )
+
+@router.get("/api/jobs/{job_id}/stream")
+async def stream_job_video(job_id: str):
+    """Фрагментированный MP4 задачи с stream=true: отдается по мере обработки
+
+    Ответ идет chunked-передачей без Content-Length и завершается, когда
+    обработка закончена и файл дочитан.
+    """
+    chunks = await video_processor.tail_stream(job_id)
+    return StreamingResponse(
+        chunks,
+        media_type="video/mp4",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+@router.get("/api/jobs/{job_id}/preview")
+async def preview_job_frame(job_id: str, t: float = 0.0, width: int = 640, mode: str = "split"):
+    """Кадр предпросмотра коррекции на момент t (секунды) в JPEG
+
+    mode=split - слева исходный кадр, справа скорректированный; mode=full - только коррекция.
+    Видео не рендерится: используется сохраненный анализ и ближайший кадр.
+    """
+    jpeg, frame_number, frame_timestamp = await video_processor.run_interactive(
+        video_processor.previews.render, job_id, t, width, mode
+    )
+    return Response(
+        content=jpeg,
+        media_type="image/jpeg",
+        headers={
+            "X-Frame-Number": str(frame_number),
+            "X-Frame-Timestamp": f"{frame_timestamp:.3f}",
+            "Cache-Control": "private, max-age=3600"
+        }
+    )
+
+@router.websocket("/api/mobile/live")
+async def mobile_live_correction(
+    websocket: WebSocket,
+    format: str = "jpeg",
+    width: int = 0,
+    height: int = 0,
+    refresh: int = settings.LIVE_REFRESH_FRAMES,
+    smoothing: float = settings.LIVE_SMOOTHING
+):
+    """Живая коррекция кадров камеры: клиент шлет кадры, сервер возвращает скорректированные
+
+    format=jpeg - JPEG-кадры; format=raw - сырые BGR24-кадры размера width x height.
+    После каждого кадра приходит JSON со статистикой (latency_ms, dropped).
+    """
+    if format not in LIVE_FORMATS or (format == "raw" and (width <= 0 or height <= 0)):
+        await websocket.close(code=1003)
+        return
+    if LiveSession.active >= settings.LIVE_MAX_SESSIONS:
+        # 1013 - Try Again Later
+        await websocket.close(code=1013)
+        return
+
+    await websocket.accept()
+    session = LiveSession(
+        websocket, format, width, height,
+        jpeg_quality=settings.LIVE_JPEG_QUALITY,
+        refresh_interval=refresh,
+        smoothing=smoothing,
+        max_frame_bytes=settings.LIVE_MAX_FRAME_SIZE
+    )
+    await session.run()
 
 @router.get("/api/mobile/files")
 async def mobile_list_files():
@@ -267,12 +617,53 @@ async def mobile_list_files():
             "error": str(e)
         }
 
+# Durable job queue
+@router.get("/api/queue/status")
+async def queue_status():
+    """Число задач в очереди по состояниям и ближайшие задачи"""
+    queue = video_processor.queue
+    return {
+        "success": True,
+        "data": {
+            "counts": await run_in_threadpool(queue.stats),
+            "queued": await run_in_threadpool(queue.list_jobs, "queued"),
+            "running": await run_in_threadpool(queue.list_jobs, "running")
+        }
+    }
+
+@router.get("/api/queue/jobs/{job_id}")
+async def queue_job_status(job_id: str):
+    """Состояние задачи очереди (SQLite или, при распределенной обработке, Redis - с прогрессом воркера)"""
+    job = await run_in_threadpool(video_processor.queue.get, job_id)
+    if job is None and video_processor.remote_queue is not None:
+        job = await run_in_threadpool(video_processor.remote_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "success": True,
+        "data": job
+    }
+
+@router.get("/api/workers/status")
+async def workers_status():
+    """Очередь распределенной обработки: длина потока, задачи в работе, воркеры"""
+    if video_processor.remote_queue is None:
+        raise HTTPException(status_code=404, detail="Distributed workers are disabled")
+    return {
+        "success": True,
+        "data": await run_in_threadpool(video_processor.remote_queue.stats)
+    }
+
 # Performance management endpoints
 @router.get("/api/performance/info")
 async def get_performance_info_endpoint():
     """Получение информации о настройках производительности"""
     try:
-        info = get_performance_info()
+        info = dict(
+            get_performance_info(),
+            lanes=video_processor.lane_stats(),
+            runtime_model=await run_in_threadpool(video_processor.runtime_model.stats)
+        )
         return {
             "success": True,
             "data": info
@@ -291,7 +682,8 @@ async def configure_performance_endpoint(
     video_quality: int = None,
     use_gpu: bool = None,
     enable_ffmpeg_optimization: bool = None,
-    video_codec: str = None
+    video_codec: str = None,
+    job_memory_budget_mb: int = None
 ):
     """Настройка параметров производительности"""
     try:
@@ -301,7 +693,8 @@ async def configure_performance_endpoint(
             video_quality=video_quality,
             use_gpu=use_gpu,
             enable_ffmpeg_optimization=enable_ffmpeg_optimization,
-            video_codec=video_codec
+            video_codec=video_codec,
+            job_memory_budget_mb=job_memory_budget_mb
         )
         
         return {
@@ -35,6 +35,92 @@ class Settings:
     # File upload settings
     MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", 500 * 1024 * 1024))  # 500MB
     UPLOAD_TIMEOUT: int = int(os.getenv("UPLOAD_TIMEOUT", 300))  # 5 minutes
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))  # 8MB
+    PROGRESSIVE_ANALYSIS: bool = os.getenv("PROGRESSIVE_ANALYSIS", "True").lower() == "true"
+    MAX_UPLOAD_CHUNK_SIZE: int = int(os.getenv("MAX_UPLOAD_CHUNK_SIZE", 64 * 1024 * 1024))  # 64MB
+
+    # Storage settings
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "uploads")
+    OUTPUT_DIR: str = os.getenv("OUTPUT_DIR", "outputs")
+    OUTPUT_TTL_HOURS: int = int(os.getenv("OUTPUT_TTL_HOURS", 24))
+    OUTPUT_MAX_SIZE: int = int(os.getenv("OUTPUT_MAX_SIZE", 5 * 1024 * 1024 * 1024))  # 5GB
+    WORKSPACE_TTL_HOURS: int = int(os.getenv("WORKSPACE_TTL_HOURS", 6))
+    ANALYSIS_CACHE_DIR: str = os.getenv("ANALYSIS_CACHE_DIR", "cache/analysis")
+    ANALYSIS_CACHE_MAX_SIZE: int = int(os.getenv("ANALYSIS_CACHE_MAX_SIZE", 256 * 1024 * 1024))  # 256MB
+    JANITOR_INTERVAL: int = int(os.getenv("JANITOR_INTERVAL", 300))  # 5 minutes
+
+    # Review render (быстрая уменьшенная копия, полное разрешение - при скачивании)
+    REVIEW_MAX_DIMENSION: int = int(os.getenv("REVIEW_MAX_DIMENSION", 720))
+
+    # Streaming output (фрагментированный MP4 во время обработки)
+    STREAM_CHUNK_SIZE: int = int(os.getenv("STREAM_CHUNK_SIZE", 256 * 1024))  # 256KB
+    STREAM_POLL_INTERVAL: float = float(os.getenv("STREAM_POLL_INTERVAL", 0.25))  # секунды
+
+    # HLS packaging
+    HLS_RENDITIONS: str = os.getenv("HLS_RENDITIONS", "1080:5000k,720:2800k,360:800k")  # высота:битрейт
+    HLS_URL_PREFIX: str = os.getenv("HLS_URL_PREFIX", "/hls")  # отдается nginx из OUTPUT_DIR
+
+    # Multi-variant rendering
+    MAX_VARIANTS: int = int(os.getenv("MAX_VARIANTS", 4))  # вариантов за один проход декодирования
+
+    # Frame preview
+    PREVIEW_CACHE_SIZE: int = int(os.getenv("PREVIEW_CACHE_SIZE", 256))  # кадров в LRU
+    PREVIEW_MAX_SESSIONS: int = int(os.getenv("PREVIEW_MAX_SESSIONS", 4))  # открытых декодеров
+    PREVIEW_JPEG_QUALITY: int = int(os.getenv("PREVIEW_JPEG_QUALITY", 80))
+    PREVIEW_MAX_WIDTH: int = int(os.getenv("PREVIEW_MAX_WIDTH", 1920))
+
+    # Live correction (WebSocket)
+    LIVE_MAX_SESSIONS: int = int(os.getenv("LIVE_MAX_SESSIONS", 4))
+    LIVE_REFRESH_FRAMES: int = int(os.getenv("LIVE_REFRESH_FRAMES", 15))  # пересчет фильтра раз в N кадров
+    LIVE_SMOOTHING: float = float(os.getenv("LIVE_SMOOTHING", 0.2))
+    LIVE_JPEG_QUALITY: int = int(os.getenv("LIVE_JPEG_QUALITY", 75))
+    LIVE_MAX_FRAME_SIZE: int = int(os.getenv("LIVE_MAX_FRAME_SIZE", 8 * 1024 * 1024))  # 8MB
+
+    # Concurrency
+    MAX_CONCURRENT_JOBS: int = int(os.getenv("MAX_CONCURRENT_JOBS", 2))
+
+    # Thread budget (потоки OpenCV/BLAS в процессах пула и ffmpeg из одного бюджета узла)
+    THREAD_BUDGET: int = int(os.getenv("THREAD_BUDGET", 0))  # 0 - по числу ядер с учетом квоты cgroup
+    THREAD_BUDGET_MAIN: int = int(os.getenv("THREAD_BUDGET_MAIN", 0))  # потоков основному процессу и ffmpeg; 0 - остаток после пула (не меньше 1)
+    PIN_WORKERS: bool = os.getenv("PIN_WORKERS", "False").lower() == "true"  # привязка процессов пула к ядрам
+
+    # Frame pool (процессы пула кадров создаются и прогреваются при старте)
+    WORKER_POOL_MIN: int = int(os.getenv("WORKER_POOL_MIN", 1))  # прогретых процессов в простое
+    WORKER_IDLE_TIMEOUT: float = float(os.getenv("WORKER_IDLE_TIMEOUT", 300))  # секунды до сжатия пула
+    WORKER_POOL_INTERACTIVE_RESERVED: int = int(os.getenv("WORKER_POOL_INTERACTIVE_RESERVED", 1))  # процессов только для анализа по запросу
+
+    # Cost-aware admission (стоимость задачи - пиксель-кадры: ширина x высота x кадры)
+    NODE_COST_BUDGET: int = int(os.getenv("NODE_COST_BUDGET", 1920 * 1080 * 30 * 600))  # 10 минут 1080p30 одновременно
+    MAX_QUEUED_COST: int = int(os.getenv("MAX_QUEUED_COST", 1920 * 1080 * 30 * 2400))  # дороже - 429
+    IMAGE_JOB_COST: int = int(os.getenv("IMAGE_JOB_COST", 4096 * 3072))  # фиксированная стоимость изображения
+    SCHEDULER_AGING_RATE: float = float(os.getenv("SCHEDULER_AGING_RATE", 1920 * 1080 * 30))  # пиксель-кадров в секунду ожидания
+    SCHEDULER_THROUGHPUT: float = float(os.getenv("SCHEDULER_THROUGHPUT", 1920 * 1080 * 30))  # начальная оценка для Retry-After
+
+    # Interactive lane (изображения, предпросмотр, анализ) - отдельно от рендеров видео
+    INTERACTIVE_MAX_CONCURRENT: int = int(os.getenv("INTERACTIVE_MAX_CONCURRENT", 4))
+    INTERACTIVE_COST_BUDGET: int = int(os.getenv("INTERACTIVE_COST_BUDGET", 4096 * 3072 * 8))
+    INTERACTIVE_MAX_QUEUED_COST: int = int(os.getenv("INTERACTIVE_MAX_QUEUED_COST", 4096 * 3072 * 64))
+
+    # Durable job queue (SQLite WAL, общая для сервера и воркеров)
+    QUEUE_DB_PATH: str = os.getenv("QUEUE_DB_PATH", "data/queue.db")
+    QUEUE_LEASE_SECONDS: int = int(os.getenv("QUEUE_LEASE_SECONDS", 60))  # аренда задачи без heartbeat
+    QUEUE_MAX_ATTEMPTS: int = int(os.getenv("QUEUE_MAX_ATTEMPTS", 3))
+    QUEUE_RETRY_BACKOFF: float = float(os.getenv("QUEUE_RETRY_BACKOFF", 5))  # секунды, удваивается с каждой попыткой
+    QUEUE_RETENTION_HOURS: int = int(os.getenv("QUEUE_RETENTION_HOURS", 168))  # 7 days
+
+    # Job runtime prediction (статистика выполненных задач и прогноз длительности)
+    JOB_STATS_DB_PATH: str = os.getenv("JOB_STATS_DB_PATH", "data/job_stats.db")
+    ETA_MIN_SAMPLES: int = int(os.getenv("ETA_MIN_SAMPLES", 5))  # задач в группе для регрессии
+    ETA_WINDOW: int = int(os.getenv("ETA_WINDOW", 200))  # последних задач в выборке
+    ETA_MAX_SAMPLES: int = int(os.getenv("ETA_MAX_SAMPLES", 5000))  # хранится задач
+
+    # Distributed workers (Redis Streams, python -m src.services.worker)
+    DISTRIBUTED_WORKERS: bool = os.getenv("DISTRIBUTED_WORKERS", "False").lower() == "true"
+    REDIS_QUEUE_PREFIX: str = os.getenv("REDIS_QUEUE_PREFIX", "dcc")
+    REDIS_VISIBILITY_TIMEOUT: int = int(os.getenv("REDIS_VISIBILITY_TIMEOUT", 120))  # секунды без heartbeat
+    REDIS_RESULT_TTL_HOURS: int = int(os.getenv("REDIS_RESULT_TTL_HOURS", 24))
+    REMOTE_JOB_TIMEOUT: int = int(os.getenv("REMOTE_JOB_TIMEOUT", 3600))  # ожидание результата воркера
+    REMOTE_POLL_INTERVAL: float = float(os.getenv("REMOTE_POLL_INTERVAL", 0.5))
 
 settings = Settings()
 
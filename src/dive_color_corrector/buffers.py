@@ -0,0 +1,59 @@
+"""
+Буферы между этапами обработки видео, ограниченные в байтах
+
+Очереди, ограниченные числом кадров, держат в 4K в десятки раз больше памяти,
+чем в 720p. Здесь ограничение - сумма размеров элементов: производитель
+(декодер) ждет, пока потребитель не освободит место, поэтому пиковая память
+задачи задается бюджетом и не зависит от разрешения.
+"""
+
+import queue
+import threading
+
+
+class ByteBudget:
+    """Счетчик занятых байтов с ожиданием свободного места
+
+    Элемент больше всего бюджета пропускается, когда буфер пуст, иначе
+    конвейер встал бы навсегда.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max(1, int(max_bytes))
+        self.used = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def fits(self, size):
+        return self.used == 0 or self.used + size <= self.max_bytes
+
+    def acquire(self, size):
+        """Занимает size байтов, дожидаясь места"""
+        with self._cond:
+            while not self.fits(size):
+                self._cond.wait()
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    def release(self, size):
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+
+class ByteBoundedQueue:
+    """Очередь (FIFO) с ограничением суммарного размера элементов в байтах"""
+
+    def __init__(self, max_bytes):
+        self.budget = ByteBudget(max_bytes)
+        self._queue = queue.Queue()
+
+    def put(self, item, size):
+        """Добавляет элемент размером size байтов; блокируется, пока нет места"""
+        self.budget.acquire(size)
+        self._queue.put((item, size))
+
+    def get(self):
+        item, size = self._queue.get()
+        self.budget.release(size)
+        return item
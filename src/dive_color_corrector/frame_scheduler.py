@@ -0,0 +1,397 @@
+"""
+Общий для узла пул процессов для батчей кадров
+
+Раньше каждая задача создавала свой ProcessPoolExecutor (и даже на каждый
+батч), и два видео одновременно занимали вдвое больше ядер, чем есть.
+FrameBatchScheduler владеет одним постоянным пулом размером с число ядер;
+задачи отдают ему батчи, а он раздает свободные процессы задачам по кругу
+с весами (smooth weighted round-robin), так что параллельные видео делят
+пропускную способность честно, а загрузка CPU не выходит за число ядер.
+
+Пул запускается заранее (start): min_workers процессов создаются при старте
+сервиса и прогреваются инициализатором, поэтому первая задача не ждет импорта
+и инициализации OpenCV. Под нагрузкой пул растет до max_workers, а после
+idle_timeout секунд простоя сжимается обратно до min_workers, возвращая память.
+Процессы запускаются через forkserver (spawn, где его нет): в отличие от fork,
+ProcessPoolExecutor тогда создает процесс только когда свободных нет, поэтому
+пул после сжатия действительно состоит из min_workers процессов. Число
+процессов планировщик считает сам - по PID, которые возвращают прогрев и батчи.
+Сервер forkserver заранее импортирует только модули обработки, а не __main__:
+скрипт запуска, который процессы пула выполняют как __mp_main__, не должен
+создавать приложение (см. app.py).
+
+reserved_workers процессов оставлены интерактивным задачам (анализ по запросу
+клиента): пакетные рендеры занимают не больше max_workers - reserved_workers
+процессов, поэтому анализ не ждет, пока освободится пул, занятый рендерами.
+"""
+
+import os
+import time
+import logging
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .resources import get_governor
+from .threads import get_thread_budget, init_pool_worker
+
+logger = logging.getLogger(__name__)
+
+# Простой пула (секунды), после которого лишние процессы завершаются
+IDLE_TIMEOUT = 300.0
+# Как часто проверять простой пула (секунды)
+REAP_INTERVAL = 5.0
+# Способ запуска процессов пула: с fork пул создает все max_workers процессов сразу
+START_METHOD = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+
+
+def _init_worker(thread_args, warmup):
+    """Инициализатор процесса пула: бюджет потоков и прогрев (импорты, ядра обработки)"""
+    init_pool_worker(*thread_args)
+    if warmup is not None:
+        try:
+            warmup()
+        except Exception as e:
+            logger.warning(f"Worker {os.getpid()} warm-up failed: {e}")
+
+
+def _ping():
+    """Пустая задача: заставляет пул создать процесс заранее"""
+    return os.getpid()
+
+
+def _tracked(fn, args):
+    """Выполняет батч в процессе пула и возвращает (PID, результат)"""
+    return os.getpid(), fn(*args)
+
+
+class FrameJob:
+    """Очередь батчей одной задачи в общем планировщике"""
+
+    def __init__(self, scheduler, name, weight, interactive=False):
+        self.scheduler = scheduler
+        self.name = name
+        self.weight = max(1, int(weight))
+        self.interactive = interactive
+        self.current_weight = 0
+        self.pending = deque()
+        self.submitted = 0
+        self.completed = 0
+
+    def submit(self, fn, *args):
+        """Ставит батч в очередь планировщика; возвращает Future с результатом fn(*args)"""
+        return self.scheduler._submit(self, fn, args)
+
+    def map(self, fn, items):
+        """Как Executor.map: результаты в порядке items"""
+        futures = [self.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.scheduler._close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameBatchScheduler:
+    """Планировщик батчей кадров поверх одного постоянного пула процессов"""
+
+    def __init__(self, max_workers=None, min_workers=0, idle_timeout=IDLE_TIMEOUT, reserved_workers=0):
+        # По умолчанию - по квоте CPU и лимиту памяти контейнера; без явного
+        # max_workers размер пересчитывается при каждом пересоздании пула
+        self.requested_workers = max_workers
+        self.max_workers = max_workers or self._default_size()
+        self.idle_timeout = idle_timeout
+        self._limits = (min_workers, reserved_workers)
+        self._apply_limits()
+        self.warmup = None
+        self.scale_downs = 0
+        self._executor = None
+        self._jobs = []
+        self._in_flight = 0
+        # Батчи пакетных (не интерактивных) задач в работе
+        self._batch_in_flight = 0
+        # PID процессов текущего пула, которые уже выполнили прогрев или батч
+        self._pids = set()
+        self._last_active = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper = None
+
+    @staticmethod
+    def _default_size():
+        """Процессов на потоки пула из бюджета узла, в пределах квоты CPU и памяти"""
+        return get_governor().pool_size(get_thread_budget().pool_threads())
+
+    def _apply_limits(self):
+        """Прогретые и зарезервированные процессы в пределах текущего max_workers
+
+        Заданные значения хранятся в self._limits, поэтому после уменьшения
+        пула и его роста обратно они восстанавливаются. Хотя бы один процесс
+        всегда доступен пакетным задачам.
+        """
+        min_workers, reserved_workers = self._limits
+        self.min_workers = min(max(0, int(min_workers)), self.max_workers)
+        self.reserved_workers = min(max(0, int(reserved_workers)), self.max_workers - 1)
+
+    def _resize(self):
+        """Размер нового пула по текущей памяти контейнера (под self._lock)"""
+        if self.requested_workers:
+            return
+        size = self._default_size()
+        if size != self.max_workers:
+            logger.info(f"Frame batch pool resized: {self.max_workers} -> {size} processes")
+            self.max_workers = size
+            self._apply_limits()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._resize()
+            # Потоки OpenCV/BLAS в процессах пула - из общего бюджета потоков узла;
+            # initargs передаются процессам через pickle, поэтому warmup - функция уровня модуля
+            context = mp.get_context(START_METHOD)
+            if START_METHOD == "forkserver":
+                # По умолчанию сервер импортирует __main__ (app.py с глобальным
+                # VideoProcessor) - ему нужны только модули обработки
+                modules = [__name__] + ([self.warmup.__module__] if self.warmup is not None else [])
+                context.set_forkserver_preload(modules)
+            _, thread_args = get_thread_budget().pool_initializer(self.max_workers, context)
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                                 initializer=_init_worker, initargs=(thread_args, self.warmup))
+            self._pids = set()
+            logger.info(f"Frame batch pool started (up to {self.max_workers} processes, {START_METHOD})")
+        return self._executor
+
+    def _prewarm(self):
+        """Создает min_workers процессов (под self._lock): пока ни один не свободен,
+        каждая новая задача запускает новый процесс
+
+        Возвращает [(пул, future)]: колбэки, учитывающие PID, вешает
+        _watch_pings после освобождения self._lock.
+        """
+        executor = self._get_executor()
+        return [(executor, executor.submit(_ping)) for _ in range(self.min_workers)]
+
+    def _watch_pings(self, pings):
+        for executor, future in pings:
+            future.add_done_callback(lambda f, executor=executor: self._record_pid(executor, f))
+
+    def _record_pid(self, executor, future):
+        """Учитывает процесс пула по PID (без self._lock у вызывающего)"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            # Ответ от пула, который уже заменен, не учитывается
+            if executor is self._executor:
+                self._pids.add(future.result())
+
+    def start(self, min_workers=None, idle_timeout=None, warmup=None, reserved_workers=None):
+        """Запускает и прогревает пул заранее и следит за его простоем
+
+        warmup - функция без аргументов (уровня модуля), которую каждый новый
+        процесс вызывает при старте, чтобы заранее загрузить и прогреть код обработки.
+        reserved_workers - процессов, недоступных пакетным задачам.
+        """
+        with self._lock:
+            if min_workers is not None:
+                self._limits = (min_workers, self._limits[1])
+            if reserved_workers is not None:
+                self._limits = (self._limits[0], reserved_workers)
+            self._apply_limits()
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            self.warmup = warmup
+            if self._executor is not None and self._in_flight == 0:
+                # Пул создан до start без прогрева - пересоздаем с инициализатором
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            pings = self._prewarm()
+            self._last_active = time.monotonic()
+            if self._reaper is None:
+                self._stop.clear()
+                self._reaper = threading.Thread(target=self._reap_loop, name="frame-pool-reaper", daemon=True)
+                self._reaper.start()
+        self._watch_pings(pings)
+        logger.info(f"Frame batch pool prewarmed: {self.min_workers} of {self.max_workers} processes, "
+                    f"idle timeout {self.idle_timeout}s")
+
+    def _reap_loop(self):
+        while not self._stop.wait(min(REAP_INTERVAL, self.idle_timeout)):
+            try:
+                self.scale_down_if_idle()
+            except Exception as e:
+                logger.error(f"Frame batch pool reaper error: {e}")
+
+    def scale_down_if_idle(self):
+        """Сжимает пул до min_workers, если он простаивает дольше idle_timeout
+
+        ProcessPoolExecutor не умеет завершать отдельные процессы, поэтому
+        простаивающий пул заменяется новым с min_workers прогретыми процессами.
+        """
+        with self._lock:
+            idle = time.monotonic() - self._last_active
+            if (self._executor is None or self._in_flight or any(job.pending for job in self._jobs)
+                    or idle < self.idle_timeout):
+                return False
+            processes = len(self._pids)
+            if processes <= self.min_workers:
+                return False
+            executor = self._executor
+            self._executor = None
+            self.scale_downs += 1
+            pings = self._prewarm() if self.min_workers else []
+        self._watch_pings(pings)
+        executor.shutdown(wait=True)
+        logger.info(f"Frame batch pool idle for {idle:.0f}s: scaled down from {processes} "
+                    f"to {self.min_workers} processes")
+        return True
+
+    def shutdown(self):
+        """Останавливает наблюдение за простоем и завершает процессы пула"""
+        self._stop.set()
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._reaper = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def job(self, name="job", weight=1, interactive=False):
+        """Регистрирует задачу; вес - доля процессов при конкуренции с другими задачами
+
+        interactive - задача может занимать процессы, оставленные в резерве (reserved_workers).
+        """
+        job = FrameJob(self, name, weight, interactive)
+        with self._lock:
+            self._jobs.append(job)
+        return job
+
+    def _submit(self, job, fn, args):
+        future = Future()
+        with self._lock:
+            job.pending.append((fn, args, future))
+            job.submitted += 1
+            started = self._dispatch()
+        self._watch(started)
+        return future
+
+    def _close(self, job):
+        with self._lock:
+            if job in self._jobs:
+                self._jobs.remove(job)
+            while job.pending:
+                _, _, future = job.pending.popleft()
+                future.cancel()
+
+    def _next_job(self):
+        """Smooth weighted round-robin среди задач с ожидающими батчами"""
+        active = [job for job in self._jobs if job.pending]
+        if self._batch_in_flight >= self.max_workers - self.reserved_workers:
+            # Пакетные задачи заняли свою долю пула - остаток только интерактивным
+            active = [job for job in active if job.interactive]
+        if not active:
+            return None
+        total = 0
+        for job in active:
+            job.current_weight += job.weight
+            total += job.weight
+        chosen = max(active, key=lambda j: j.current_weight)
+        chosen.current_weight -= total
+        return chosen
+
+    def _dispatch(self):
+        """Отдает батчи в пул, пока есть свободные процессы (вызывается под self._lock)
+
+        Возвращает [(задача, future, пул, future пула)]: колбэки завершения вешает
+        _watch после освобождения self._lock - future, уже завершенный к этому
+        моменту, вызывает колбэк сразу, а _on_done снова берет self._lock.
+        """
+        started = []
+        while self._in_flight < self.max_workers:
+            job = self._next_job()
+            if job is None:
+                break
+            fn, args, future = job.pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                executor = self._get_executor()
+                pool_future = executor.submit(_tracked, fn, args)
+            except BrokenProcessPool as e:
+                # Процесс пула упал - пересоздаем пул для следующих батчей
+                logger.error(f"Frame batch pool is broken, restarting: {str(e)}")
+                self._executor = None
+                future.set_exception(e)
+                continue
+            self._in_flight += 1
+            if not job.interactive:
+                self._batch_in_flight += 1
+            self._last_active = time.monotonic()
+            started.append((job, future, executor, pool_future))
+        return started
+
+    def _watch(self, started):
+        """Вешает колбэки завершения на отданные в пул батчи (без self._lock)"""
+        for job, future, executor, pool_future in started:
+            pool_future.add_done_callback(
+                lambda f, job=job, future=future, executor=executor: self._on_done(job, future, executor, f)
+            )
+
+    def _on_done(self, job, future, executor, pool_future):
+        failed = pool_future.cancelled() or pool_future.exception() is not None
+        with self._lock:
+            self._in_flight -= 1
+            if not job.interactive:
+                self._batch_in_flight -= 1
+            job.completed += 1
+            self._last_active = time.monotonic()
+            if not failed and executor is self._executor:
+                self._pids.add(pool_future.result()[0])
+            started = self._dispatch()
+        self._watch(started)
+        try:
+            future.set_result(pool_future.result()[1])
+        except BaseException as e:
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    self._executor = None
+            future.set_exception(e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "min_workers": self.min_workers,
+                "reserved_workers": self.reserved_workers,
+                "processes": len(self._pids) if self._executor is not None else 0,
+                "start_method": START_METHOD,
+                "idle_timeout": self.idle_timeout,
+                "idle_seconds": round(time.monotonic() - self._last_active, 1),
+                "scale_downs": self.scale_downs,
+                "prewarmed": self.warmup is not None,
+                "in_flight": self._in_flight,
+                "batch_in_flight": self._batch_in_flight,
+                "jobs": [
+                    {"name": j.name, "weight": j.weight, "interactive": j.interactive, "pending": len(j.pending),
+                     "submitted": j.submitted, "completed": j.completed}
+                    for j in self._jobs
+                ]
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_frame_scheduler():
+    """Общий планировщик узла (создается при первом обращении)"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FrameBatchScheduler()
+        return _scheduler
@@ -0,0 +1,68 @@
+"""
+Коррекция живого видеопотока (предпросмотр камеры) кадр за кадром
+
+Анализ (get_filter_matrix) выполняется не на каждом кадре, а раз в N кадров
+по уменьшенной копии; между обновлениями используется сглаженная оценка
+фильтра. Сам фильтр применяется одним вызовом cv2.transform прямо к BGR-кадру:
+без перевода в RGB и без промежуточных float-массивов.
+"""
+
+import cv2
+import numpy as np
+
+from .mobile_correct import get_filter_matrix
+
+# Размер кадра для обновления оценки фильтра (get_filter_matrix все равно сжимает до 256x256)
+ANALYSIS_SIZE = (256, 256)
+
+
+def filter_to_transform(filt):
+    """Матрица 3x4 для cv2.transform, эквивалентная apply_filter_cpu, но для BGR-кадра
+
+    Фильтр задан для RGB: R' = R*f0 + G*f1 + B*f2 + f4*255, G' = G*f6 + f9*255,
+    B' = B*f12 + f14*255. В BGR порядок каналов обратный.
+    """
+    f = np.asarray(filt, dtype=np.float32)
+    return np.array([
+        [f[12], 0, 0, f[14] * 255],
+        [0, f[6], 0, f[9] * 255],
+        [f[2], f[1], f[0], f[4] * 255]
+    ], dtype=np.float32)
+
+
+def apply_transform(frame, transform):
+    """Применяет фильтр к BGR-кадру (uint8, с насыщением)"""
+    return cv2.transform(frame, transform)
+
+
+class LiveCorrector:
+    """Скользящая оценка фильтра для потока кадров
+
+    refresh_interval - каждые сколько кадров пересчитывать фильтр;
+    smoothing - вес нового измерения в экспоненциальном сглаживании (0..1],
+    чтобы коррекция не «мигала» при смене сцены.
+    """
+
+    def __init__(self, refresh_interval=15, smoothing=0.2):
+        self.refresh_interval = max(1, int(refresh_interval))
+        self.smoothing = min(max(float(smoothing), 0.01), 1.0)
+        self.filter = None
+        self.transform = None
+        self.frames = 0
+
+    def update_filter(self, frame):
+        """Пересчитывает фильтр по кадру (BGR) и сглаживает с текущей оценкой"""
+        small = cv2.resize(frame, ANALYSIS_SIZE, interpolation=cv2.INTER_AREA)
+        measured = get_filter_matrix(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if self.filter is None:
+            self.filter = measured
+        else:
+            self.filter = self.smoothing * measured + (1 - self.smoothing) * self.filter
+        self.transform = filter_to_transform(self.filter)
+
+    def process(self, frame):
+        """Корректирует очередной кадр (BGR)"""
+        if self.frames % self.refresh_interval == 0:
+            self.update_filter(frame)
+        self.frames += 1
+        return apply_transform(frame, self.transform)
@@ -0,0 +1,41 @@
+"""
+Экспорт матриц фильтра в 3D LUT (.cube) для применения коррекции на клиенте
+"""
+
+import numpy as np
+
+DEFAULT_LUT_SIZE = 17
+MAX_LUT_SIZE = 65
+
+
+def filter_to_lut(filt, size=DEFAULT_LUT_SIZE):
+    """Строит таблицу size^3 x 3 (значения 0..1) в порядке .cube: быстрее всего меняется R"""
+    size = max(2, min(int(size), MAX_LUT_SIZE))
+    levels = np.linspace(0, 255, size, dtype=np.float32)
+    b, g, r = np.meshgrid(levels, levels, levels, indexing='ij')
+    grid = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=-1).reshape(-1, 1, 3)
+
+    # Тот же расчет, что и в apply_filter_cpu, но без округления до uint8
+    filt = np.asarray(filt, dtype=np.float32)
+    corrected = np.empty_like(grid)
+    corrected[..., 0] = grid[..., 0] * filt[0] + grid[..., 1] * filt[1] + grid[..., 2] * filt[2] + filt[4] * 255
+    corrected[..., 1] = grid[..., 1] * filt[6] + filt[9] * 255
+    corrected[..., 2] = grid[..., 2] * filt[12] + filt[14] * 255
+    np.clip(corrected, 0, 255, out=corrected)
+
+    return corrected.reshape(-1, 3) / 255.0
+
+
+def filter_to_cube(filt, size=DEFAULT_LUT_SIZE, title="Dive Color Correction"):
+    """Возвращает текст 3D LUT в формате Adobe/Resolve .cube"""
+    table = filter_to_lut(filt, size)
+    lut_size = round(len(table) ** (1 / 3))
+    lines = [
+        f'TITLE "{title}"',
+        f"LUT_3D_SIZE {lut_size}",
+        "DOMAIN_MIN 0.0 0.0 0.0",
+        "DOMAIN_MAX 1.0 1.0 1.0"
+    ]
+    lines.extend(f"{r:.6f} {g:.6f} {b:.6f}" for r, g, b in table)
+    return "\n".join(lines) + "\n"
+
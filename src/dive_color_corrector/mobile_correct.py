@@ -4,9 +4,14 @@ import math
 import logging
 import subprocess
 import json
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import multiprocessing as mp
 from functools import partial
+from .writers import FFmpegPipeWriter, FFmpegHLSWriter
+from .frame_scheduler import get_frame_scheduler
+from .resources import get_governor, effective_cpu_count
+from .threads import get_thread_budget
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +50,9 @@ MAX_HUE_SHIFT = 120
 BLUE_MAGIC_VALUE = 1.2
 SAMPLE_SECONDS = 1.0  # Берем кадры каждые 1.0 секунду для ускорения анализа
 
+# Версия алгоритма коррекции: увеличивать при любом изменении, влияющем на результат
+ENGINE_VERSION = "1.0.0"
+
 # Параметры производительности
 BATCH_SIZE = 4  # Минимальный размер батча для простоты
 MAX_PROCESSES = 2  # Минимальное количество процессов
@@ -52,12 +60,13 @@ VIDEO_QUALITY = 100  # Максимальное качество (без сжа
 USE_GPU = True  # Использовать GPU если доступен
 ENABLE_FFMPEG_OPTIMIZATION = False  # Отключить постобработку для скорости
 VIDEO_CODEC = 'mp4v'  # Кодек без потерь для сохранения качества
+JOB_MEMORY_BUDGET_MB = 256  # Буферы кадров одной задачи (декодер -> обработка -> запись)
 
 
 # Загружаем конфигурацию при импорте модуля
 def _load_performance_config():
     """Загружает конфигурацию производительности"""
-    global BATCH_SIZE, MAX_PROCESSES, VIDEO_QUALITY, USE_GPU, ENABLE_FFMPEG_OPTIMIZATION, VIDEO_CODEC
+    global BATCH_SIZE, MAX_PROCESSES, VIDEO_QUALITY, USE_GPU, ENABLE_FFMPEG_OPTIMIZATION, VIDEO_CODEC, JOB_MEMORY_BUDGET_MB
     
     try:
         import os
@@ -75,11 +84,12 @@ def _load_performance_config():
             USE_GPU = config.get('use_gpu', USE_GPU) and GPU_AVAILABLE
             ENABLE_FFMPEG_OPTIMIZATION = config.get('enable_ffmpeg_optimization', ENABLE_FFMPEG_OPTIMIZATION)
             VIDEO_CODEC = config.get('video_codec', VIDEO_CODEC)
+            JOB_MEMORY_BUDGET_MB = config.get('job_memory_budget_mb', JOB_MEMORY_BUDGET_MB)
             
             logger.info(f"Loaded performance config: batch_size={BATCH_SIZE}, max_processes={MAX_PROCESSES}, video_quality={VIDEO_QUALITY}, use_gpu={USE_GPU}")
         else:
-            # Применяем оптимальную конфигурацию для системы
-            cpu_count = mp.cpu_count()
+            # Применяем оптимальную конфигурацию для системы (ядра - с учетом квоты cgroup)
+            cpu_count = effective_cpu_count()
             if cpu_count >= 8:
                 BATCH_SIZE = 64
                 MAX_PROCESSES = 6
@@ -115,6 +125,7 @@ def _save_performance_config():
             "max_processes": MAX_PROCESSES,
             "video_quality": VIDEO_QUALITY,
             "use_gpu": USE_GPU,
+            "job_memory_budget_mb": JOB_MEMORY_BUDGET_MB,
             "auto_configure": False
         }
         
@@ -126,9 +137,10 @@ def _save_performance_config():
     except Exception as e:
         logger.error(f"Error saving performance config: {e}")
 
-def configure_performance(batch_size=None, max_processes=None, video_quality=None, use_gpu=None, enable_ffmpeg_optimization=None, video_codec=None):
+def configure_performance(batch_size=None, max_processes=None, video_quality=None, use_gpu=None, enable_ffmpeg_optimization=None, video_codec=None,
+                          job_memory_budget_mb=None):
     """Настраивает параметры производительности"""
-    global BATCH_SIZE, MAX_PROCESSES, VIDEO_QUALITY, USE_GPU, ENABLE_FFMPEG_OPTIMIZATION, VIDEO_CODEC
+    global BATCH_SIZE, MAX_PROCESSES, VIDEO_QUALITY, USE_GPU, ENABLE_FFMPEG_OPTIMIZATION, VIDEO_CODEC, JOB_MEMORY_BUDGET_MB
     
     config_changed = False
     
@@ -138,7 +150,7 @@ def configure_performance(batch_size=None, max_processes=None, video_quality=Non
         config_changed = True
     
     if max_processes is not None:
-        MAX_PROCESSES = max(1, min(max_processes, mp.cpu_count()))
+        MAX_PROCESSES = max(1, min(max_processes, effective_cpu_count()))
         logger.info(f"Max processes set to: {MAX_PROCESSES}")
         config_changed = True
     
@@ -166,6 +178,11 @@ def configure_performance(batch_size=None, max_processes=None, video_quality=Non
         else:
             logger.warning(f"Invalid codec: {video_codec}. Valid options: {valid_codecs}")
     
+    if job_memory_budget_mb is not None:
+        JOB_MEMORY_BUDGET_MB = max(16, job_memory_budget_mb)  # Не меньше 16MB
+        logger.info(f"Job memory budget set to: {JOB_MEMORY_BUDGET_MB}MB")
+        config_changed = True
+    
     # Сохраняем конфигурацию в файл если что-то изменилось
     if config_changed:
         _save_performance_config()
@@ -179,9 +196,38 @@ def get_performance_info():
         "use_gpu": USE_GPU,
         "gpu_available": GPU_AVAILABLE,
         "gpu_type": GPU_TYPE,
-        "cpu_count": mp.cpu_count(),
+        "cpu_count": effective_cpu_count(),
+        "host_cpu_count": mp.cpu_count(),
         "enable_ffmpeg_optimization": ENABLE_FFMPEG_OPTIMIZATION,
-        "video_codec": VIDEO_CODEC
+        "video_codec": VIDEO_CODEC,
+        "job_memory_budget_mb": JOB_MEMORY_BUDGET_MB,
+        "frame_pool": get_frame_scheduler().stats(),
+        "resources": get_governor().stats(),
+        "threads": get_thread_budget().stats()
+    }
+
+def get_engine_mode():
+    """Движок обработки кадров: тип GPU или cpu"""
+    return GPU_TYPE.lower() if USE_GPU and GPU_AVAILABLE and GPU_TYPE else "cpu"
+
+def get_analysis_params():
+    """Возвращает параметры, влияющие на результат анализа (для ключей кеша)"""
+    return {
+        "sample_seconds": SAMPLE_SECONDS,
+        "threshold_ratio": THRESHOLD_RATIO,
+        "min_avg_red": MIN_AVG_RED,
+        "max_hue_shift": MAX_HUE_SHIFT,
+        "blue_magic_value": BLUE_MAGIC_VALUE,
+        "engine_version": ENGINE_VERSION
+    }
+
+def get_processing_params():
+    """Возвращает параметры, влияющие на результат обработки (для ключей кеша)"""
+    return {
+        **get_analysis_params(),
+        "video_codec": VIDEO_CODEC,
+        "video_quality": VIDEO_QUALITY,
+        "enable_ffmpeg_optimization": ENABLE_FFMPEG_OPTIMIZATION
     }
 
 def get_video_bitrate(video_path):
@@ -579,6 +625,32 @@ def correct_image_mobile(input_path, output_path):
             "message": f"Error processing image: {str(e)}"
         }
 
+def analyze_image_mobile(input_path):
+    """Считает матрицу фильтра для изображения без применения коррекции"""
+    mat = cv2.imread(input_path)
+    if mat is None:
+        raise ValueError(f"Не удалось загрузить изображение: {input_path}")
+    
+    rgb_mat = cv2.cvtColor(mat, cv2.COLOR_BGR2RGB)
+    return {
+        "width": int(mat.shape[1]),
+        "height": int(mat.shape[0]),
+        "filter": get_filter_matrix(rgb_mat)
+    }
+
+def get_filter_timeline(video_data):
+    """Возвращает матрицы фильтра с метками времени для применения на клиенте"""
+    fps = video_data["fps"] or 1
+    return [
+        {
+            "frame": int(frame_number),
+            # Номера кадров в анализе начинаются с 1
+            "timestamp": round((frame_number - 1) / fps, 6),
+            "matrix": [float(v) for v in filter_matrix]
+        }
+        for frame_number, filter_matrix in zip(video_data["filter_indices"], video_data["filters"])
+    ]
+
 def _process_frame_for_analysis(args):
     """Обрабатывает один кадр для анализа (для многопроцессной обработки)"""
     frame_data, frame_number, rotation_angle = args
@@ -598,8 +670,118 @@ def _process_frame_for_analysis(args):
         logger.warning(f"Ошибка при обработке кадра {frame_number}: {str(e)}")
         return None
 
-def analyze_video_mobile(input_video_path, output_video_path, progress_callback=None):
-    """Анализирует видео для мобильного API (оптимизированная версия)"""
+def get_video_frame_count(video_path, cap):
+    """Количество кадров: точнее через ffprobe, иначе из метаданных OpenCV"""
+    try:
+        cmd = ['ffprobe', '-v', 'quiet', '-select_streams', 'v:0', '-show_entries', 'stream=nb_frames', '-of', 'csv=p=0', video_path]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        if result.returncode == 0 and result.stdout.strip():
+            frame_count = int(result.stdout.strip())
+            logger.info(f"Frame count from ffprobe: {frame_count}")
+            return frame_count
+        frame_count = math.ceil(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        logger.warning(f"Using OpenCV frame count: {frame_count}")
+    except Exception as e:
+        frame_count = math.ceil(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        logger.warning(f"Error getting frame count from ffprobe: {e}, using OpenCV: {frame_count}")
+    return frame_count
+
+def probe_video_mobile(video_path):
+    """Быстро получает параметры видео без декодирования кадров"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Не удалось открыть видео: {video_path}")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_count = get_video_frame_count(video_path, cap)
+    finally:
+        cap.release()
+    
+    video_bitrate, audio_bitrate = get_video_bitrate(video_path)
+    return {
+        "fps": fps,
+        "frame_count": frame_count,
+        "width": width,
+        "height": height,
+        "rotation_angle": get_video_rotation(video_path),
+        "original_bitrate": video_bitrate,
+        "original_audio_bitrate": audio_bitrate
+    }
+
+# Допустимое расхождение длительности прокси и оригинала
+PROXY_DURATION_TOLERANCE = 0.05
+
+def map_proxy_analysis(proxy_data, input_video_path, output_video_path):
+    """Переносит анализ уменьшенной копии (прокси) на оригинал по меткам времени
+
+    Кадр прокси с номером n (с 1) показывается в момент (n - 1) / fps_прокси;
+    ему соответствует ближайший по времени кадр оригинала.
+    """
+    original = probe_video_mobile(input_video_path)
+    fps = original["fps"]
+    frame_count = original["frame_count"]
+    
+    proxy_duration = proxy_data["frame_count"] / proxy_data["fps"] if proxy_data["fps"] else 0
+    original_duration = frame_count / fps if fps else 0
+    if original_duration and abs(proxy_duration - original_duration) > max(1.0, original_duration * PROXY_DURATION_TOLERANCE):
+        raise ValueError(
+            f"Прокси не соответствует оригиналу: длительность {proxy_duration:.2f}с против {original_duration:.2f}с"
+        )
+    
+    mapped = {}
+    for proxy_frame, filter_matrix in zip(proxy_data["filter_indices"], proxy_data["filters"]):
+        timestamp = (proxy_frame - 1) / proxy_data["fps"]
+        frame_number = min(max(1, int(round(timestamp * fps)) + 1), max(1, frame_count))
+        mapped[frame_number] = filter_matrix
+    
+    filter_indices = sorted(mapped)
+    logger.info(f"Mapped {len(filter_indices)} proxy samples onto original ({fps} fps, {frame_count} frames)")
+    
+    return {
+        "input_video_path": input_video_path,
+        "output_video_path": output_video_path,
+        "fps": fps,
+        "frame_count": frame_count,
+        "filters": np.array([mapped[n] for n in filter_indices]),
+        "filter_indices": filter_indices,
+        "rotation_angle": original["rotation_angle"],
+        "original_bitrate": original["original_bitrate"],
+        "original_audio_bitrate": original["original_audio_bitrate"],
+        "analysis_source": "proxy"
+    }
+
+def get_sample_step(fps):
+    """Шаг (в кадрах) между кадрами, по которым считается матрица фильтра"""
+    return max(1, int(fps * SAMPLE_SECONDS))
+
+def get_frame_range(fps, frame_count, start=None, end=None):
+    """Переводит отрезок [start, end) в секундах в номера кадров (с 1, включительно)"""
+    first = 1
+    last = frame_count
+    if start is not None and start > 0:
+        first = int(round(start * fps)) + 1
+    if end is not None:
+        last = min(frame_count, int(round(end * fps)))
+    if first > last:
+        raise ValueError(f"Пустой отрезок видео: start={start}, end={end}, длительность {frame_count / fps if fps else 0:.2f}с")
+    return first, last
+
+def analyze_video_mobile(input_video_path, output_video_path, progress_callback=None, precomputed_filters=None,
+                         start=None, end=None, priority=1, interactive=False):
+    """Анализирует видео для мобильного API (оптимизированная версия)
+
+    precomputed_filters - {номер кадра: матрица фильтра}, уже посчитанные
+    заранее (например, во время загрузки); такие кадры повторно не анализируются.
+    start, end - анализировать только отрезок (в секундах) с запасом в один шаг
+    семплирования с каждой стороны, чтобы интерполяция на краях была такой же,
+    как при анализе всего файла.
+    priority - вес задачи в общем пуле процессов узла.
+    interactive - анализ по запросу клиента: может занимать процессы пула,
+    оставленные интерактивным задачам.
+    """
+    precomputed_filters = precomputed_filters or {}
     try:
         # Определяем поворот видео и битрейт
         rotation_angle = get_video_rotation(input_video_path)
@@ -610,84 +792,116 @@ def analyze_video_mobile(input_video_path, output_video_path, progress_callback=
             raise ValueError(f"Не удалось открыть видео: {input_video_path}")
             
         fps = cap.get(cv2.CAP_PROP_FPS)
-        # Более точное определение количества кадров через ffprobe
-        try:
-            import subprocess
-            cmd = ['ffprobe', '-v', 'quiet', '-select_streams', 'v:0', '-show_entries', 'stream=nb_frames', '-of', 'csv=p=0', input_video_path]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            if result.returncode == 0 and result.stdout.strip():
-                frame_count = int(result.stdout.strip())
-                logger.info(f"Frame count from ffprobe: {frame_count}")
-            else:
-                frame_count = math.ceil(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                logger.warning(f"Using OpenCV frame count: {frame_count}")
-        except Exception as e:
-            frame_count = math.ceil(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            logger.warning(f"Error getting frame count from ffprobe: {e}, using OpenCV: {frame_count}")
+        frame_count = get_video_frame_count(input_video_path, cap)
         
         logger.info(f"Video info: FPS={fps}, Frame count={frame_count}")
         
-        # Собираем кадры для анализа
-        frames_to_analyze = []
+        # Кадры для анализа отправляются в общий пул процессов по мере
+        # декодирования. В работе - не больше бюджета памяти задачи (в байтах
+        # JPEG), иначе декодер ждет результатов самых старых кадров
+        frame_bytes = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) * cap.get(cv2.CAP_PROP_FRAME_HEIGHT) * 3)
+        budget = get_governor().job_budget(JOB_MEMORY_BUDGET_MB * 1024 * 1024, frame_bytes, MAX_PROCESSES)
+        pending = deque()
+        pending_bytes = 0
+        analysis_results = []
+        samples_submitted = 0
         count = 0
+        sample_step = get_sample_step(fps)
         
-        logger.info("Starting video analysis...")
-        
-        while(cap.isOpened()):
-            ret, frame = cap.read()
-            if not ret:
-                if count >= frame_count:
-                    logger.info(f"Reached expected frame count in analysis: {frame_count}")
-                    break
-                if count >= 1e6:  # Защита от бесконечного цикла
-                    logger.warning(f"Reached maximum frame limit in analysis: {count}")
-                    break
-                logger.warning(f"Failed to read frame {count + 1} in analysis, continuing...")
-                continue
-            
-            count += 1
-
-            # Выбираем кадры для анализа каждые N секунд
-            if count % int(fps * SAMPLE_SECONDS) == 0:
-                # Кодируем кадр в байты для передачи в процессы
-                _, encoded_frame = cv2.imencode('.jpg', frame)
-                frames_to_analyze.append((encoded_frame.tobytes(), count, rotation_angle))
-                
-                if progress_callback:
-                    progress_callback({
-                        "stage": "analyzing",
-                        "progress": (count / frame_count) * 30,  # Сбор кадров занимает 30% времени
-                        "frames_processed": count,
-                        "total_frames": frame_count
-                    })
-        
-        cap.release()
-
-        # Проверяем, что мы получили хотя бы один кадр для анализа
-        if not frames_to_analyze:
-            raise ValueError("Не удалось получить ни одного кадра для анализа. Проверьте корректность видеофайла.")
+        def collect(max_bytes):
+            nonlocal pending_bytes
+            while pending and pending_bytes > max_bytes:
+                future, size = pending.popleft()
+                analysis_results.append(future.result())
+                pending_bytes -= size
         
-        # Многопроцессная обработка кадров
-        logger.info(f"Processing {len(frames_to_analyze)} frames with multiprocessing...")
+        # Границы анализируемого участка (по умолчанию - весь файл)
+        first_frame, last_frame = 1, frame_count
+        if start is not None or end is not None:
+            first_frame, last_frame = get_frame_range(fps, frame_count, start, end)
+            first_frame = max(1, first_frame - sample_step)
+            last_frame = min(frame_count, last_frame + sample_step)
+            if first_frame > 1:
+                # Seek начинает декодирование с ближайшего ключевого кадра перед нужным
+                cap.set(cv2.CAP_PROP_POS_FRAMES, first_frame - 1)
+                count = first_frame - 1
+            logger.info(f"Analyzing frames {first_frame}-{last_frame} of {frame_count}")
         
-        # Определяем количество процессов (не больше количества кадров)
-        num_processes = min(mp.cpu_count(), len(frames_to_analyze))
+        first_sample = (first_frame + sample_step - 1) // sample_step * sample_step
+        expected_samples = set(range(first_sample, last_frame + 1, sample_step))
+        if expected_samples and expected_samples.issubset(precomputed_filters):
+            # Все кадры уже проанализированы заранее - проход декодирования не нужен
+            logger.info(f"All {len(expected_samples)} samples precomputed, skipping analysis decode pass")
+            count = last_frame
+            cap.release()
+        else:
+            logger.info("Starting video analysis...")
         
+        job = get_frame_scheduler().job("analysis", priority, interactive)
+        try:
+            while(cap.isOpened() and count < last_frame):
+                # grab() без retrieve() пропускает конвертацию кадров, которые не анализируются
+                ret = cap.grab()
+                if not ret:
+                    if count >= frame_count:
+                        logger.info(f"Reached expected frame count in analysis: {frame_count}")
+                        break
+                    if count >= 1e6:  # Защита от бесконечного цикла
+                        logger.warning(f"Reached maximum frame limit in analysis: {count}")
+                        break
+                    logger.warning(f"Failed to read frame {count + 1} in analysis, continuing...")
+                    continue
+                
+                count += 1
+
+                # Выбираем кадры для анализа каждые N секунд
+                if count % sample_step == 0 and count not in precomputed_filters:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        logger.warning(f"Failed to decode sample frame {count} in analysis, skipping")
+                        continue
+                    # Кодируем кадр в байты для передачи в процессы
+                    _, encoded_frame = cv2.imencode('.jpg', frame)
+                    frame_data = encoded_frame.tobytes()
+                    collect(budget - len(frame_data))
+                    pending.append((job.submit(_process_frame_for_analysis, (frame_data, count, rotation_angle)), len(frame_data)))
+                    pending_bytes += len(frame_data)
+                    samples_submitted += 1
+                    
+                    if progress_callback:
+                        progress_callback({
+                            "stage": "analyzing",
+                            "progress": (count / frame_count) * 30,  # Сбор кадров занимает 30% времени
+                            "frames_processed": count,
+                            "total_frames": frame_count
+                        })
+            
+            cap.release()
+            logger.info(f"Waiting for {len(pending)} of {samples_submitted} sampled frames...")
+            collect(0)
+        finally:
+            job.close()
+
         filter_matrix_indexes = []
         filter_matrices = []
+        for frame_number, filter_matrix in precomputed_filters.items():
+            if first_frame <= frame_number <= count:
+                filter_matrix_indexes.append(frame_number)
+                filter_matrices.append(np.asarray(filter_matrix))
         
-        with ProcessPoolExecutor(max_workers=num_processes) as executor:
-            results = list(executor.map(_process_frame_for_analysis, frames_to_analyze))
-            
-            # Собираем результаты
-            for result in results:
-                if result is not None:
-                    frame_number, filter_matrix = result
-                    filter_matrix_indexes.append(frame_number)
-                    filter_matrices.append(filter_matrix)
+        # Проверяем, что мы получили хотя бы один кадр для анализа
+        if not samples_submitted and not filter_matrices:
+            raise ValueError("Не удалось получить ни одного кадра для анализа. Проверьте корректность видеофайла.")
+        
+        # Собираем результаты
+        for result in analysis_results:
+            if result is not None:
+                frame_number, filter_matrix = result
+                filter_matrix_indexes.append(frame_number)
+                filter_matrices.append(filter_matrix)
         
         # Сортируем результаты по номеру кадра
-        sorted_data = sorted(zip(filter_matrix_indexes, filter_matrices))
+        sorted_data = sorted(zip(filter_matrix_indexes, filter_matrices), key=lambda item: item[0])
         filter_matrix_indexes, filter_matrices = zip(*sorted_data) if sorted_data else ([], [])
         
         if progress_callback:
@@ -704,7 +918,7 @@ def analyze_video_mobile(input_video_path, output_video_path, progress_callback=
             "input_video_path": input_video_path,
             "output_video_path": output_video_path,
             "fps": fps,
-            "frame_count": count,
+            "frame_count": count if last_frame == frame_count else frame_count,
             "filters": filter_matrices,
             "filter_indices": list(filter_matrix_indexes),
             "rotation_angle": rotation_angle,
@@ -717,6 +931,11 @@ def analyze_video_mobile(input_video_path, output_video_path, progress_callback=
         raise
 
 
+def get_interpolated_filter(frame_number, filter_indices, filter_matrices):
+    """Матрица фильтра для кадра: линейная интерполяция между семплами анализа"""
+    return [np.interp(frame_number, filter_indices, filter_matrices[..., x])
+            for x in range(len(filter_matrices[0]))]
+
 def _process_frame_batch(args):
     """Обрабатывает батч кадров (для многопроцессной обработки) - оптимизированная версия"""
     frames_data, frame_numbers, filter_matrices, filter_indices, rotation_angle = args
@@ -737,8 +956,7 @@ def _process_frame_batch(args):
             
             # Интерполируем матрицу фильтра
             if len(filter_matrices) > 0:
-                interpolated_filter = [np.interp(frame_number, filter_indices, filter_matrices[..., x]) 
-                                     for x in range(len(filter_matrices[0]))]
+                interpolated_filter = get_interpolated_filter(frame_number, filter_indices, filter_matrices)
                 corrected_mat = apply_filter(rgb_mat, interpolated_filter)
                 corrected_mat = cv2.cvtColor(corrected_mat, cv2.COLOR_RGB2BGR)
             else:
@@ -753,8 +971,53 @@ def _process_frame_batch(args):
         logger.warning(f"Ошибка при обработке батча кадров: {str(e)}")
         return []
 
-def process_video_mobile(video_data, progress_callback=None):
-    """Обрабатывает видео для мобильного API (оптимизированная версия)"""
+def warm_up_worker():
+    """Прогрев процесса пула кадров: один маленький кадр через анализ и батч
+
+    Вызывается инициализатором пула (см. FrameBatchScheduler.start): загружает
+    кодеки OpenCV, ядра cvtColor/calcHist и (если включен) GPU-контекст до
+    первой задачи, а не во время нее.
+    """
+    frame = np.full((64, 64, 3), (170, 120, 40), dtype=np.uint8)
+    _, encoded_frame = cv2.imencode('.jpg', frame)
+    result = _process_frame_for_analysis((encoded_frame.tobytes(), 1, 0))
+    if result is not None:
+        filter_matrices = np.array([result[1]])
+        _process_frame_batch(([encoded_frame.tobytes()], [1], filter_matrices, [1], 0))
+
+def get_scaled_dimensions(width, height, max_dimension=None):
+    """Размеры кадра, вписанные в max_dimension по большей стороне (четные, для кодеков)"""
+    width, height = int(width), int(height)
+    if not max_dimension or max(width, height) <= max_dimension:
+        return width, height
+    scale = max_dimension / max(width, height)
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+def _write_processed_batch(writer, processed_frames):
+    """Декодирует обработанные кадры батча и пишет их по порядку"""
+    for frame_number, processed_frame_data in processed_frames:
+        processed_frame = cv2.imdecode(
+            np.frombuffer(processed_frame_data, dtype=np.uint8), 
+            cv2.IMREAD_COLOR
+        )
+        if processed_frame is not None:
+            writer.write(processed_frame)
+
+def process_video_mobile(video_data, progress_callback=None, max_dimension=None, start=None, end=None, stream=False,
+                         hls=None, priority=1):
+    """Обрабатывает видео для мобильного API (оптимизированная версия)
+
+    max_dimension - рендер уменьшенной копии для просмотра: кадр уменьшается
+    сразу после декодирования, поэтому кодирование, фильтр и запись дешевле.
+    start, end - записать только отрезок (в секундах); декодирование начинается
+    с ближайшего ключевого кадра перед start, а не с начала файла.
+    stream - писать фрагментированный MP4 (H.264 со звуком) через ffmpeg: файл
+    можно отдавать и проигрывать, пока обработка еще идет.
+    hls - список ступеней [(высота, битрейт)]: output_video_path - каталог пакета
+    HLS, все качества кодируются из одного прохода декодирования.
+    priority - вес задачи в общем пуле процессов узла: при нескольких
+    одновременных видео процессы делятся между ними пропорционально весам.
+    """
     try:
         cap = cv2.VideoCapture(video_data["input_video_path"])
         if not cap.isOpened():
@@ -771,19 +1034,54 @@ def process_video_mobile(video_data, progress_callback=None):
         logger.info(f"Processing video with rotation angle: {rotation_angle} degrees")
         logger.info(f"Original video dimensions: {frame_width}x{frame_height}")
         
+        # Размер декодированного кадра после уменьшения (до поворота)
+        scaled_width, scaled_height = get_scaled_dimensions(frame_width, frame_height, max_dimension)
+        resize_to = None
+        if (scaled_width, scaled_height) != (int(frame_width), int(frame_height)):
+            resize_to = (scaled_width, scaled_height)
+            logger.info(f"Review render: downscaling frames to {scaled_width}x{scaled_height}")
+        
         # Определяем размеры после поворота
-        output_width, output_height = get_rotated_dimensions(frame_width, frame_height, rotation_angle)
+        output_width, output_height = get_rotated_dimensions(scaled_width, scaled_height, rotation_angle)
         logger.info(f"Output video dimensions after rotation: {output_width}x{output_height}")
 
-        # Используем настроенный кодек
-        fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODEC)
-        logger.info(f"Using video codec: {VIDEO_CODEC}")
-        new_video = cv2.VideoWriter(
-            video_data["output_video_path"], 
-            fourcc, 
-            video_data["fps"], 
-            (int(output_width), int(output_height))
-        )
+        frame_count = video_data["frame_count"]
+        first_frame, last_frame = 1, frame_count
+        if start is not None or end is not None:
+            first_frame, last_frame = get_frame_range(video_data["fps"], frame_count, start, end)
+            logger.info(f"Trimming output to frames {first_frame}-{last_frame} of {frame_count}")
+
+        if hls:
+            new_video = FFmpegHLSWriter(
+                video_data["output_video_path"],
+                video_data["fps"],
+                (int(output_width), int(output_height)),
+                hls,
+                audio_source=video_data["input_video_path"],
+                audio_start=(first_frame - 1) / video_data["fps"],
+                audio_duration=(last_frame - first_frame + 1) / video_data["fps"]
+            )
+        elif stream:
+            # Фрагменты по секунде: клиент может начать просмотр почти сразу
+            new_video = FFmpegPipeWriter(
+                video_data["output_video_path"],
+                video_data["fps"],
+                (int(output_width), int(output_height)),
+                audio_source=video_data["input_video_path"],
+                audio_start=(first_frame - 1) / video_data["fps"],
+                audio_duration=(last_frame - first_frame + 1) / video_data["fps"],
+                bitrate=video_data.get("original_bitrate")
+            )
+        else:
+            # Используем настроенный кодек
+            fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODEC)
+            logger.info(f"Using video codec: {VIDEO_CODEC}")
+            new_video = cv2.VideoWriter(
+                video_data["output_video_path"], 
+                fourcc, 
+                video_data["fps"], 
+                (int(output_width), int(output_height))
+            )
         
         # Настраиваем параметры кодека для сохранения качества (без сжатия)
         if hasattr(new_video, 'set'):
@@ -796,109 +1094,145 @@ def process_video_mobile(video_data, progress_callback=None):
 
         logger.info("Starting video processing...")
 
-        frame_count = video_data["frame_count"]
         count = 0
         
-        # Параметры для батчевой обработки
+        # Параметры для батчевой обработки. Буферы ограничены в байтах бюджетом
+        # задачи (не больше, чем осталось до лимита памяти контейнера): копящийся
+        # батч и батчи в работе, у каждого - входные кадры и результат того же
+        # размера. Батч закрывается по BATCH_SIZE кадров или по своей доле бюджета
+        governor = get_governor()
+        budget = governor.job_budget(JOB_MEMORY_BUDGET_MB * 1024 * 1024, scaled_width * scaled_height * 3, MAX_PROCESSES)
         batch_size = BATCH_SIZE
+        batch_bytes_limit = max(1, budget // (2 * MAX_PROCESSES + 1))
+        in_flight_bytes_limit = budget - batch_bytes_limit
         frames_batch = []
         frame_numbers_batch = []
+        batch_bytes = 0
         
         # Создаем новый VideoCapture для обработки (позиция сброшена)
         cap = cv2.VideoCapture(video_data["input_video_path"])
+        if first_frame > 1:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, first_frame - 1)
+            count = first_frame - 1
         
-        # Определяем количество процессов для обработки
-        num_processes = min(mp.cpu_count(), MAX_PROCESSES)
+        # Батчи обрабатываются в общем пуле процессов узла; пока они считаются,
+        # декодируются следующие. В работе не больше MAX_PROCESSES батчей задачи
+        # и in_flight_bytes_limit байтов (при нехватке памяти - меньше); когда
+        # места нет, декодер ждет записи самого старого батча. Результаты
+        # пишутся строго по порядку
+        in_flight = deque()
+        in_flight_bytes = 0
+        peak_bytes = 0
+        frames_written = 0
+        total_frames = last_frame - first_frame + 1
+        job = get_frame_scheduler().job("render", priority)
         
-        # Простая последовательная обработка (как в оригинале)
-        while(cap.isOpened()):
-            ret, frame = cap.read()
-            
-            if not ret:
-                if count >= frame_count:
-                    logger.info(f"Reached expected frame count: {frame_count}")
-                    break
-                if count >= 1e6:  # Защита от бесконечного цикла
-                    logger.warning(f"Reached maximum frame limit: {count}")
-                    break
-                logger.warning(f"Failed to read frame {count + 1}, continuing...")
-                continue
-            
-            count += 1
+        def flush(limit, max_bytes=None):
+            nonlocal in_flight_bytes, frames_written
+            while in_flight and (len(in_flight) > limit or (max_bytes is not None and in_flight_bytes > max_bytes)):
+                future, size = in_flight.popleft()
+                processed_frames = future.result()
+                _write_processed_batch(new_video, processed_frames)
+                in_flight_bytes -= size
+                frames_written += len(processed_frames)
+                if progress_callback:
+                    # Рендер - вторая половина задачи (первая - анализ)
+                    progress_callback({
+                        "stage": "processing",
+                        "progress": 50 + min(frames_written / total_frames, 1.0) * 50,
+                        "frames_processed": frames_written,
+                        "total_frames": total_frames
+                    })
+        
+        def submit_batch():
+            nonlocal in_flight_bytes, peak_bytes
+            size = 2 * batch_bytes
+            limit = governor.in_flight_limit(MAX_PROCESSES)
+            flush(max(0, limit - 1), in_flight_bytes_limit - size)
+            if limit == 0:
+                # Память на пределе: свои батчи уже записаны, новый - после выхода из паузы
+                waited = governor.wait_while_paused()
+                logger.info(f"Render paused for {waited:.1f}s by memory pressure")
+            batch_args = (frames_batch, frame_numbers_batch, filter_matrices, 
+                        filter_indices, rotation_angle)
+            in_flight.append((job.submit(_process_frame_batch, batch_args), size))
+            in_flight_bytes += size
+            peak_bytes = max(peak_bytes, in_flight_bytes)
+        
+        try:
+            # Декодирование кадров (как в оригинале)
+            while(cap.isOpened() and count < last_frame):
+                ret, frame = cap.read()
+                
+                if not ret:
+                    if count >= frame_count:
+                        logger.info(f"Reached expected frame count: {frame_count}")
+                        break
+                    if count >= 1e6:  # Защита от бесконечного цикла
+                        logger.warning(f"Reached maximum frame limit: {count}")
+                        break
+                    logger.warning(f"Failed to read frame {count + 1}, continuing...")
+                    continue
+                
+                count += 1
 
-            # Кодируем кадр в JPG для скорости
-            _, encoded_frame = cv2.imencode('.jpg', frame)
-            frames_batch.append(encoded_frame.tobytes())
-            frame_numbers_batch.append(count)
-            
-            # Обрабатываем батч когда он заполнен
-            if len(frames_batch) >= batch_size:
-                if frames_batch:
-                    # Многопроцессная обработка батча
-                    batch_args = (frames_batch, frame_numbers_batch, filter_matrices, 
-                                filter_indices, rotation_angle)
-                    
-                    # Создаем локальный пул процессов для каждого батча
-                    with ProcessPoolExecutor(max_workers=num_processes) as executor:
-                        results = list(executor.map(_process_frame_batch, [batch_args]))
-                    
-                    # Записываем обработанные кадры в видео
-                    for result in results:
-                        for frame_number, processed_frame_data in result:
-                            processed_frame = cv2.imdecode(
-                                np.frombuffer(processed_frame_data, dtype=np.uint8), 
-                                cv2.IMREAD_COLOR
-                            )
-                            if processed_frame is not None:
-                                new_video.write(processed_frame)
+                if resize_to:
+                    frame = cv2.resize(frame, resize_to, interpolation=cv2.INTER_AREA)
+
+                # Кодируем кадр в JPG для скорости
+                _, encoded_frame = cv2.imencode('.jpg', frame)
+                frames_batch.append(encoded_frame.tobytes())
+                frame_numbers_batch.append(count)
+                batch_bytes += len(frames_batch[-1])
+                
+                # Отправляем батч когда он заполнен (по кадрам или по байтам)
+                if len(frames_batch) >= batch_size or batch_bytes >= batch_bytes_limit:
+                    submit_batch()
                     
                     # Очищаем батч
                     frames_batch = []
                     frame_numbers_batch = []
-        
-        # Обрабатываем оставшиеся кадры
-        if frames_batch:
-            logger.info(f"Processing remaining {len(frames_batch)} frames...")
-            batch_args = (frames_batch, frame_numbers_batch, filter_matrices, 
-                        filter_indices, rotation_angle)
-            
-            # Создаем локальный пул процессов для оставшихся кадров
-            with ProcessPoolExecutor(max_workers=num_processes) as executor:
-                results = list(executor.map(_process_frame_batch, [batch_args]))
+                    batch_bytes = 0
             
-            # Записываем обработанные кадры в видео
-            for result in results:
-                for frame_number, processed_frame_data in result:
-                    processed_frame = cv2.imdecode(
-                        np.frombuffer(processed_frame_data, dtype=np.uint8), 
-                        cv2.IMREAD_COLOR
-                    )
-                    if processed_frame is not None:
-                        new_video.write(processed_frame)
+            # Обрабатываем оставшиеся кадры
+            if frames_batch:
+                logger.info(f"Processing remaining {len(frames_batch)} frames...")
+                submit_batch()
+            flush(0)
+        finally:
+            job.close()
 
         cap.release()
         new_video.release()
         
-        logger.info(f"Video processing completed. Processed {count} frames out of {frame_count} expected.")
+        logger.info(f"Video processing completed. Processed {count - first_frame + 1} frames out of {last_frame - first_frame + 1} expected.")
+        logger.info(f"Frame buffers peak: {peak_bytes >> 10} KB of {budget >> 10} KB budget")
         
         # Оптимизируем видео через ffmpeg для лучшего сжатия (если включено)
-        if ENABLE_FFMPEG_OPTIMIZATION:
+        if stream or hls:
+            logger.info("Output encoded by ffmpeg - optimization pass not needed")
+        elif ENABLE_FFMPEG_OPTIMIZATION:
             optimized_path = video_data["output_video_path"].replace('.mp4', '_optimized.mp4')
             try:
                 import subprocess
                 import os
                 # Используем ffmpeg для оптимизации сжатия с битрейтом оригинального видео
-                original_bitrate = video_data.get("original_bitrate", 2800000)  # 2.8 Mbps по умолчанию
-                original_audio_bitrate = video_data.get("original_audio_bitrate", 75000)  # 75 kbps по умолчанию
+                original_bitrate = video_data.get("original_bitrate") or 2800000  # 2.8 Mbps по умолчанию
+                original_audio_bitrate = video_data.get("original_audio_bitrate") or 75000  # 75 kbps по умолчанию
                 
+                # Звук берем из исходника, обрезанный по тому же отрезку, что и видео
+                audio_start = (first_frame - 1) / video_data["fps"]
+                audio_duration = (last_frame - first_frame + 1) / video_data["fps"]
                 cmd = [
                     'ffmpeg', '-y', '-i', video_data["output_video_path"],
+                    '-ss', f'{audio_start:.3f}', '-t', f'{audio_duration:.3f}', '-i', video_data["input_video_path"],
+                    '-map', '0:v:0', '-map', '1:a:0?', '-shortest',
                     '-c:v', 'libx264', '-preset', 'ultrafast', 
                     '-b:v', f'{original_bitrate}',  # Используем битрейт оригинального видео
                     '-maxrate', f'{original_bitrate}', '-bufsize', f'{original_bitrate * 2}',
                     '-c:a', 'aac', '-b:a', f'{original_audio_bitrate}',
                     '-movflags', '+faststart',
-                    '-threads', '2',  # Используем 2 потока для ускорения
+                    '-threads', str(get_thread_budget().ffmpeg_threads()),  # Потоки из бюджета узла
                     optimized_path
                 ]
                 result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
@@ -913,14 +1247,19 @@ def process_video_mobile(video_data, progress_callback=None):
         else:
             logger.info("FFmpeg optimization disabled - using original file")
         
-        return {
+        result = {
             "status": "success",
             "output_path": video_data["output_video_path"],
             "message": "Video processed successfully",
             "rotation_applied": rotation_angle,
             "original_dimensions": (int(frame_width), int(frame_height)),
-            "output_dimensions": (int(output_width), int(output_height))
+            "output_dimensions": (int(output_width), int(output_height)),
+            "frame_range": (first_frame, last_frame),
+            "duration": (last_frame - first_frame + 1) / video_data["fps"]
         }
+        if hls:
+            result["renditions"] = new_video.renditions
+        return result
         
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
@@ -0,0 +1,129 @@
+"""
+Быстрый предпросмотр коррекции одного кадра видео по метке времени
+
+Кадр не рендерится заново из всего видео: декодер позиционируется по индексу
+ключевых кадров, а матрица фильтра берется интерполяцией из готового анализа.
+"""
+
+import bisect
+import logging
+import subprocess
+
+import cv2
+import numpy as np
+
+from .mobile_correct import apply_filter, apply_rotation, get_interpolated_filter
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_MODES = ("split", "full")
+
+# Без индекса ключевых кадров: насколько далеко вперед выгоднее дочитать, чем искать
+FALLBACK_FORWARD_FRAMES = 30
+
+
+def get_keyframe_index(video_path, fps):
+    """Номера ключевых кадров (с 1) по пакетам видеопотока, без декодирования
+
+    Возвращает пустой список, если ffprobe недоступен.
+    """
+    try:
+        cmd = [
+            'ffprobe', '-v', 'quiet', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.warning(f"Failed to build keyframe index: {result.stderr}")
+            return []
+
+        keyframes = set()
+        for line in result.stdout.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                keyframes.add(int(round(float(pts_time) * fps)) + 1)
+        logger.info(f"Keyframe index: {len(keyframes)} keyframes")
+        return sorted(keyframes)
+    except Exception as e:
+        logger.warning(f"Error building keyframe index: {e}")
+        return []
+
+
+class FrameSeeker:
+    """Держит открытый декодер и выбирает самый дешевый путь к нужному кадру
+
+    Если между текущей позицией и целевым кадром нет ключевого кадра, дешевле
+    дочитать вперед (grab без конвертации), иначе - переход через seek, который
+    начинает декодирование с ближайшего предшествующего ключевого кадра.
+    Объект не потокобезопасен: вызывающий код держит блокировку.
+    """
+
+    def __init__(self, video_path, keyframes):
+        self.video_path = video_path
+        self.keyframes = keyframes
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Не удалось открыть видео: {video_path}")
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Номер последнего прочитанного кадра (0 - ничего не прочитано)
+        self.position = 0
+
+    def _can_read_forward(self, frame_number):
+        if frame_number <= self.position:
+            return False
+        if not self.keyframes:
+            return frame_number - self.position <= FALLBACK_FORWARD_FRAMES
+        # Есть ли ключевой кадр в (position, frame_number]
+        i = bisect.bisect_right(self.keyframes, self.position)
+        return i >= len(self.keyframes) or self.keyframes[i] > frame_number
+
+    def read(self, frame_number):
+        """Возвращает кадр (BGR) с номером frame_number (с 1) или None"""
+        if not self._can_read_forward(frame_number):
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number - 1)
+            self.position = frame_number - 1
+
+        while self.position < frame_number - 1:
+            if not self.cap.grab():
+                return None
+            self.position += 1
+
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        self.position = frame_number
+        return frame
+
+    def release(self):
+        self.cap.release()
+
+
+def render_preview_frame(frame, rotation_angle, filter_matrices, filter_indices, frame_number,
+                         width=None, mode="split", jpeg_quality=80):
+    """Корректирует кадр и кодирует его в JPEG
+
+    Кадр сначала уменьшается до width: фильтр поканальный, поэтому результат
+    тот же, а считать приходится меньше пикселей. В режиме split левая половина -
+    исходный кадр, правая - скорректированный (как превью в correct.py).
+    """
+    frame = apply_rotation(frame, rotation_angle)
+    if width and frame.shape[1] > width:
+        height = max(2, int(frame.shape[0] * width / frame.shape[1]))
+        frame = cv2.resize(frame, (int(width), height), interpolation=cv2.INTER_AREA)
+
+    if len(filter_matrices) > 0:
+        filt = get_interpolated_filter(frame_number, filter_indices, np.asarray(filter_matrices))
+        rgb_mat = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        corrected = cv2.cvtColor(apply_filter(rgb_mat, filt), cv2.COLOR_RGB2BGR)
+    else:
+        corrected = frame
+
+    if mode == "split":
+        preview = frame.copy()
+        half = preview.shape[1] // 2
+        preview[:, half:] = corrected[:, half:]
+    else:
+        preview = corrected
+
+    _, encoded = cv2.imencode('.jpg', preview, [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)])
+    return encoded.tobytes()
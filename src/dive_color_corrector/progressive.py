@@ -0,0 +1,176 @@
+"""
+Анализ видео по мере поступления загрузки (progressive ingest)
+
+Пока файл еще дописывается на диск, фоновый поток открывает его и считает
+матрицы фильтра для тех кадров, данные которых, по оценке, уже пришли.
+Работает только если атом moov лежит в начале файла (fast start или
+фрагментированный MP4/MOV): иначе без moov кадры не декодировать, и анализ
+выполняется обычным образом после загрузки.
+"""
+
+import os
+import struct
+import logging
+import threading
+
+import cv2
+
+from .mobile_correct import get_filter_matrix, get_sample_step, get_video_rotation, apply_rotation
+
+logger = logging.getLogger(__name__)
+
+# Запас по байтам сверх пропорциональной оценки позиции кадра в файле
+SAFETY_MARGIN_RATIO = 0.05
+SAFETY_MARGIN_BYTES = 2 * 1024 * 1024
+
+PROGRESSIVE_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+
+LAYOUT_PROGRESSIVE = "progressive"
+LAYOUT_MOOV_AT_END = "moov_at_end"
+LAYOUT_UNSUPPORTED = "unsupported"
+
+
+def inspect_mp4_layout(path, available_bytes):
+    """Определяет расположение moov по верхнеуровневым атомам MP4/MOV
+
+    Возвращает LAYOUT_PROGRESSIVE (moov целиком доступен до mdat),
+    LAYOUT_MOOV_AT_END, LAYOUT_UNSUPPORTED или None, если данных пока мало.
+    """
+    offset = 0
+    with open(path, 'rb') as f:
+        while offset + 8 <= available_bytes:
+            f.seek(offset)
+            header = f.read(16)
+            if len(header) < 8:
+                return None
+
+            size, box_type = struct.unpack('>I4s', header[:8])
+            if not all(32 <= c < 127 for c in box_type):
+                return LAYOUT_UNSUPPORTED
+            if size == 1:
+                if len(header) < 16:
+                    return None
+                size = struct.unpack('>Q', header[8:16])[0]
+            elif size == 0:
+                # Атом до конца файла - дальше moov уже не будет
+                return LAYOUT_PROGRESSIVE if box_type == b'moov' else LAYOUT_MOOV_AT_END
+            if size < 8:
+                return LAYOUT_UNSUPPORTED
+
+            if box_type == b'moov':
+                return LAYOUT_PROGRESSIVE if offset + size <= available_bytes else None
+            if box_type in (b'mdat', b'moof'):
+                return LAYOUT_MOOV_AT_END
+
+            offset += size
+
+    return None
+
+
+class ProgressiveAnalyzer:
+    """Считает матрицы фильтра по растущему файлу загрузки в фоновом потоке"""
+
+    def __init__(self, path, expected_size):
+        self.path = path
+        self.expected_size = expected_size
+        self.layout = None
+        self.filters = {}
+        self._bytes_written = 0
+        self._upload_done = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="progressive-analysis", daemon=True)
+
+    @classmethod
+    def supports(cls, filename, expected_size):
+        """Progressive-режим возможен только для MP4/MOV с известным размером"""
+        _, ext = os.path.splitext(filename or "")
+        return bool(expected_size) and ext.lower() in PROGRESSIVE_EXTENSIONS
+
+    def update(self, bytes_written):
+        """Сообщает, сколько байт загрузки уже записано на диск
+
+        Первый вызов запускает фоновый поток: к этому моменту файл уже создан.
+        """
+        with self._cond:
+            self._bytes_written = bytes_written
+            self._cond.notify_all()
+        if self._thread.ident is None:
+            self._thread.start()
+
+    def finish(self, completed=True):
+        """Останавливает анализ и возвращает {номер кадра: матрица фильтра}
+
+        Оставшиеся кадры досчитывает обычный analyze_video_mobile, поэтому
+        после окончания загрузки фоновый поток не ждем дольше текущего кадра.
+        """
+        with self._cond:
+            self._upload_done = True
+            self._cond.notify_all()
+        if self._thread.ident is not None:
+            self._thread.join()
+        logger.info(f"Progressive analysis ({self.layout}): {len(self.filters)} samples computed during upload")
+        return dict(self.filters) if completed else {}
+
+    def _wait_for(self, needed_bytes):
+        """Ждет, пока на диске будет needed_bytes; False - если загрузка окончена"""
+        with self._cond:
+            while self._bytes_written < needed_bytes and not self._upload_done:
+                self._cond.wait(timeout=1.0)
+            return not self._upload_done
+
+    def _run(self):
+        try:
+            self._analyze()
+        except Exception as e:
+            logger.warning(f"Progressive analysis stopped: {str(e)}")
+
+    def _analyze(self):
+        # Ждем, пока станет понятно, где лежит moov
+        while self.layout is None:
+            with self._cond:
+                available = self._bytes_written
+            self.layout = inspect_mp4_layout(self.path, available)
+            if self.layout is None and not self._wait_for(available + 64 * 1024):
+                return
+
+        if self.layout != LAYOUT_PROGRESSIVE:
+            logger.info(f"Progressive analysis unavailable ({self.layout}), falling back to post-upload analysis")
+            return
+
+        cap = cv2.VideoCapture(self.path)
+        try:
+            if not cap.isOpened():
+                return
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if fps <= 0 or frame_count <= 0:
+                logger.info("Progressive analysis: frame count unknown from moov, falling back")
+                return
+
+            rotation_angle = get_video_rotation(self.path)
+            sample_step = get_sample_step(fps)
+            margin = max(SAFETY_MARGIN_BYTES, int(self.expected_size * SAFETY_MARGIN_RATIO))
+
+            for frame_number in range(sample_step, frame_count + 1, sample_step):
+                # Оценка: байты кадра распределены по файлу примерно равномерно
+                needed = min(self.expected_size, int(frame_number / frame_count * self.expected_size) + margin)
+                if not self._wait_for(needed):
+                    return
+
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number - 1)
+                ret, frame = cap.read()
+                if not ret:
+                    # Данные еще не дошли - откроем файл заново, когда он подрастет
+                    cap.release()
+                    if not self._wait_for(needed + margin):
+                        return
+                    cap = cv2.VideoCapture(self.path)
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number - 1)
+                    ret, frame = cap.read()
+                    if not ret:
+                        continue
+
+                mat = cv2.cvtColor(apply_rotation(frame, rotation_angle), cv2.COLOR_BGR2RGB)
+                self.filters[frame_number] = get_filter_matrix(mat)
+        finally:
+            cap.release()
@@ -0,0 +1,353 @@
+"""
+Учет ресурсов контейнера: квота CPU и лимит памяти из cgroup v1/v2
+
+mp.cpu_count() в контейнере возвращает ядра хоста, а не квоту, и без учета
+лимита памяти батчи кадров и пул процессов легко выходят за него (OOM kill).
+ResourceGovernor читает квоту CPU и лимит памяти cgroup, следит за
+фактическим потреблением (память cgroup и RSS процесса с дочерними
+процессами пула) и по ним выбирает безопасные размеры: число процессов,
+бюджет буферов кадров задачи и число батчей в работе. При нехватке памяти прием новой работы
+сначала ограничивается, а затем приостанавливается.
+"""
+
+import os
+import time
+import math
+import logging
+import threading
+from collections import deque
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Доля лимита памяти: выше MEMORY_SOFT_RATIO - ограничение, выше MEMORY_HARD_RATIO - пауза
+MEMORY_SOFT_RATIO = 0.75
+MEMORY_HARD_RATIO = 0.9
+# Память процесса пула: импорт numpy/cv2 и рабочие копии кадра (float32 в apply_filter)
+WORKER_BASE_BYTES = 150 * 1024 * 1024
+FRAME_WORKING_SET = 12
+# Нижняя граница бюджета буферов задачи: хотя бы несколько кадров в работе
+MIN_JOB_BUDGET = 16 * 1024 * 1024
+# Лимиты cgroup без ограничения выглядят как огромное число
+_UNLIMITED = 1 << 60
+# Как часто перечитывать потребление памяти (секунды)
+SAMPLE_INTERVAL = 1.0
+# Ожидание выхода из паузы: первая задержка, наибольшая задержка и общий предел (секунды)
+PAUSE_BACKOFF = 0.1
+PAUSE_MAX_DELAY = 2.0
+PAUSE_TIMEOUT = 300.0
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _read_int(path):
+    value = _read(path)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _memory_stat(path, name):
+    content = _read(path)
+    for line in (content or "").splitlines():
+        key, _, value = line.partition(" ")
+        if key == name:
+            return int(value)
+    return 0
+
+
+def _cgroup_paths():
+    """{контроллер: путь группы процесса} из /proc/self/cgroup ("" - cgroup v2)"""
+    paths = {}
+    for line in (_read("/proc/self/cgroup") or "").splitlines():
+        parts = line.split(":", 2)
+        if len(parts) != 3:
+            continue
+        for controller in parts[1].split(","):
+            paths[controller] = parts[2]
+    return paths
+
+
+def _group_dirs(base, path):
+    """Каталоги от группы процесса к корню (лимит может стоять на любом уровне)
+
+    В контейнере с собственным пространством имен cgroup путь - "/", и группа
+    процесса - это сам base.
+    """
+    dirs = []
+    path = (path or "/").strip("/")
+    while path:
+        candidate = os.path.join(base, path)
+        if os.path.isdir(candidate):
+            dirs.append(candidate)
+        path = os.path.dirname(path)
+    dirs.append(base)
+    return dirs
+
+
+def read_cgroup_limits(root=CGROUP_ROOT):
+    """Квота CPU (в ядрах), лимит и потребление памяти (байты) из cgroup v1 или v2
+
+    None - ограничения нет (или cgroup недоступна). Потребление памяти - без
+    неактивного файлового кеша, как считает docker stats.
+    """
+    paths = _cgroup_paths()
+    limits = {"version": None, "cpu_quota": None, "memory_limit": None, "memory_usage": None}
+
+    if os.path.exists(os.path.join(root, "cgroup.controllers")):
+        limits["version"] = 2
+        dirs = _group_dirs(root, paths.get(""))
+        for directory in dirs:
+            quota, _, period = (_read(os.path.join(directory, "cpu.max")) or "max").partition(" ")
+            if quota != "max" and period:
+                cores = int(quota) / int(period)
+                limits["cpu_quota"] = min(cores, limits["cpu_quota"] or cores)
+            memory_max = _read(os.path.join(directory, "memory.max"))
+            if memory_max and memory_max != "max":
+                limits["memory_limit"] = min(int(memory_max), limits["memory_limit"] or _UNLIMITED)
+        current = _read_int(os.path.join(dirs[0], "memory.current"))
+        if current is not None:
+            limits["memory_usage"] = max(0, current - _memory_stat(os.path.join(dirs[0], "memory.stat"), "inactive_file"))
+        return limits
+
+    memory_base = os.path.join(root, "memory")
+    cpu_base = next((os.path.join(root, name) for name in ("cpu", "cpu,cpuacct", "cpuacct,cpu")
+                     if os.path.isdir(os.path.join(root, name))), None)
+    if not os.path.isdir(memory_base) and cpu_base is None:
+        return limits
+    limits["version"] = 1
+
+    if cpu_base:
+        for directory in _group_dirs(cpu_base, paths.get("cpu")):
+            quota = _read_int(os.path.join(directory, "cpu.cfs_quota_us"))
+            period = _read_int(os.path.join(directory, "cpu.cfs_period_us"))
+            if quota and quota > 0 and period:
+                cores = quota / period
+                limits["cpu_quota"] = min(cores, limits["cpu_quota"] or cores)
+
+    if os.path.isdir(memory_base):
+        dirs = _group_dirs(memory_base, paths.get("memory"))
+        for directory in dirs:
+            limit = _read_int(os.path.join(directory, "memory.limit_in_bytes"))
+            if limit and limit < _UNLIMITED:
+                limits["memory_limit"] = min(limit, limits["memory_limit"] or _UNLIMITED)
+        usage = _read_int(os.path.join(dirs[0], "memory.usage_in_bytes"))
+        if usage is not None:
+            inactive = _memory_stat(os.path.join(dirs[0], "memory.stat"), "total_inactive_file")
+            limits["memory_usage"] = max(0, usage - inactive)
+    return limits
+
+
+def _affinity_cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def _physical_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def process_tree_rss(pid=None):
+    """RSS процесса вместе с дочерними (процессы пула кадров, ffmpeg) или None без psutil"""
+    if psutil is None:
+        return None
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.Error:
+        return None
+    total = 0
+    for p in processes:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+class ResourceGovernor:
+    """Безопасные размеры пула, батчей и прием работы по ресурсам контейнера
+
+    Состояние памяти: ok - ниже soft_ratio лимита, throttle - выше (в работе
+    по одному батчу и одной задаче), pause - выше hard_ratio (новая работа не
+    принимается, пока потребление не снизится). Последние решения хранятся для
+    /api/performance/info.
+    """
+
+    def __init__(self, root=CGROUP_ROOT, soft_ratio=MEMORY_SOFT_RATIO, hard_ratio=MEMORY_HARD_RATIO,
+                 sample_interval=SAMPLE_INTERVAL):
+        self.root = root
+        self.soft_ratio = soft_ratio
+        self.hard_ratio = hard_ratio
+        self.sample_interval = sample_interval
+        self.decisions = deque(maxlen=20)
+        self._lock = threading.Lock()
+        self._sample = None
+        self._sampled_at = 0.0
+        self._state = "ok"
+
+        limits = read_cgroup_limits(root)
+        self.cgroup_version = limits["version"]
+        self.cpu_quota = limits["cpu_quota"]
+        self.memory_limit = limits["memory_limit"]
+        self.cpu_count = self._effective_cpu_count()
+        if self.cpu_count < (os.cpu_count() or 1) or self.memory_limit:
+            logger.info(f"Resource governor: cgroup v{self.cgroup_version}, {self.cpu_count} CPUs, "
+                        f"memory limit {self.memory_limit}")
+
+    def _effective_cpu_count(self):
+        count = _affinity_cpu_count()
+        if self.cpu_quota:
+            count = min(count, max(1, int(math.ceil(self.cpu_quota))))
+        return max(1, count)
+
+    def _decide(self, kind, value, reason):
+        self.decisions.append({"time": round(time.time(), 1), "decision": kind, "value": value, "reason": reason})
+        logger.info(f"Resource governor: {kind}={value} ({reason})")
+
+    def memory(self):
+        """Лимит и потребление памяти (кешируется на sample_interval секунд)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._sample is not None and now - self._sampled_at < self.sample_interval:
+                return self._sample
+        limits = read_cgroup_limits(self.root)
+        rss = process_tree_rss()
+        limit = self.memory_limit or _physical_memory()
+        # Вне контейнера память cgroup - это вся система, берем RSS своих процессов
+        usage = limits["memory_usage"] if self.memory_limit and limits["memory_usage"] is not None else rss
+        sample = {
+            "limit": limit,
+            "usage": usage,
+            "rss": rss,
+            "ratio": round(usage / limit, 3) if usage is not None and limit else None
+        }
+        with self._lock:
+            self._sample = sample
+            self._sampled_at = now
+        return sample
+
+    def state(self):
+        """ok, throttle или pause по текущему потреблению памяти"""
+        ratio = self.memory()["ratio"]
+        if ratio is None or ratio < self.soft_ratio:
+            state = "ok"
+        elif ratio < self.hard_ratio:
+            state = "throttle"
+        else:
+            state = "pause"
+        if state != self._state:
+            self._decide("state", state, f"memory at {ratio:.0%} of limit" if ratio is not None else "memory unknown")
+            self._state = state
+        return state
+
+    def _available_memory(self):
+        sample = self.memory()
+        if not sample["limit"]:
+            return None
+        return sample["limit"] * self.soft_ratio - (sample["usage"] or 0)
+
+    def pool_size(self, requested=None):
+        """Число процессов пула кадров: не больше квоты CPU и того, что помещается в память"""
+        size = min(requested or self.cpu_count, self.cpu_count)
+        available = self._available_memory()
+        if available is not None:
+            by_memory = max(1, int(available // WORKER_BASE_BYTES))
+            if by_memory < size:
+                self._decide("pool_size", by_memory, f"{int(available) >> 20} MB available for workers")
+                size = by_memory
+        return size
+
+    def job_budget(self, requested, frame_bytes, workers):
+        """Бюджет буферов кадров задачи (байты): не больше, чем осталось до мягкого лимита
+
+        Из свободной памяти вычитаются рабочие копии кадра в workers процессах пула.
+        """
+        available = self._available_memory()
+        if available is None:
+            return requested
+        available -= min(workers, self.cpu_count) * frame_bytes * FRAME_WORKING_SET
+        budget = int(max(MIN_JOB_BUDGET, min(requested, available)))
+        if budget < requested:
+            self._decide("job_budget", budget, f"{max(0, int(available)) >> 20} MB available")
+        return budget
+
+    def in_flight_limit(self, requested):
+        """Сколько батчей задачи держать в работе: меньше при нехватке памяти"""
+        state = self.state()
+        if state == "pause":
+            return 0
+        return 1 if state == "throttle" else requested
+
+    def wait_while_paused(self, initial=PAUSE_BACKOFF, max_delay=PAUSE_MAX_DELAY, timeout=PAUSE_TIMEOUT):
+        """Ждет, пока state() не выйдет из pause (задержка удваивается до max_delay)
+
+        Вызывать, когда своих батчей в работе уже нет. Через timeout секунд
+        работа продолжается (по одному батчу), чтобы задача не зависла навсегда.
+        Возвращает время ожидания в секундах.
+        """
+        started = time.monotonic()
+        delay = initial
+        while self.state() == "pause":
+            waited = time.monotonic() - started
+            if waited >= timeout:
+                logger.warning(f"Resource governor: still paused after {waited:.0f}s, resuming with one batch")
+                break
+            time.sleep(min(delay, timeout - waited))
+            delay = min(delay * 2, max_delay)
+        return time.monotonic() - started
+
+    def concurrency_limit(self, requested):
+        """Сколько тяжелых задач выполнять одновременно; 0 - прием приостановлен"""
+        state = self.state()
+        if state == "pause":
+            return 0
+        return min(requested, 1 if state == "throttle" else requested)
+
+    def stats(self):
+        return {
+            "cgroup_version": self.cgroup_version,
+            "cpu_quota": self.cpu_quota,
+            "cpu_count": self.cpu_count,
+            "memory": self.memory(),
+            "state": self.state(),
+            "soft_ratio": self.soft_ratio,
+            "hard_ratio": self.hard_ratio,
+            "decisions": list(self.decisions)
+        }
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    """Общий для процесса ResourceGovernor (создается при первом обращении)"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = ResourceGovernor()
+        return _governor
+
+
+def effective_cpu_count():
+    """Число ядер с учетом квоты cgroup и привязки процесса"""
+    return get_governor().cpu_count
@@ -0,0 +1,181 @@
+"""
+Единый бюджет потоков узла: OpenCV, BLAS/OpenMP и ffmpeg
+
+OpenCV (cvtColor, resize, calcHist), BLAS numpy и ffmpeg по умолчанию
+запускают по потоку на ядро каждый, и все это - поверх пула процессов кадров
+размером с число ядер: на 8 ядрах легко получается 50+ готовых к выполнению
+потоков, которые вытесняют друг друга. ThreadBudget делит один бюджет потоков
+узла (по умолчанию - ядра с учетом квоты cgroup) между процессами пула,
+основным процессом и кодировщиками ffmpeg, а при pin_workers привязывает
+процессы пула к непересекающимся наборам ядер.
+"""
+
+import os
+import logging
+import threading
+import multiprocessing as mp
+
+import cv2
+
+from .resources import get_governor
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+logger = logging.getLogger(__name__)
+
+# Переменные окружения, которыми ограничиваются потоки BLAS/OpenMP
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"
+)
+
+
+def _available_cores():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return list(range(os.cpu_count() or 1))
+
+
+def split_cores(cores, parts):
+    """Делит ядра на parts непрерывных непересекающихся наборов (если ядер меньше - по одному)"""
+    parts = max(1, parts)
+    if len(cores) < parts:
+        return [[core] for core in cores]
+    size, extra = divmod(len(cores), parts)
+    sets, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def limit_threads(threads):
+    """Ограничивает потоки OpenCV и BLAS/OpenMP в текущем процессе
+
+    Переменные окружения действуют на библиотеки, загруженные позже, и на
+    дочерние процессы; уже загруженный BLAS ограничивается через threadpoolctl.
+    """
+    threads = max(1, int(threads))
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    cv2.setNumThreads(threads)
+    if threadpool_limits is not None:
+        threadpool_limits(threads)
+
+
+def init_pool_worker(threads, core_sets, slot_counter):
+    """Инициализатор процесса пула кадров: потоки и (если задано) привязка к ядрам
+
+    Каждый процесс берет следующий номер из slot_counter и занимает свой набор
+    ядер; процессы, перезапущенные после сбоя пула, идут по кругу.
+    """
+    limit_threads(threads)
+    if not core_sets:
+        return
+    with slot_counter.get_lock():
+        slot = slot_counter.value
+        slot_counter.value += 1
+    cores = core_sets[slot % len(core_sets)]
+    try:
+        os.sched_setaffinity(0, cores)
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Could not pin worker {os.getpid()} to cores {cores}: {e}")
+
+
+class ThreadBudget:
+    """Распределение бюджета потоков узла
+
+    Процессы пула кадров загружены все сразу, поэтому каждый получает
+    (total - main_reserve) // workers потоков. Основному процессу
+    (декодирование, превью, live) и кодировщикам ffmpeg достается main_reserve
+    потоков; encoders - сколько кодировщиков работает одновременно.
+
+    По умолчанию (main_reserve=0) основному процессу остается то, что не занято
+    пулом. Пул обычно размером с число ядер, поэтому это total - workers = 0,
+    и основной процесс получает один поток сверх бюджета: декодер и ffmpeg
+    делят ядра с пулом. Чтобы выделить им долю явно, задайте main_reserve
+    (THREAD_BUDGET_MAIN): пул кадров тогда рассчитывается на pool_threads() потоков.
+    """
+
+    def __init__(self, total=None, pin_workers=False, encoders=1, main_reserve=0):
+        self.cores = _available_cores()
+        self.total = max(1, int(total or get_governor().cpu_count))
+        self.pin_workers = pin_workers
+        self.encoders = max(1, int(encoders))
+        # Хотя бы один поток остается пулу
+        self.main_reserve = min(max(0, int(main_reserve or 0)), self.total - 1)
+        self.workers = self.total
+
+    def pool_threads(self):
+        """Потоки, которые делят процессы пула кадров (бюджет без доли основного процесса)"""
+        return self.total - self.main_reserve
+
+    def worker_threads(self):
+        return max(1, self.pool_threads() // max(1, self.workers))
+
+    def main_threads(self):
+        return max(1, self.main_reserve or self.total - self.workers)
+
+    def ffmpeg_threads(self):
+        """Значение -threads для одного кодировщика ffmpeg"""
+        return max(1, self.main_threads() // self.encoders)
+
+    def pool_initializer(self, workers, mp_context=None):
+        """(initializer, initargs) для пула из workers процессов; ограничивает и основной процесс
+
+        mp_context - контекст multiprocessing, которым пул запускает процессы:
+        счетчик наборов ядер создается в нем же, иначе его нельзя передать
+        процессам, запущенным через forkserver или spawn.
+        """
+        self.workers = max(1, int(workers))
+        slot_counter = (mp_context or mp).Value("i", 0)
+        core_sets = split_cores(self.cores, self.workers) if self.pin_workers else []
+        limit_threads(self.main_threads())
+        if threadpool_limits is None:
+            logger.warning("threadpoolctl is not installed: BLAS/OpenMP pools already loaded are not limited, "
+                           "only OMP_NUM_THREADS and similar variables apply")
+        logger.info(f"Thread budget {self.total}: {self.workers} workers x {self.worker_threads()} threads, "
+                    f"main {self.main_threads()}, ffmpeg {self.ffmpeg_threads()} x {self.encoders}, "
+                    f"pinned={bool(core_sets)}")
+        return init_pool_worker, (self.worker_threads(), core_sets, slot_counter)
+
+    def stats(self):
+        return {
+            "total": self.total,
+            "workers": self.workers,
+            "worker_threads": self.worker_threads(),
+            "main_threads": self.main_threads(),
+            "main_reserve": self.main_reserve,
+            "ffmpeg_threads": self.ffmpeg_threads(),
+            "encoders": self.encoders,
+            "pin_workers": self.pin_workers,
+            "cores": self.cores,
+            "core_sets": split_cores(self.cores, self.workers) if self.pin_workers else None,
+            "threadpoolctl": threadpool_limits is not None
+        }
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def configure_thread_budget(total=None, pin_workers=False, encoders=1, main_reserve=0):
+    """Задает бюджет потоков узла; вызывать до запуска пула кадров"""
+    global _budget
+    with _budget_lock:
+        _budget = ThreadBudget(total, pin_workers, encoders, main_reserve)
+        return _budget
+
+
+def get_thread_budget():
+    """Общий бюджет потоков (по умолчанию - ядра с учетом квоты, без привязки)"""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = ThreadBudget()
+        return _budget
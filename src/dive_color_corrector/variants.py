@@ -0,0 +1,268 @@
+"""
+Рендер нескольких вариантов результата за один проход декодирования
+
+Клиенту часто нужно сразу несколько файлов: полное разрешение и уменьшенная
+копия для отправки, или коррекция разной силы. Видео декодируется и
+анализируется один раз; каждый кадр раздается вариантам, и у каждого свой
+поток: масштабирование, фильтр нужной силы и кодирование. Дополнительный
+вариант стоит только своего масштабирования и кодирования.
+
+Сила коррекции strength смешивает исходный и скорректированный кадр:
+out = (1 - strength) * кадр + strength * фильтр(кадр). Фильтр аффинный,
+поэтому смешивается сама матрица cv2.transform, а не готовые кадры.
+"""
+
+import re
+import json
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from . import mobile_correct
+from .mobile_correct import (
+    VIDEO_CODEC, apply_rotation, get_rotated_dimensions, get_scaled_dimensions,
+    get_frame_range, get_interpolated_filter
+)
+from .live import filter_to_transform, apply_transform
+from .writers import FFmpegPipeWriter
+from .buffers import ByteBoundedQueue
+from .resources import get_governor
+
+logger = logging.getLogger(__name__)
+
+VARIANT_CODECS = ("h264", "mp4v")
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+_BITRATE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)([kKmM]?)$")
+
+# Преобразование "без коррекции" для смешивания по силе
+_IDENTITY_TRANSFORM = np.hstack([np.eye(3, dtype=np.float32), np.zeros((3, 1), dtype=np.float32)])
+
+
+def parse_bitrate(value):
+    """Битрейт в бит/с из числа или строки вида "2500k", "5M" """
+    match = _BITRATE_PATTERN.match(str(value).strip())
+    if not match:
+        raise ValueError(f"Некорректный битрейт: {value}")
+    number, unit = match.groups()
+    return int(float(number) * {"": 1, "k": 1000, "m": 1000000}[unit.lower()])
+
+
+def parse_variants(spec, max_variants, default_codec="h264"):
+    """Разбирает JSON-список вариантов и заполняет значения по умолчанию
+
+    Пример: [{"name": "full"}, {"name": "share", "max_dimension": 720,
+    "bitrate": "2M", "strength": 0.7}]. Ошибки - ValueError с описанием.
+    """
+    try:
+        items = json.loads(spec) if isinstance(spec, str) else spec
+    except ValueError:
+        raise ValueError("variants должен быть JSON-списком")
+    if not isinstance(items, list) or not items:
+        raise ValueError("variants должен быть непустым JSON-списком")
+    if len(items) > max_variants:
+        raise ValueError(f"Не больше {max_variants} вариантов")
+
+    variants = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("Каждый вариант - JSON-объект")
+        name = str(item.get("name", f"v{len(variants) + 1}"))
+        if not _NAME_PATTERN.match(name) or any(v["name"] == name for v in variants):
+            raise ValueError(f"Некорректное или повторяющееся имя варианта: {name}")
+        codec = item.get("codec") or default_codec
+        if codec not in VARIANT_CODECS:
+            raise ValueError(f"codec должен быть одним из: {', '.join(VARIANT_CODECS)}")
+        max_dimension = item.get("max_dimension")
+        if max_dimension is not None:
+            max_dimension = int(max_dimension)
+            if max_dimension < 16:
+                raise ValueError("max_dimension должен быть не меньше 16")
+        bitrate = item.get("bitrate")
+        if bitrate is not None:
+            if codec != "h264":
+                raise ValueError("bitrate поддерживается только для codec h264")
+            bitrate = parse_bitrate(bitrate)
+        strength = float(item.get("strength", 1.0))
+        if not 0 <= strength <= 1:
+            raise ValueError("strength должен быть в диапазоне 0..1")
+        variants.append({
+            "name": name,
+            "max_dimension": max_dimension,
+            "codec": codec,
+            "bitrate": bitrate,
+            "strength": strength
+        })
+    return variants
+
+
+def blend_transform(transform, strength):
+    """Матрица фильтра заданной силы: 0 - исходный кадр, 1 - полная коррекция"""
+    if strength >= 1:
+        return transform
+    return (strength * transform + (1 - strength) * _IDENTITY_TRANSFORM).astype(np.float32)
+
+
+class _VariantWorker(threading.Thread):
+    """Поток одного варианта: масштаб, фильтр, поворот и запись кадров из очереди
+
+    cv2 и запись в pipe ffmpeg отпускают GIL, поэтому варианты кодируются параллельно.
+    Очередь ограничена в байтах (queue_bytes): декодер ждет самый медленный вариант.
+    """
+
+    def __init__(self, variant, writer, resize_to, rotation_angle, queue_bytes):
+        super().__init__(daemon=True)
+        self.variant = variant
+        self.writer = writer
+        self.resize_to = resize_to
+        self.rotation_angle = rotation_angle
+        self.frames = ByteBoundedQueue(queue_bytes)
+        self.written = 0
+        self.error = None
+
+    def run(self):
+        strength = self.variant["strength"]
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            frame, transform = item
+            try:
+                if self.resize_to:
+                    frame = cv2.resize(frame, self.resize_to, interpolation=cv2.INTER_AREA)
+                if transform is not None and strength > 0:
+                    frame = apply_transform(frame, blend_transform(transform, strength))
+                self.writer.write(apply_rotation(frame, self.rotation_angle))
+                self.written += 1
+            except Exception as e:
+                # Продолжаем разбирать очередь, чтобы не заблокировать декодер
+                self.error = e
+
+
+def _open_writer(variant, path, fps, size, audio_source, audio_start, audio_duration):
+    if variant["codec"] == "h264":
+        return FFmpegPipeWriter(
+            path, fps, size,
+            audio_source=audio_source,
+            audio_start=audio_start,
+            audio_duration=audio_duration,
+            bitrate=variant.get("bitrate"),
+            fragmented=False
+        )
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*VIDEO_CODEC), fps, size)
+    writer.set(cv2.VIDEOWRITER_PROP_QUALITY, 100)
+    return writer
+
+
+def process_video_variants(video_data, variants, start=None, end=None):
+    """Рендерит несколько вариантов видео за один проход декодирования
+
+    variants - список словарей: name, path (куда писать), max_dimension
+    (None - исходный размер), codec (h264 со звуком через ffmpeg или mp4v через
+    OpenCV), bitrate (бит/с, только для h264), strength (0..1).
+    start, end - отрезок в секундах, как в process_video_mobile.
+    """
+    cap = cv2.VideoCapture(video_data["input_video_path"])
+    if not cap.isOpened():
+        raise ValueError(f"Не удалось открыть видео: {video_data['input_video_path']}")
+
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    rotation_angle = video_data.get("rotation_angle", 0)
+    fps = video_data["fps"]
+    frame_count = video_data["frame_count"]
+
+    first_frame, last_frame = 1, frame_count
+    if start is not None or end is not None:
+        first_frame, last_frame = get_frame_range(fps, frame_count, start, end)
+    audio_start = (first_frame - 1) / fps
+    audio_duration = (last_frame - first_frame + 1) / fps
+
+    # Декодированный кадр общий для всех вариантов, поэтому в очередях вместе
+    # не больше queue_bytes байтов разных кадров (плюс по кадру в работе у потоков)
+    queue_bytes = get_governor().job_budget(
+        mobile_correct.JOB_MEMORY_BUDGET_MB * 1024 * 1024, frame_width * frame_height * 3, len(variants)
+    )
+
+    workers = []
+    try:
+        for variant in variants:
+            scaled_width, scaled_height = get_scaled_dimensions(frame_width, frame_height, variant.get("max_dimension"))
+            resize_to = None
+            if (scaled_width, scaled_height) != (frame_width, frame_height):
+                resize_to = (scaled_width, scaled_height)
+            output_size = get_rotated_dimensions(scaled_width, scaled_height, rotation_angle)
+            writer = _open_writer(
+                variant, variant["path"], fps, (int(output_size[0]), int(output_size[1])),
+                video_data["input_video_path"], audio_start, audio_duration
+            )
+            worker = _VariantWorker(variant, writer, resize_to, rotation_angle, queue_bytes)
+            worker.output_dimensions = (int(output_size[0]), int(output_size[1]))
+            worker.start()
+            workers.append(worker)
+        logger.info(f"Rendering {len(workers)} variants from one decode pass: "
+                    f"{', '.join(w.variant['name'] for w in workers)}")
+
+        filter_matrices = video_data["filters"]
+        filter_indices = video_data["filter_indices"]
+
+        count = 0
+        if first_frame > 1:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, first_frame - 1)
+            count = first_frame - 1
+
+        while count < last_frame:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            count += 1
+
+            # Фильтр считается один раз на кадр, варианты только смешивают матрицу
+            transform = None
+            if len(filter_matrices) > 0:
+                transform = filter_to_transform(get_interpolated_filter(count, filter_indices, filter_matrices))
+            for worker in workers:
+                if worker.error is not None:
+                    raise RuntimeError(f"Вариант {worker.variant['name']}: {worker.error}")
+                worker.frames.put((frame, transform), frame.nbytes)
+    finally:
+        cap.release()
+        for worker in workers:
+            worker.frames.put(None, 0)
+        errors = []
+        for worker in workers:
+            worker.join()
+            try:
+                worker.writer.release()
+            except Exception as e:
+                errors.append(f"{worker.variant['name']}: {e}")
+            if worker.error is not None:
+                errors.append(f"{worker.variant['name']}: {worker.error}")
+
+    if errors:
+        raise RuntimeError(f"Ошибка записи вариантов: {'; '.join(errors)}")
+
+    logger.info(f"Variant rendering completed: {count - first_frame + 1} frames x {len(workers)} variants")
+    return {
+        "status": "success",
+        "message": "Video variants processed successfully",
+        "rotation_applied": rotation_angle,
+        "original_dimensions": (frame_width, frame_height),
+        "frame_range": (first_frame, last_frame),
+        "duration": (last_frame - first_frame + 1) / fps,
+        "variants": [
+            {
+                "name": w.variant["name"],
+                "output_path": w.variant["path"],
+                "output_dimensions": w.output_dimensions,
+                "codec": w.variant["codec"],
+                "strength": w.variant["strength"],
+                "frames": w.written
+            }
+            for w in workers
+        ]
+    }
@@ -0,0 +1,215 @@
+"""
+Запись видео через внешний ffmpeg (кадры передаются по pipe)
+
+Используется там, где cv2.VideoWriter не подходит: фрагментированный MP4,
+который можно отдавать клиенту, пока файл еще пишется, и пакет HLS с
+несколькими качествами из одного прохода декодирования.
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+
+from .threads import get_thread_budget
+
+logger = logging.getLogger(__name__)
+
+# Флаги фрагментированного MP4: moov в начале без таблиц сэмплов, каждый фрагмент
+# начинается с ключевого кадра - файл проигрывается с любого уже записанного места
+FRAGMENTED_MP4_FLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+
+def is_ffmpeg_available():
+    """Есть ли ffmpeg в PATH"""
+    return shutil.which("ffmpeg") is not None
+
+
+class FFmpegPipeWriter:
+    """Совместимая с cv2.VideoWriter (write/release/isOpened) запись через ffmpeg
+
+    Кадры BGR24 пишутся в stdin ffmpeg, который кодирует их в H.264 и сразу
+    выгружает фрагменты на диск (fragment_seconds - длительность фрагмента).
+    audio_source - файл, из которого берется звук (с audio_start, audio_duration).
+    threads - потоки кодировщика (по умолчанию - из бюджета потоков узла).
+    fragmented=False - обычный MP4 с moov в начале (+faststart), для готовых файлов.
+    """
+
+    def __init__(self, path, fps, size, fragment_seconds=1.0, audio_source=None,
+                 audio_start=0.0, audio_duration=None, bitrate=None, preset="veryfast", fragmented=True, threads=None):
+        width, height = int(size[0]), int(size[1])
+        self.frame_bytes = width * height * 3
+        gop = max(1, int(round(fps * fragment_seconds)))
+
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', f'{fps}', '-i', '-'
+        ]
+        if audio_source:
+            cmd += ['-ss', f'{audio_start:.3f}']
+            if audio_duration:
+                cmd += ['-t', f'{audio_duration:.3f}']
+            cmd += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?', '-c:a', 'aac']
+        cmd += [
+            # yuv420p требует четных размеров
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-c:v', 'libx264', '-preset', preset, '-pix_fmt', 'yuv420p',
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+            '-threads', str(threads or get_thread_budget().ffmpeg_threads())
+        ]
+        if bitrate:
+            cmd += ['-b:v', str(bitrate), '-maxrate', str(bitrate), '-bufsize', str(bitrate * 2)]
+        if fragmented:
+            cmd += ['-movflags', FRAGMENTED_MP4_FLAGS, '-flush_packets', '1']
+        else:
+            cmd += ['-movflags', '+faststart']
+        cmd += ['-f', 'mp4', path]
+
+        self._stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+        logger.info(f"Started ffmpeg MP4 writer: {width}x{height} @ {fps} fps, GOP {gop}, fragmented={fragmented}")
+
+    def _error(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors="replace").strip()
+
+    def isOpened(self):
+        return self.proc.poll() is None
+
+    def write(self, frame):
+        try:
+            self.proc.stdin.write(frame.tobytes())
+        except (BrokenPipeError, ValueError):
+            self.proc.wait()
+            raise RuntimeError(f"ffmpeg завершился с ошибкой: {self._error()}")
+
+    def release(self):
+        """Закрывает stdin и дожидается, пока ffmpeg допишет последний фрагмент"""
+        try:
+            if self.proc.stdin and not self.proc.stdin.closed:
+                self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.proc.wait()
+        error = self._error()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg завершился с ошибкой ({returncode}): {error}")
+
+
+def has_audio_stream(path):
+    """Есть ли в файле звуковая дорожка (по выводу ffmpeg -i, ffprobe не нужен)"""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-i', path], capture_output=True, text=True, timeout=30)
+        return any("Audio:" in line for line in result.stderr.splitlines() if "Stream #" in line)
+    except Exception as e:
+        logger.warning(f"Could not detect audio stream: {e}")
+        return False
+
+
+def parse_renditions(spec):
+    """Разбирает лесенку качеств вида "1080:5000k,720:2800k,360:800k" в [(высота, битрейт)]"""
+    renditions = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        height, _, bitrate = item.partition(":")
+        renditions.append((int(height), bitrate.strip() or None))
+    return sorted(renditions, key=lambda r: r[0], reverse=True)
+
+
+def select_renditions(renditions, width, height):
+    """Оставляет качества не выше исходника (по короткой стороне) и считает их размеры
+
+    Если исходник меньше всех ступеней, остается одна - в исходном размере.
+    """
+    short_side = min(width, height)
+    selected = []
+    for target, bitrate in renditions:
+        if target > short_side:
+            continue
+        scale = target / short_side
+        selected.append({
+            "name": f"{target}p",
+            "width": max(2, int(round(width * scale / 2)) * 2),
+            "height": max(2, int(round(height * scale / 2)) * 2),
+            "bitrate": bitrate
+        })
+    if not selected:
+        bitrate = renditions[-1][1] if renditions else None
+        selected.append({
+            "name": f"{short_side}p",
+            "width": width // 2 * 2,
+            "height": height // 2 * 2,
+            "bitrate": bitrate
+        })
+    return selected
+
+
+class FFmpegHLSWriter(FFmpegPipeWriter):
+    """Пакет HLS с лесенкой качеств из одного потока кадров
+
+    Кадры декодируются и корректируются один раз; ffmpeg делит поток (split),
+    масштабирует под каждую ступень и кодирует их параллельно. В package_dir
+    появляются master.m3u8 и по каталогу v<имя качества> на качество (v1080p,
+    v720p, ...): в -var_stream_map у потоков задан name, и %v заменяется им.
+    Плейлисты ссылаются на эти каталоги относительными путями.
+    """
+
+    MASTER_PLAYLIST = "master.m3u8"
+
+    def __init__(self, package_dir, fps, size, renditions, segment_seconds=4.0, audio_source=None,
+                 audio_start=0.0, audio_duration=None, preset="veryfast", threads=None):
+        width, height = int(size[0]), int(size[1])
+        self.frame_bytes = width * height * 3
+        self.renditions = select_renditions(renditions, width, height)
+        os.makedirs(package_dir, exist_ok=True)
+        # Ключевой кадр на границе каждого сегмента во всех качествах
+        gop = max(1, int(round(fps * segment_seconds)))
+        with_audio = bool(audio_source) and has_audio_stream(audio_source)
+
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', f'{fps}', '-i', '-'
+        ]
+        if with_audio:
+            cmd += ['-ss', f'{audio_start:.3f}']
+            if audio_duration:
+                cmd += ['-t', f'{audio_duration:.3f}']
+            cmd += ['-i', audio_source]
+
+        count = len(self.renditions)
+        graph = f"[0:v]split={count}" + "".join(f"[s{i}]" for i in range(count))
+        for i, r in enumerate(self.renditions):
+            graph += f";[s{i}]scale={r['width']}:{r['height']}[v{i}]"
+        cmd += ['-filter_complex', graph]
+
+        stream_map = []
+        for i, r in enumerate(self.renditions):
+            cmd += ['-map', f'[v{i}]', f'-c:v:{i}', 'libx264']
+            if r["bitrate"]:
+                bitrate = r["bitrate"]
+                cmd += [f'-b:v:{i}', bitrate, f'-maxrate:v:{i}', bitrate, f'-bufsize:v:{i}', bitrate]
+            if with_audio:
+                cmd += ['-map', '1:a:0']
+                stream_map.append(f"v:{i},a:{i},name:{r['name']}")
+            else:
+                stream_map.append(f"v:{i},name:{r['name']}")
+        if with_audio:
+            cmd += ['-c:a', 'aac', '-b:a', '128k']
+        cmd += [
+            '-preset', preset, '-pix_fmt', 'yuv420p',
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+            '-threads', str(threads or get_thread_budget().ffmpeg_threads()),
+            '-f', 'hls', '-hls_time', f'{segment_seconds}', '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(package_dir, 'v%v', 'seg_%05d.ts'),
+            '-master_pl_name', self.MASTER_PLAYLIST,
+            '-var_stream_map', ' '.join(stream_map),
+            os.path.join(package_dir, 'v%v', 'index.m3u8')
+        ]
+
+        self._stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+        logger.info(f"Started ffmpeg HLS writer: {', '.join(r['name'] for r in self.renditions)}, audio={with_audio}")
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Версия формата .npz; при изменении набора полей старые записи игнорируются
+ANALYSIS_CACHE_VERSION = 1
+
+
+class AnalysisCache:
+    """Персистентный кеш результатов analyze_video_mobile в виде .npz
+
+    Ключ - хеш содержимого видео и параметры анализа. Запись хранит только то,
+    что не зависит от путей и параметров кодирования, поэтому ее можно
+    переиспользовать для любого повторного рендера того же файла.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash: str, params: Dict[str, Any]) -> str:
+        """Строит ключ из хеша видео и параметров анализа"""
+        payload = json.dumps({"input": content_hash, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.npz")
+
+    def load(self, key: str, input_video_path: str, output_video_path: str) -> Optional[Dict[str, Any]]:
+        """Восстанавливает video_data из кеша или возвращает None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != ANALYSIS_CACHE_VERSION:
+                    return None
+                video_bitrate = int(data["original_bitrate"])
+                audio_bitrate = int(data["original_audio_bitrate"])
+                video_data = {
+                    "input_video_path": input_video_path,
+                    "output_video_path": output_video_path,
+                    "fps": float(data["fps"]),
+                    "frame_count": int(data["frame_count"]),
+                    "filters": data["filters"],
+                    "filter_indices": data["filter_indices"].tolist(),
+                    "rotation_angle": int(data["rotation_angle"]),
+                    "original_bitrate": video_bitrate if video_bitrate >= 0 else None,
+                    "original_audio_bitrate": audio_bitrate if audio_bitrate >= 0 else None
+                }
+        except Exception as e:
+            logger.warning(f"Corrupted analysis cache entry {path}: {str(e)}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        # Отмечаем обращение для LRU-вытеснения
+        try:
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except OSError:
+            pass
+
+        logger.info(f"Analysis cache hit: {key[:12]}")
+        return video_data
+
+    def save(self, key: str, video_data: Dict[str, Any]):
+        """Сохраняет результат анализа (атомарно через временный файл)"""
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        video_bitrate = video_data.get("original_bitrate")
+        audio_bitrate = video_data.get("original_audio_bitrate")
+
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    version=np.int32(ANALYSIS_CACHE_VERSION),
+                    filters=np.asarray(video_data["filters"], dtype=np.float64),
+                    filter_indices=np.asarray(video_data["filter_indices"], dtype=np.int64),
+                    fps=np.float64(video_data["fps"]),
+                    frame_count=np.int64(video_data["frame_count"]),
+                    rotation_angle=np.int32(video_data.get("rotation_angle", 0)),
+                    original_bitrate=np.int64(video_bitrate if video_bitrate is not None else -1),
+                    original_audio_bitrate=np.int64(audio_bitrate if audio_bitrate is not None else -1)
+                )
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not store analysis cache entry {key[:12]}: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def evict(self) -> List[str]:
+        """Удаляет самые давно использованные записи сверх лимита размера"""
+        removed = []
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if not name.endswith(".npz") or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+
+            entries.sort()
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total_size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total_size -= size
+                    removed.append(path)
+                    logger.info(f"Evicted analysis cache entry: {path}")
+                except OSError as e:
+                    logger.error(f"Error evicting analysis cache entry {path}: {str(e)}")
+
+        return removed
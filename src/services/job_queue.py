@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Долговечная очередь задач в SQLite (режим WAL)
+
+    Одной базой пользуются сервер и воркеры (в том числе из других процессов):
+    WAL позволяет читать, пока кто-то пишет, а захват задачи идет в транзакции
+    BEGIN IMMEDIATE, поэтому одну задачу не получат два воркера.
+
+    Жизненный цикл: queued -> running -> completed | failed. Захваченная задача
+    арендуется на lease_seconds; воркер продлевает аренду через heartbeat().
+    Если аренда истекла (воркер упал), задача возвращается в очередь. Ошибка
+    возвращает задачу в очередь с экспоненциальной задержкой, пока не исчерпан
+    max_attempts. Завершенные задачи хранятся retention_seconds, затем evict()
+    их удаляет.
+
+    Все выборки идут по индексам (status, ...), поэтому постановка, захват и
+    статус стоят O(log n) независимо от размера истории.
+    """
+
+    STATUSES = ("queued", "running", "completed", "failed")
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            available_at REAL NOT NULL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            result TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, available_at);
+        CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (status, lease_expires);
+        CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, finished_at);
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float = 60, max_attempts: int = 3,
+                 retry_backoff: float = 5, max_retry_delay: float = 600, retention_seconds: float = 7 * 24 * 3600):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
+        self.retention_seconds = retention_seconds
+        # sqlite3-соединение нельзя делить между потоками - свое на каждый поток
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.executescript(self._SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None - транзакции открываем явно
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], priority: int = 0,
+                max_attempts: Optional[int] = None, job_id: Optional[str] = None,
+                worker_id: Optional[str] = None) -> str:
+        """Ставит задачу в очередь и возвращает ее id (чем больше priority, тем раньше)
+
+        worker_id - задача сразу захвачена этим воркером (running с арендой):
+        для задач, которые выполняет сам поставивший их процесс, - они не
+        остаются в очереди без потребителя.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        if worker_id is None:
+            self._connection().execute(
+                "INSERT INTO jobs (id, kind, payload, priority, status, max_attempts, available_at, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), priority, max_attempts or self.max_attempts, now, now)
+            )
+        else:
+            self._connection().execute(
+                "INSERT INTO jobs (id, kind, payload, priority, status, attempts, max_attempts, available_at, "
+                "lease_owner, lease_expires, created_at, started_at) "
+                "VALUES (?, ?, ?, ?, 'running', 1, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), priority, max_attempts or self.max_attempts, now,
+                 worker_id, now + self.lease_seconds, now, now)
+            )
+        return job_id
+
+    def _recover_expired(self, conn: sqlite3.Connection, now: float):
+        """Возвращает в очередь задачи с истекшей арендой (воркер пропал)
+
+        Как и после ошибки, задача становится доступной через retry_delay(attempts):
+        если ее роняет сама задача, воркеры не перезапускают ее без паузы.
+        """
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, lease_owner = NULL, "
+            "error = 'Lease expired after last attempt' "
+            "WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts",
+            (now, now)
+        )
+        rows = conn.execute(
+            "SELECT id, attempts FROM jobs WHERE status = 'running' AND lease_expires < ?", (now,)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE jobs SET status = 'queued', available_at = ?, lease_owner = NULL, lease_expires = NULL, "
+            "error = 'Lease expired' WHERE id = ?",
+            [(now + self.retry_delay(row["attempts"]), row["id"]) for row in rows]
+        )
+        for row in rows:
+            logger.warning(f"Job {row['id']} lease expired (attempt {row['attempts']}), requeued with backoff")
+
+    def claim(self, worker_id: str, kinds: Optional[List[str]] = None,
+              job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Атомарно захватывает самую приоритетную готовую задачу или возвращает None
+
+        job_id - захватить только эту задачу (если она в очереди и ее время пришло).
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._recover_expired(conn, now)
+            query = "SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ?"
+            params: List[Any] = [now]
+            if kinds:
+                query += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+                params.extend(kinds)
+            if job_id:
+                query += " AND id = ?"
+                params.append(job_id)
+            row = conn.execute(query + " ORDER BY priority DESC, available_at LIMIT 1", params).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?, lease_expires = ?, "
+                "started_at = ?, error = NULL WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row["id"])
+            )
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self._to_dict(job)
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Продлевает аренду; False - аренда потеряна и задачу нужно бросить"""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = 'running' AND lease_owner = ?",
+            (time.time() + self.lease_seconds, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: Optional[Dict[str, Any]] = None) -> bool:
+        """Отмечает задачу выполненной (только владельцем аренды)"""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'completed', finished_at = ?, result = ?, lease_owner = NULL, lease_expires = NULL "
+            "WHERE id = ? AND status = 'running' AND lease_owner = ?",
+            (time.time(), json.dumps(result, default=str) if result is not None else None, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def retry_delay(self, attempts: int) -> float:
+        """Задержка перед следующей попыткой: retry_backoff * 2^(attempts-1), не больше max_retry_delay"""
+        return min(self.retry_backoff * (2 ** max(0, attempts - 1)), self.max_retry_delay)
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> Optional[str]:
+        """Сообщает об ошибке: задача уходит на повтор с задержкой или в failed
+
+        Возвращает новый статус задачи или None, если аренда уже потеряна.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (job_id, worker_id)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            if row["attempts"] < row["max_attempts"]:
+                status = "queued"
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', available_at = ?, error = ?, lease_owner = NULL, "
+                    "lease_expires = NULL WHERE id = ?",
+                    (now + self.retry_delay(row["attempts"]), error, job_id)
+                )
+            else:
+                status = "failed"
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, lease_owner = NULL, "
+                    "lease_expires = NULL WHERE id = ?",
+                    (now, error, job_id)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if status == "queued":
+            logger.warning(f"Job {job_id} failed (attempt {row['attempts']}/{row['max_attempts']}), will retry: {error}")
+        return status
+
+    def fail_orphaned(self, kind: str, owner_alive: Callable[[str], bool],
+                      error: str = "Owner process exited") -> List[str]:
+        """Переводит в failed выполняющиеся задачи вида kind, чей владелец аренды больше не работает
+
+        Для задач, которые выполняет только поставивший их процесс: после его
+        падения продолжить их некому, и ждать истечения аренды незачем.
+        owner_alive(lease_owner) - жив ли владелец.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, lease_owner FROM jobs WHERE kind = ? AND status = 'running'", (kind,)
+            ).fetchall()
+            orphaned = [row["id"] for row in rows if not owner_alive(row["lease_owner"] or "")]
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, lease_owner = NULL, "
+                "lease_expires = NULL WHERE id = ?",
+                [(time.time(), error, job_id) for job_id in orphaned]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for job_id in orphaned:
+            logger.warning(f"Job {job_id}: owner process exited, marked failed")
+        return orphaned
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Текущее состояние задачи"""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def list_jobs(self, status: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Задачи в заданном состоянии (очередь - в порядке захвата, остальные - свежие первыми)"""
+        if status == "queued":
+            order = "priority DESC, available_at"
+        elif status == "running":
+            order = "lease_expires"
+        else:
+            order = "finished_at DESC"
+        rows = self._connection().execute(
+            f"SELECT * FROM jobs WHERE status = ? ORDER BY {order} LIMIT ?", (status, limit)
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        """Число задач в каждом состоянии"""
+        conn = self._connection()
+        return {
+            status: conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+            for status in self.STATUSES
+        }
+
+    def evict(self) -> List[str]:
+        """Удаляет завершенные задачи старше retention_seconds (для StorageJanitor)
+
+        Задачи, которые никто не захватил за retention_seconds (их владелец
+        пропал, а ожидающего запроса уже нет), удаляются так же.
+        """
+        conn = self._connection()
+        cutoff = time.time() - self.retention_seconds
+        removed = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for status, column in (("completed", "finished_at"), ("failed", "finished_at"), ("queued", "available_at")):
+                rows = conn.execute(
+                    f"SELECT id FROM jobs WHERE status = ? AND {column} < ?", (status, cutoff)
+                ).fetchall()
+                conn.executemany("DELETE FROM jobs WHERE id = ?", [(row["id"],) for row in rows])
+                removed.extend(row["id"] for row in rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
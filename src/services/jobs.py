@@ -0,0 +1,116 @@
+import os
+import re
+import json
+import time
+import logging
+from typing import Dict, Any, Tuple, Optional
+
+from fastapi import HTTPException
+
+from .storage import JobWorkspace, WorkspaceManager
+
+logger = logging.getLogger(__name__)
+
+
+class JobRegistry:
+    """Реестр завершенных видео-задач, чьи исходники еще хранятся на диске
+
+    После обработки рабочая директория задачи не удаляется: в ней остаются
+    исходное видео и job.json с хешем содержимого и параметрами. По ним можно
+    без повторной загрузки выполнить отложенный рендер в полном разрешении.
+    Директория живет WORKSPACE_TTL_HOURS с последнего обращения, затем ее
+    удаляет уборщик.
+    """
+
+    RECORD_NAME = "job.json"
+    _ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+    # Параметры, которые нельзя (или не нужно) сохранять в job.json
+    _TRANSIENT_OPTIONS = ("precomputed_filters",)
+
+    def __init__(self, workspaces: WorkspaceManager):
+        self.workspaces = workspaces
+
+    def _record_path(self, job_id: str) -> str:
+        return os.path.join(self.workspaces.root, job_id, self.RECORD_NAME)
+
+    def _save(self, workspace: JobWorkspace, record: Dict[str, Any]):
+        path = workspace.file_path(self.RECORD_NAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump(record, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def output_kind(options: Dict[str, Any]) -> str:
+        """Вид результата задачи по ее параметрам"""
+        if options.get("variants"):
+            return "variants"
+        if options.get("hls"):
+            return "hls"
+        if options.get("stream"):
+            return "stream"
+        return "review" if options.get("max_dimension") else "full"
+
+    def register(self, workspace: JobWorkspace, filename: str, content_hash: str,
+                 options: Dict[str, Any], result: Dict[str, Any], status: str = "completed") -> Dict[str, Any]:
+        """Сохраняет сведения о задаче рядом с ее исходным видео"""
+        record = {
+            "job_id": workspace.job_id,
+            "filename": os.path.basename(filename),
+            "content_hash": content_hash,
+            "options": {k: v for k, v in options.items() if k not in self._TRANSIENT_OPTIONS},
+            "outputs": {self.output_kind(options): result.get("output_filename")},
+            "status": status,
+            "created_at": time.time()
+        }
+        self._save(workspace, record)
+        return record
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        """Возвращает запись задачи и продлевает срок хранения ее директории"""
+        if not self._ID_PATTERN.match(job_id):
+            raise HTTPException(status_code=404, detail="Job not found")
+        path = self._record_path(job_id)
+        try:
+            with open(path, "r") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        # Уборщик смотрит на mtime директории
+        try:
+            os.utime(os.path.dirname(path))
+        except OSError:
+            pass
+        return record
+
+    def acquire(self, job_id: str) -> Tuple[JobWorkspace, Dict[str, Any]]:
+        """Открывает задачу для работы, защищая ее директорию от уборщика
+
+        Директорию нужно вернуть через workspaces.release(workspace, remove=False).
+        """
+        record = self.get(job_id)
+        workspace = self.workspaces.create(job_id)
+        if not os.path.exists(workspace.file_path(record["filename"])):
+            self.workspaces.release(workspace, remove=False)
+            raise HTTPException(status_code=410, detail="Job source video is no longer available")
+        return workspace, record
+
+    def set_output(self, workspace: JobWorkspace, kind: str, output_filename: str):
+        """Запоминает имя готового файла заданного вида (review/full/stream/hls/variants)"""
+        record = self.get(workspace.job_id)
+        record["outputs"][kind] = output_filename
+        self._save(workspace, record)
+
+    def set_estimate(self, workspace: JobWorkspace, predicted_seconds: float):
+        """Запоминает прогноз длительности задачи, отсчет - с текущего момента"""
+        record = self.get(workspace.job_id)
+        record["estimate"] = {"predicted_seconds": predicted_seconds, "started_at": time.time()}
+        self._save(workspace, record)
+
+    def set_status(self, workspace: JobWorkspace, status: str, error: Optional[str] = None):
+        """Обновляет состояние задачи (processing/completed/failed)"""
+        record = self.get(workspace.job_id)
+        record["status"] = status
+        if error:
+            record["error"] = error
+        self._save(workspace, record)
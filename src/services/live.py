@@ -0,0 +1,140 @@
+import json
+import time
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from fastapi import WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from ..dive_color_corrector.live import LiveCorrector
+
+logger = logging.getLogger(__name__)
+
+LIVE_FORMATS = ("jpeg", "raw")
+
+
+class LiveSession:
+    """Сессия живой коррекции кадров по WebSocket
+
+    Протокол: клиент шлет бинарные сообщения - JPEG или сырые BGR24-кадры
+    (format=raw, размер width x height), сервер отвечает кадром в том же
+    формате и следом текстовым JSON со статистикой кадра (задержка, число
+    пропущенных кадров). Текстовое сообщение {"type": "reset"} сбрасывает
+    оценку фильтра (например, при смене сцены).
+
+    Прием и обработка разнесены: пока кадр обрабатывается, новые кадры
+    вытесняют друг друга, и в работу идет только самый свежий. Так очередь
+    не растет, а задержка не копится, если клиент шлет быстрее, чем успеваем.
+    """
+
+    active = 0
+
+    def __init__(self, websocket: WebSocket, fmt: str = "jpeg", width: int = 0, height: int = 0,
+                 jpeg_quality: int = 75, refresh_interval: int = 15, smoothing: float = 0.2,
+                 max_frame_bytes: int = 8 * 1024 * 1024):
+        self.websocket = websocket
+        self.fmt = fmt
+        self.width = width
+        self.height = height
+        self.jpeg_quality = jpeg_quality
+        self.max_frame_bytes = max_frame_bytes
+        self.corrector = LiveCorrector(refresh_interval, smoothing)
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self._pending: Optional[Tuple[int, bytes, float]] = None
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def _decode(self, data: bytes) -> Optional[np.ndarray]:
+        if self.fmt == "raw":
+            if len(data) != self.width * self.height * 3:
+                return None
+            return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 3)
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def _correct(self, data: bytes) -> Optional[bytes]:
+        """Декодирует, корректирует и кодирует один кадр (в пуле потоков)"""
+        frame = self._decode(data)
+        if frame is None:
+            return None
+        corrected = self.corrector.process(frame)
+        if self.fmt == "raw":
+            return corrected.tobytes()
+        _, encoded = cv2.imencode('.jpg', corrected, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        return encoded.tobytes()
+
+    async def _receive(self):
+        """Принимает сообщения клиента; непринятый в работу кадр заменяется новым"""
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    data = message["bytes"]
+                    if len(data) > self.max_frame_bytes:
+                        continue
+                    self.received += 1
+                    if self._pending is not None:
+                        self.dropped += 1
+                    self._pending = (self.received, data, time.perf_counter())
+                    self._ready.set()
+                elif message.get("text"):
+                    try:
+                        command = json.loads(message["text"])
+                    except ValueError:
+                        continue
+                    if isinstance(command, dict) and command.get("type") == "reset":
+                        self.corrector = LiveCorrector(self.corrector.refresh_interval, self.corrector.smoothing)
+        finally:
+            self._closed = True
+            self._ready.set()
+
+    async def run(self):
+        """Обслуживает соединение до отключения клиента"""
+        LiveSession.active += 1
+        receiver = asyncio.create_task(self._receive())
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                if self._closed:
+                    break
+                if self._pending is None:
+                    continue
+
+                seq, data, received_at = self._pending
+                self._pending = None
+                started_at = time.perf_counter()
+                result = await run_in_threadpool(self._correct, data)
+                finished_at = time.perf_counter()
+
+                if result is None:
+                    await self.websocket.send_text(json.dumps({"type": "error", "seq": seq, "error": "Invalid frame"}))
+                    continue
+
+                await self.websocket.send_bytes(result)
+                self.processed += 1
+                await self.websocket.send_text(json.dumps({
+                    "type": "stats",
+                    "seq": seq,
+                    "queue_ms": round((started_at - received_at) * 1000, 2),
+                    "process_ms": round((finished_at - started_at) * 1000, 2),
+                    "latency_ms": round((time.perf_counter() - received_at) * 1000, 2),
+                    "processed": self.processed,
+                    "dropped": self.dropped
+                }))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            LiveSession.active -= 1
+            receiver.cancel()
+            try:
+                await receiver
+            except (asyncio.CancelledError, WebSocketDisconnect):
+                pass
+            logger.info(f"Live session closed: {self.processed} frames processed, {self.dropped} dropped")
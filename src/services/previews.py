@@ -0,0 +1,133 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Tuple
+
+from fastapi import HTTPException
+
+from .jobs import JobRegistry
+from ..dive_color_corrector.preview import FrameSeeker, get_keyframe_index, render_preview_frame, PREVIEW_MODES
+
+logger = logging.getLogger(__name__)
+
+
+class _PreviewSession:
+    """Открытый декодер и данные анализа одной задачи"""
+
+    def __init__(self, video_data: Dict[str, Any], seeker: FrameSeeker):
+        self.video_data = video_data
+        self.seeker = seeker
+        self.lock = threading.Lock()
+
+
+class PreviewService:
+    """Кадры предпросмотра для задач из реестра
+
+    Для каждой задачи держится сессия: video_data (из кеша анализа) и открытый
+    декодер, поэтому перемотка не требует повторного открытия файла. Индекс
+    ключевых кадров строится один раз и хранится в рабочей директории задачи.
+    Готовые JPEG кладутся в LRU: повторный запрос того же кадра не декодирует видео.
+    Методы синхронные и вызываются в интерактивной полосе выполнения:
+    предпросмотр не должен ждать очереди рендеров.
+    """
+
+    KEYFRAMES_NAME = "keyframes.json"
+
+    def __init__(self, jobs: JobRegistry, prepare_video_data: Callable[..., Dict[str, Any]],
+                 max_sessions: int, cache_size: int, jpeg_quality: int, max_width: int):
+        self.jobs = jobs
+        # (input_path, content_hash, options) -> video_data
+        self.prepare_video_data = prepare_video_data
+        self.max_sessions = max_sessions
+        self.cache_size = cache_size
+        self.jpeg_quality = jpeg_quality
+        self.max_width = max_width
+        self._sessions: "OrderedDict[str, _PreviewSession]" = OrderedDict()
+        self._frames: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load_keyframes(self, job_dir: str, input_path: str, fps: float):
+        path = os.path.join(job_dir, self.KEYFRAMES_NAME)
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        keyframes = get_keyframe_index(input_path, fps)
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(keyframes, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not save keyframe index: {str(e)}")
+        return keyframes
+
+    def _session(self, job_id: str) -> _PreviewSession:
+        with self._lock:
+            session = self._sessions.get(job_id)
+            if session is not None:
+                self._sessions.move_to_end(job_id)
+                return session
+
+        record = self.jobs.get(job_id)
+        job_dir = os.path.join(self.jobs.workspaces.root, job_id)
+        input_path = os.path.join(job_dir, record["filename"])
+        if not os.path.exists(input_path):
+            raise HTTPException(status_code=410, detail="Job source video is no longer available")
+
+        options = {k: v for k, v in record["options"].items() if k != "max_dimension"}
+        video_data = self.prepare_video_data(input_path, "", record["content_hash"], options)
+        keyframes = self._load_keyframes(job_dir, input_path, video_data["fps"])
+        session = _PreviewSession(video_data, FrameSeeker(input_path, keyframes))
+
+        with self._lock:
+            existing = self._sessions.get(job_id)
+            if existing is not None:
+                session.seeker.release()
+                return existing
+            self._sessions[job_id] = session
+            while len(self._sessions) > self.max_sessions:
+                _, old = self._sessions.popitem(last=False)
+                with old.lock:
+                    old.seeker.release()
+        return session
+
+    def render(self, job_id: str, timestamp: float, width: int, mode: str) -> Tuple[bytes, int, float]:
+        """Возвращает (JPEG, номер кадра, точная метка времени кадра)"""
+        if mode not in PREVIEW_MODES:
+            raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(PREVIEW_MODES)}")
+        if timestamp < 0:
+            raise HTTPException(status_code=400, detail="t must be non-negative")
+        width = max(16, min(int(width), self.max_width))
+
+        session = self._session(job_id)
+        video_data = session.video_data
+        fps = video_data["fps"]
+        frame_number = min(int(round(timestamp * fps)) + 1, max(1, video_data["frame_count"]))
+        frame_timestamp = (frame_number - 1) / fps
+
+        key = (job_id, frame_number, width, mode)
+        with self._lock:
+            cached = self._frames.get(key)
+            if cached is not None:
+                self._frames.move_to_end(key)
+                return cached, frame_number, frame_timestamp
+
+        with session.lock:
+            frame = session.seeker.read(frame_number)
+        if frame is None:
+            raise HTTPException(status_code=404, detail=f"Frame at {timestamp}s could not be decoded")
+
+        jpeg = render_preview_frame(
+            frame, video_data["rotation_angle"], video_data["filters"], video_data["filter_indices"],
+            frame_number, width, mode, self.jpeg_quality
+        )
+
+        with self._lock:
+            self._frames[key] = jpeg
+            while len(self._frames) > self.cache_size:
+                self._frames.popitem(last=False)
+        return jpeg, frame_number, frame_timestamp
@@ -0,0 +1,193 @@
+import json
+import time
+import uuid
+import logging
+from typing import Optional, Dict, Any, List
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class RedisJobQueue:
+    """Распределенная очередь задач на Redis Streams
+
+    Задача - запись в потоке {prefix}:jobs (с полем job_id) и хеш {prefix}:job:<id>
+    с параметрами, состоянием, прогрессом и результатом. Воркеры читают поток
+    через группу потребителей: сообщение остается в списке ожидающих (PEL),
+    пока воркер не подтвердит его (XACK). Если воркер пропал и сообщение
+    не продлевалось дольше visibility_timeout, другой воркер заберет его через
+    XAUTOCLAIM. Число доставок ограничено max_attempts.
+
+    client - любой клиент с API redis-py (в тестах - fakeredis), ответы
+    должны декодироваться в строки (decode_responses=True).
+    """
+
+    GROUP = "workers"
+
+    def __init__(self, client, prefix: str = "dcc", visibility_timeout: float = 120, max_attempts: int = 3,
+                 result_ttl_seconds: int = 24 * 3600):
+        self.client = client
+        self.prefix = prefix
+        self.stream = f"{prefix}:jobs"
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl_seconds = result_ttl_seconds
+        self._group_ready = False
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisJobQueue":
+        """Очередь поверх Redis по адресу вида redis://host:6379/0"""
+        if redis is None:
+            raise RuntimeError("Для распределенной обработки нужен пакет redis")
+        return cls(redis.Redis.from_url(url, decode_responses=True), **kwargs)
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def _ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            self.client.xgroup_create(self.stream, self.GROUP, id="0", mkstream=True)
+        except Exception as e:
+            # Группа уже создана другим процессом
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    @staticmethod
+    def _decode(job_id: str, fields: Dict[str, str]) -> Dict[str, Any]:
+        job = dict(fields, id=job_id)
+        for name in ("payload", "progress", "result"):
+            if job.get(name):
+                job[name] = json.loads(job[name])
+        job["attempts"] = int(job.get("attempts", 0))
+        for name in ("created_at", "started_at", "finished_at"):
+            if job.get(name):
+                job[name] = float(job[name])
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        """Ставит задачу в поток и возвращает ее id"""
+        self._ensure_group()
+        job_id = job_id or uuid.uuid4().hex
+        pipe = self.client.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={
+            "kind": kind,
+            "payload": json.dumps(payload),
+            "status": "queued",
+            "attempts": 0,
+            "created_at": time.time()
+        })
+        pipe.xadd(self.stream, {"job_id": job_id})
+        pipe.execute()
+        return job_id
+
+    def _deliver(self, message_id: str, fields: Dict[str, str], consumer: str) -> Optional[Dict[str, Any]]:
+        """Отмечает доставку сообщения воркеру; None - попытки исчерпаны или задача пропала"""
+        job_id = fields.get("job_id")
+        key = self._job_key(job_id) if job_id else None
+        if not key or not self.client.exists(key):
+            self._ack(message_id)
+            return None
+
+        attempts = self.client.hincrby(key, "attempts", 1)
+        if attempts > self.max_attempts:
+            self._finish(job_id, message_id, "failed", error=f"Visibility timeout exceeded {self.max_attempts} times")
+            logger.warning(f"Job {job_id} dropped after {self.max_attempts} deliveries")
+            return None
+
+        self.client.hset(key, mapping={"status": "running", "consumer": consumer, "started_at": time.time()})
+        job = self._decode(job_id, self.client.hgetall(key))
+        job["message_id"] = message_id
+        return job
+
+    def claim(self, consumer: str, block_ms: int = 1000) -> Optional[Dict[str, Any]]:
+        """Берет задачу: сначала зависшие у пропавших воркеров, затем новые из потока"""
+        self._ensure_group()
+        reclaimed = self.client.xautoclaim(
+            self.stream, self.GROUP, consumer, min_idle_time=int(self.visibility_timeout * 1000), count=1
+        )
+        for message_id, fields in reclaimed[1]:
+            if fields:
+                return self._deliver(message_id, fields, consumer)
+            # Сообщение удалено из потока, но осталось в PEL
+            self._ack(message_id)
+
+        response = self.client.xreadgroup(self.GROUP, consumer, {self.stream: ">"}, count=1, block=block_ms)
+        for _, messages in response or []:
+            for message_id, fields in messages:
+                return self._deliver(message_id, fields, consumer)
+        return None
+
+    def heartbeat(self, job: Dict[str, Any], consumer: str) -> bool:
+        """Сбрасывает таймер видимости; False - задачу уже забрал другой воркер"""
+        pending = self.client.xpending_range(
+            self.stream, self.GROUP, min=job["message_id"], max=job["message_id"], count=1
+        )
+        if not pending or pending[0]["consumer"] != consumer:
+            return False
+        self.client.xclaim(self.stream, self.GROUP, consumer, 0, [job["message_id"]], justid=True)
+        return True
+
+    def progress(self, job_id: str, data: Dict[str, Any]):
+        """Публикует прогресс задачи"""
+        self.client.hset(self._job_key(job_id), "progress", json.dumps(data, default=str))
+
+    def _ack(self, message_id: str):
+        pipe = self.client.pipeline()
+        pipe.xack(self.stream, self.GROUP, message_id)
+        pipe.xdel(self.stream, message_id)
+        pipe.execute()
+
+    def _finish(self, job_id: str, message_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[str] = None):
+        key = self._job_key(job_id)
+        fields = {"status": status, "finished_at": time.time()}
+        if result is not None:
+            fields["result"] = json.dumps(result, default=str)
+        if error:
+            fields["error"] = error
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, self.result_ttl_seconds)
+        pipe.xack(self.stream, self.GROUP, message_id)
+        pipe.xdel(self.stream, message_id)
+        pipe.execute()
+
+    def complete(self, job: Dict[str, Any], result: Dict[str, Any]):
+        """Сохраняет результат и подтверждает сообщение"""
+        self._finish(job["id"], job["message_id"], "completed", result=result)
+
+    def fail(self, job: Dict[str, Any], error: str) -> str:
+        """Ошибка обработки: задача снова ставится в поток, пока не исчерпаны попытки"""
+        if job["attempts"] >= self.max_attempts:
+            self._finish(job["id"], job["message_id"], "failed", error=error)
+            return "failed"
+        pipe = self.client.pipeline()
+        pipe.hset(self._job_key(job["id"]), mapping={"status": "queued", "error": error})
+        pipe.xack(self.stream, self.GROUP, job["message_id"])
+        pipe.xdel(self.stream, job["message_id"])
+        pipe.xadd(self.stream, {"job_id": job["id"]})
+        pipe.execute()
+        return "queued"
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние, прогресс и результат задачи"""
+        fields = self.client.hgetall(self._job_key(job_id))
+        return self._decode(job_id, fields) if fields else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Длина потока, число задач в работе и активные воркеры"""
+        self._ensure_group()
+        pending = self.client.xpending(self.stream, self.GROUP)
+        consumers: List[Dict[str, Any]] = self.client.xinfo_consumers(self.stream, self.GROUP)
+        return {
+            "stream_length": self.client.xlen(self.stream),
+            "pending": pending["pending"],
+            "consumers": [{"name": c["name"], "pending": c["pending"], "idle_ms": c["idle"]} for c in consumers]
+        }
@@ -0,0 +1,124 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Optional, Dict, Any, Callable, Awaitable, Tuple
+
+from .storage import OutputStore
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при потоковом хешировании
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def new_content_hasher():
+    """Создает объект хеширования содержимого загрузок"""
+    return hashlib.sha256()
+
+
+class ResultCache:
+    """Кеш результатов, адресуемый по (хеш входа, параметры обработки, версия движка)
+
+    Сами результаты лежат в OutputStore и вытесняются им же; индекс хранит
+    только метаданные и проверяет наличие файла при каждом обращении.
+    Одинаковые запросы, пришедшие одновременно, ждут одну общую задачу.
+    """
+
+    def __init__(self, output_store: OutputStore):
+        self.output_store = output_store
+        self.index_dir = os.path.join(output_store.root, ".results")
+        self._inflight: Dict[str, asyncio.Future] = {}
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash: str, params: Dict[str, Any], engine_version: str) -> str:
+        """Строит ключ кеша из хеша входа, параметров и версии движка"""
+        payload = json.dumps(
+            {"input": content_hash, "params": params, "engine": engine_version},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.index_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает сохраненный результат, если выходной файл еще существует"""
+        index_path = self._index_path(key)
+        try:
+            with open(index_path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        output_path = self.output_store.path_for(entry["output_filename"])
+        if not os.path.exists(output_path):
+            # Результат вытеснен из хранилища - запись индекса больше не нужна
+            try:
+                os.remove(index_path)
+            except OSError:
+                pass
+            return None
+
+        self.output_store.touch(output_path)
+        return entry["result"]
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Сохраняет результат в индекс"""
+        entry = {
+            "output_filename": result["output_filename"],
+            "result": result
+        }
+        tmp_path = self._index_path(key) + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._index_path(key))
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not store cached result {key}: {str(e)}")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], str]:
+        """Возвращает (результат, источник): hit, coalesced или miss
+
+        Если запрос, выполняющий общую задачу, отменен (клиент отключился),
+        задачу заново запускает первый из еще ожидающих - своим compute.
+        """
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached, "hit"
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                return await self._compute(key, compute), "miss"
+
+            logger.info(f"Attaching request to in-flight job {key[:12]}")
+            # wait не отменяет общую задачу при отмене ожидающего и не
+            # бросает CancelledError, если отменили владельца
+            await asyncio.wait({inflight})
+            if not inflight.cancelled():
+                return inflight.result(), "coalesced"
+            logger.info(f"Owner of job {key[:12]} was cancelled, taking over")
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Выполняет compute как общую задачу для одинаковых запросов"""
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+            if result.get("status", "success") == "success":
+                self.put(key, result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; помечаем его обработанным
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
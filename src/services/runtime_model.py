@@ -0,0 +1,206 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+from ..dive_color_corrector.resources import effective_cpu_count
+
+logger = logging.getLogger(__name__)
+
+
+def job_features(probe: Dict[str, Any], mode: str, engine: str, cpu_count: Optional[int] = None) -> Dict[str, Any]:
+    """Признаки задачи для модели: метаданные видео, режим рендера и узел
+
+    cpu_count по умолчанию - ядра с учетом квоты cgroup, а не ядра хоста.
+    """
+    return {
+        "width": int(probe["width"]),
+        "height": int(probe["height"]),
+        "frames": int(probe["frames"]),
+        "codec": probe.get("codec") or "unknown",
+        "mode": mode,
+        "engine": engine,
+        "cpu_count": int(cpu_count or effective_cpu_count())
+    }
+
+
+def remaining_seconds(predicted: Optional[float], elapsed: float, progress: Optional[float] = None) -> Optional[float]:
+    """Оставшееся время задачи
+
+    В начале - прогноз модели минус прошедшее время; по мере роста прогресса
+    (0-100) оценка все больше опирается на фактическую скорость.
+    """
+    estimates = []
+    if predicted is not None:
+        estimates.append((max(0.0, predicted - elapsed), 1.0))
+    if progress and progress > 0:
+        share = min(progress, 100.0) / 100.0
+        estimates.append((elapsed * (1 - share) / share, share * 4))
+    if not estimates:
+        return None
+    total_weight = sum(weight for _, weight in estimates)
+    return round(sum(value * weight for value, weight in estimates) / total_weight, 1)
+
+
+def with_eta(progress_callback, predicted: Optional[float], started_at: Optional[float] = None):
+    """Оборачивает progress_callback: в каждое событие добавляется eta_seconds"""
+    if progress_callback is None:
+        return None
+    started_at = started_at or time.monotonic()
+
+    def callback(progress_data):
+        eta = remaining_seconds(predicted, time.monotonic() - started_at, progress_data.get("progress"))
+        return progress_callback(dict(progress_data, eta_seconds=eta) if eta is not None else progress_data)
+
+    return callback
+
+
+class RuntimeModel:
+    """Прогноз длительности обработки видео по статистике выполненных задач
+
+    После каждой задачи в SQLite записываются ее признаки (разрешение, число
+    кадров, кодек исходника, режим рендера, движок и число ядер узла) и время
+    этапов. Длительность новой задачи предсказывается по одним метаданным:
+    линейная регрессия (наименьшие квадраты) времени от пиксель-кадров на ядро
+    и числа кадров по последним window задачам той же группы. Группа
+    выбирается от точной (режим, движок, кодек) к общей, пока в ней не
+    наберется min_samples задач; если данных меньше - берется средняя скорость
+    по тем, что есть, а без истории прогноза нет (None).
+
+    Коэффициенты кешируются и пересчитываются только после новых записей.
+    Хранится не больше max_samples последних задач, лишние удаляет evict().
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS job_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            mode TEXT NOT NULL,
+            engine TEXT NOT NULL,
+            codec TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            frames INTEGER NOT NULL,
+            cpu_count INTEGER NOT NULL,
+            analysis_seconds REAL NOT NULL,
+            render_seconds REAL NOT NULL,
+            total_seconds REAL NOT NULL,
+            predicted_seconds REAL
+        );
+        CREATE INDEX IF NOT EXISTS job_stats_group ON job_stats (mode, engine, codec, id);
+    """
+
+    # Группы от точной к общей: столбцы, по которым отбираются задачи
+    _GROUPS = (("mode", "engine", "codec"), ("mode", "engine"), ("mode",), ())
+
+    def __init__(self, db_path: str, min_samples: int = 5, window: int = 200, max_samples: int = 5000):
+        self.db_path = db_path
+        self.min_samples = min_samples
+        self.window = window
+        self.max_samples = max_samples
+        self._local = threading.local()
+        # (группа, значения) -> (последний id в выборке, коэффициенты или скорость)
+        self._fits: Dict[Tuple, Tuple[int, Any]] = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(self._SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _design(width, height, frames, cpu_count) -> List[float]:
+        """Строка матрицы регрессии: [1, мегапиксель-кадры на ядро, тысячи кадров]"""
+        return [1.0, width * height * frames / max(1, cpu_count) / 1e6, frames / 1e3]
+
+    def record(self, features: Dict[str, Any], analysis_seconds: float, render_seconds: float,
+               predicted_seconds: Optional[float] = None):
+        """Сохраняет признаки и время этапов выполненной задачи"""
+        self._connection().execute(
+            "INSERT INTO job_stats (created_at, mode, engine, codec, width, height, frames, cpu_count, "
+            "analysis_seconds, render_seconds, total_seconds, predicted_seconds) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), features["mode"], features["engine"], features["codec"], features["width"],
+             features["height"], features["frames"], features["cpu_count"], analysis_seconds, render_seconds,
+             analysis_seconds + render_seconds, predicted_seconds)
+        )
+
+    def _samples(self, columns: Tuple[str, ...], features: Dict[str, Any]) -> List[sqlite3.Row]:
+        query = "SELECT id, width, height, frames, cpu_count, total_seconds FROM job_stats"
+        if columns:
+            query += " WHERE " + " AND ".join(f"{c} = ?" for c in columns)
+        return self._connection().execute(
+            query + " ORDER BY id DESC LIMIT ?", [features[c] for c in columns] + [self.window]
+        ).fetchall()
+
+    def _fit(self, rows: List[sqlite3.Row]):
+        """("lstsq", коэффициенты) при достаточной выборке, иначе ("rate", секунд на единицу)"""
+        x = np.array([self._design(r["width"], r["height"], r["frames"], r["cpu_count"]) for r in rows])
+        y = np.array([r["total_seconds"] for r in rows])
+        if len(rows) >= self.min_samples:
+            # Небольшая регуляризация: однотипные ролики дают вырожденную матрицу
+            ridge = 1e-3 * np.eye(x.shape[1])
+            ridge[0, 0] = 0
+            coef = np.linalg.solve(x.T @ x + ridge, x.T @ y)
+            return "lstsq", coef
+        return "rate", float(y.sum() / max(x[:, 1].sum(), 1e-9))
+
+    def predict(self, features: Dict[str, Any]) -> Optional[float]:
+        """Ожидаемая длительность задачи в секундах или None, если статистики нет"""
+        row = self._design(features["width"], features["height"], features["frames"], features["cpu_count"])
+        fallback = None
+        for columns in self._GROUPS:
+            key = (columns, tuple(features[c] for c in columns))
+            rows = self._samples(columns, features)
+            if not rows:
+                continue
+            with self._lock:
+                cached = self._fits.get(key)
+            if cached is None or cached[0] != rows[0]["id"]:
+                cached = (rows[0]["id"], self._fit(rows))
+                with self._lock:
+                    self._fits[key] = cached
+            method, params = cached[1]
+            if method == "lstsq":
+                return round(max(0.0, float(np.dot(params, row))), 1)
+            if fallback is None:
+                fallback = params * row[1]
+        return round(fallback, 1) if fallback is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Объем статистики по режимам и средняя ошибка прогнозов"""
+        conn = self._connection()
+        modes = {r["mode"]: r["n"] for r in conn.execute("SELECT mode, COUNT(*) AS n FROM job_stats GROUP BY mode")}
+        recent = conn.execute(
+            "SELECT total_seconds, predicted_seconds FROM job_stats WHERE predicted_seconds IS NOT NULL "
+            "ORDER BY id DESC LIMIT ?", (self.window,)
+        ).fetchall()
+        errors = [abs(r["predicted_seconds"] - r["total_seconds"]) / max(r["total_seconds"], 0.1) for r in recent]
+        return {
+            "samples": sum(modes.values()),
+            "modes": modes,
+            "mean_error_pct": round(100 * sum(errors) / len(errors), 1) if errors else None
+        }
+
+    def evict(self) -> List[str]:
+        """Удаляет записи старше последних max_samples (для StorageJanitor)"""
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT id FROM job_stats ORDER BY id DESC LIMIT -1 OFFSET ?", (self.max_samples,)
+        ).fetchall()
+        if rows:
+            conn.execute("DELETE FROM job_stats WHERE id <= ?", (rows[0]["id"],))
+        return [f"job_stats:{r['id']}" for r in rows]
@@ -0,0 +1,322 @@
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List
+
+import cv2
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+def probe_video(path: str, start: Optional[float] = None, end: Optional[float] = None) -> Dict[str, Any]:
+    """Метаданные видео из контейнера (без декодирования): размер кадра, fps, число кадров, кодек
+
+    Для отрезка frames - число кадров только в нем.
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+    finally:
+        cap.release()
+
+    if start is not None or end is not None:
+        first = int((start or 0) * fps)
+        last = frame_count if end is None else min(frame_count, int(math.ceil(end * fps)))
+        frame_count = max(1, last - first)
+    codec = "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ").lower()
+    return {"width": width, "height": height, "fps": fps, "frames": frame_count, "codec": codec or "unknown"}
+
+
+def estimate_video_cost(path: str, start: Optional[float] = None, end: Optional[float] = None) -> int:
+    """Стоимость обработки видео в пиксель-кадрах: ширина x высота x число кадров
+
+    Берется из метаданных контейнера (без декодирования); для отрезка -
+    только его кадры.
+    """
+    return video_cost(probe_video(path, start, end))
+
+
+def video_cost(probe: Dict[str, Any]) -> int:
+    """Стоимость в пиксель-кадрах по результату probe_video"""
+    return max(1, probe["width"] * probe["height"] * probe["frames"])
+
+
+def analysis_cost(probe: Dict[str, Any], sample_step: int) -> int:
+    """Стоимость анализа в пиксель-кадрах: обрабатывается каждый sample_step-й кадр"""
+    samples = int(math.ceil(probe["frames"] / max(1, sample_step)))
+    return max(1, probe["width"] * probe["height"] * samples)
+
+
+class _Waiter:
+    def __init__(self, cost: int, duration: Optional[float] = None):
+        self.cost = cost
+        self.duration = duration
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class CostScheduler:
+    """Допуск тяжелых задач по бюджету стоимости узла
+
+    Стоимость задачи - пиксель-кадры (см. estimate_video_cost). Одновременно
+    выполняются задачи с суммарной стоимостью не больше budget и числом не
+    больше max_concurrent; задача дороже всего бюджета выполняется одна.
+    Остальные ждут в очереди: первой запускается самая дешевая, а ожидание
+    снижает эффективную стоимость на aging_rate пиксель-кадров в секунду, так
+    что дорогие задачи не голодают. Если очередь уже дороже max_queued_cost,
+    новая задача отклоняется с 429 и Retry-After по наблюдаемой пропускной
+    способности (пиксель-кадров в секунду).
+
+    Если для задачи известна прогнозная длительность (duration, секунды), порядок
+    очереди и Retry-After считаются по ней: в пиксель-кадры она переводится
+    через текущую пропускную способность.
+
+    governor - необязательный ResourceGovernor: при нехватке памяти он снижает
+    число одновременных задач, а при паузе новые задачи получают 429.
+    """
+
+    def __init__(self, budget: int, max_concurrent: int, max_queued_cost: int, aging_rate: float,
+                 initial_throughput: float, name: str = "default", governor=None):
+        self.name = name
+        self.governor = governor
+        self.budget = budget
+        self.max_concurrent = max_concurrent
+        self.max_queued_cost = max_queued_cost
+        self.aging_rate = aging_rate
+        self.throughput = initial_throughput
+        self.running = 0
+        self.running_cost = 0
+        self._waiters: List[_Waiter] = []
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def queued_cost(self) -> int:
+        return sum(w.cost for w in self._waiters)
+
+    def _charge(self, cost: int) -> int:
+        # Задача дороже бюджета занимает его целиком
+        return min(cost, self.budget)
+
+    def _concurrency(self) -> int:
+        if self.governor is None:
+            return self.max_concurrent
+        return max(1, self.governor.concurrency_limit(self.max_concurrent))
+
+    def _fits(self, cost: int) -> bool:
+        if self.running == 0:
+            return True
+        return self.running < self._concurrency() and self.running_cost + self._charge(cost) <= self.budget
+
+    def _start(self, cost: int):
+        self.running += 1
+        self.running_cost += self._charge(cost)
+        self.admitted += 1
+
+    def _seconds(self, cost: int, duration: Optional[float] = None) -> float:
+        """Ожидаемое время задачи: прогноз, если есть, иначе по пропускной способности"""
+        return duration if duration is not None else cost / max(self.throughput, 1.0)
+
+    def retry_after(self, cost: int = 0, duration: Optional[float] = None) -> int:
+        """Через сколько секунд освободится место для задачи такой стоимости"""
+        backlog = self._seconds(self.running_cost) + sum(self._seconds(w.cost, w.duration) for w in self._waiters)
+        backlog += self._seconds(cost, duration)
+        return max(1, int(math.ceil(backlog)))
+
+    def _dispatch(self):
+        """Запускает ожидающие задачи, пока они помещаются в бюджет"""
+        while self._waiters:
+            now = time.monotonic()
+            waiter = min(
+                self._waiters,
+                key=lambda w: self._seconds(w.cost, w.duration) * self.throughput - self.aging_rate * (now - w.enqueued_at)
+            )
+            if not self._fits(waiter.cost):
+                break
+            self._waiters.remove(waiter)
+            self._start(waiter.cost)
+            waiter.future.set_result(True)
+
+    def _reject(self, cost: int, duration: Optional[float], reason: str):
+        self.rejected += 1
+        retry_after = self.retry_after(cost, duration)
+        logger.warning(f"Scheduler {self.name}: rejecting job of cost {cost} ({reason}), retry after {retry_after}s")
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy, retry later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def check(self, cost: int, duration: Optional[float] = None):
+        """Отклоняет задачу с 429, если acquire не допустил бы ее сейчас (место не занимается)
+
+        Для ответов, которые нельзя отменить после начала (поток SSE): допуск
+        проверяется до отправки заголовков.
+        """
+        cost = max(1, int(cost))
+        if self.governor is not None and self.governor.concurrency_limit(self.max_concurrent) == 0:
+            self._reject(cost, duration, "memory pressure")
+        if self._waiters and self.queued_cost + cost > self.max_queued_cost:
+            self._reject(cost, duration, "queue is full")
+
+    async def acquire(self, cost: int, duration: Optional[float] = None):
+        """Ждет места в бюджете или отклоняет задачу с 429
+
+        duration - прогноз длительности задачи в секундах (если есть).
+        """
+        cost = max(1, int(cost))
+        self.check(cost, duration)
+        if not self._waiters and self._fits(cost):
+            self._start(cost)
+            return
+
+        waiter = _Waiter(cost, duration)
+        self._waiters.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled():
+                # Место уже выделено - возвращаем его
+                self.release(cost)
+            raise
+
+    def release(self, cost: int, elapsed: Optional[float] = None):
+        """Освобождает бюджет и учитывает фактическую скорость обработки"""
+        cost = max(1, int(cost))
+        self.running -= 1
+        self.running_cost -= self._charge(cost)
+        if elapsed and elapsed > 0:
+            # Скользящая оценка пропускной способности для Retry-After
+            self.throughput = 0.8 * self.throughput + 0.2 * (cost / elapsed)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, cost: int, duration: Optional[float] = None):
+        """async with scheduler.slot(cost): ... - выполнение в рамках бюджета"""
+        await self.acquire(cost, duration)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(cost, time.monotonic() - started_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budget": self.budget,
+            "max_concurrent": self.max_concurrent,
+            "concurrency": self._concurrency(),
+            "running": self.running,
+            "running_cost": self.running_cost,
+            "queued": len(self._waiters),
+            "queued_cost": self.queued_cost,
+            "throughput": round(self.throughput),
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+
+def _percentiles(values) -> Dict[str, float]:
+    """p50/p95/p99 в миллисекундах"""
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+class ExecutionLane:
+    """Класс задержки со своим планировщиком, пулом потоков и метриками
+
+    Интерактивные запросы (изображения, кадры предпросмотра, анализ) и пакетные
+    рендеры видео идут в разные полосы: у каждой свой бюджет стоимости, свой
+    лимит параллельности и свои потоки, поэтому очередь видео не задерживает
+    ответ на изображение. Метрики - по последним latency_window задачам.
+    """
+
+    def __init__(self, name: str, scheduler: CostScheduler, latency_window: int = 1000):
+        self.name = name
+        self.scheduler = scheduler
+        self.executor = ThreadPoolExecutor(max_workers=scheduler.max_concurrent, thread_name_prefix=f"lane-{name}")
+        self.completed = 0
+        self.failed = 0
+        self._wait_times = deque(maxlen=latency_window)
+        self._latencies = deque(maxlen=latency_window)
+
+    @asynccontextmanager
+    async def slot(self, cost: int, duration: Optional[float] = None):
+        """async with lane.slot(cost): ... - место в бюджете полосы с учетом в метриках
+
+        Для задач, которые выполняются не в пуле полосы (например, на удаленном воркере).
+        """
+        submitted_at = time.perf_counter()
+        async with self.scheduler.slot(cost, duration):
+            self._wait_times.append(time.perf_counter() - submitted_at)
+            try:
+                yield
+            except BaseException:
+                # В том числе отмена: результат задачи никто не получил
+                self.failed += 1
+                raise
+            finally:
+                self._latencies.append(time.perf_counter() - submitted_at)
+        self.completed += 1
+
+    def check(self, cost: int, duration: Optional[float] = None):
+        """Заранее отклоняет задачу с 429, если полоса не допустила бы ее сейчас"""
+        self.scheduler.check(cost, duration)
+
+    async def run(self, func, *args, cost: int, duration: Optional[float] = None):
+        """Выполняет функцию в пуле полосы, дождавшись места в ее бюджете
+
+        Поток пула нельзя прервать, поэтому при отмене ожидающего запроса место
+        в бюджете остается занятым, пока функция не завершится: иначе полоса
+        допустила бы больше работы, чем позволяет бюджет. Такая задача
+        считается неудавшейся.
+        """
+        submitted_at = time.perf_counter()
+        await self.scheduler.acquire(cost, duration)
+        started_at = time.monotonic()
+        self._wait_times.append(time.perf_counter() - submitted_at)
+        abandoned = False
+
+        def finished(future):
+            self.scheduler.release(cost, time.monotonic() - started_at)
+            self._latencies.append(time.perf_counter() - submitted_at)
+            if abandoned or future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+        except BaseException:
+            self.scheduler.release(cost)
+            self.failed += 1
+            raise
+        future.add_done_callback(finished)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            abandoned = True
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            self.scheduler.stats(),
+            completed=self.completed,
+            failed=self.failed,
+            wait_ms=_percentiles(self._wait_times),
+            latency_ms=_percentiles(self._latencies)
+        )
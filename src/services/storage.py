@@ -0,0 +1,228 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+import threading
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorkspace:
+    """Изолированная рабочая директория одной задачи"""
+
+    def __init__(self, root: str, job_id: Optional[str] = None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.path = os.path.join(root, self.job_id)
+        os.makedirs(self.path, exist_ok=True)
+
+    def file_path(self, filename: str) -> str:
+        """Возвращает путь к файлу внутри рабочей директории"""
+        return os.path.join(self.path, os.path.basename(filename))
+
+    def cleanup(self):
+        """Удаляет рабочую директорию вместе со всем содержимым"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class WorkspaceManager:
+    """Создает рабочие директории задач и удаляет брошенные"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._active = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def create(self, job_id: Optional[str] = None) -> JobWorkspace:
+        """Создает новую рабочую директорию и помечает ее активной"""
+        workspace = JobWorkspace(self.root, job_id)
+        with self._lock:
+            self._active.add(workspace.job_id)
+        return workspace
+
+    def release(self, workspace: JobWorkspace, remove: bool = True):
+        """Снимает пометку активности и (по умолчанию) удаляет директорию"""
+        with self._lock:
+            self._active.discard(workspace.job_id)
+        if remove:
+            workspace.cleanup()
+
+    def sweep(self, max_age_seconds: int) -> List[str]:
+        """Удаляет неактивные рабочие директории старше max_age_seconds"""
+        removed = []
+        now = time.time()
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            with self._lock:
+                if name in self._active:
+                    continue
+            try:
+                if now - os.path.getmtime(path) < max_age_seconds:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                removed.append(path)
+                logger.info(f"Removed stale workspace: {path}")
+            except OSError as e:
+                logger.error(f"Error removing workspace {path}: {str(e)}")
+
+        return removed
+
+
+def path_size(path: str) -> int:
+    """Размер файла или суммарный размер каталога"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class OutputStore:
+    """Хранилище результатов с TTL и LRU-вытеснением по суммарному размеру
+
+    Время последнего обращения хранится в atime файла: оно выставляется явно
+    при записи результата и при каждом скачивании. Результат может быть и
+    каталогом (пакет HLS) - он учитывается и вытесняется целиком.
+    """
+
+    def __init__(self, root: str, ttl_seconds: int, max_bytes: int):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._pinned = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, filename: str) -> str:
+        """Возвращает путь к результату в корне хранилища (без вложенных путей)"""
+        return os.path.join(self.root, os.path.basename(filename))
+
+    def pin(self, path: str):
+        """Защищает файл от вытеснения (пока задача его пишет)"""
+        with self._lock:
+            self._pinned.add(os.path.basename(path))
+
+    def unpin(self, path: str):
+        """Снимает защиту и отмечает файл как только что использованный"""
+        with self._lock:
+            self._pinned.discard(os.path.basename(path))
+        self.touch(path)
+
+    def touch(self, path: str):
+        """Обновляет время последнего обращения к файлу"""
+        try:
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except OSError:
+            pass
+
+    def _entries(self) -> List[Dict[str, Any]]:
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(path)
+                size = path_size(path)
+            except FileNotFoundError:
+                # Удален одновременно с обходом (уборщик, другое вытеснение, задача)
+                continue
+            entries.append({
+                "name": name,
+                "path": path,
+                "size": size,
+                "last_access": max(stat.st_atime, stat.st_mtime)
+            })
+        return entries
+
+    def evict(self) -> List[str]:
+        """Удаляет просроченные файлы, затем самые давно использованные сверх лимита"""
+        removed = []
+        now = time.time()
+
+        with self._lock:
+            pinned = set(self._pinned)
+
+        all_entries = self._entries()
+        total_size = sum(e["size"] for e in all_entries)
+        entries = sorted(
+            (e for e in all_entries if e["name"] not in pinned),
+            key=lambda e: e["last_access"]
+        )
+
+        for entry in entries:
+            expired = now - entry["last_access"] > self.ttl_seconds
+            over_limit = total_size > self.max_bytes
+            if not expired and not over_limit:
+                continue
+            try:
+                if os.path.isdir(entry["path"]):
+                    shutil.rmtree(entry["path"])
+                else:
+                    os.remove(entry["path"])
+                total_size -= entry["size"]
+                removed.append(entry["path"])
+                logger.info(f"Evicted output file: {entry['path']} ({'ttl' if expired else 'lru'})")
+            except OSError as e:
+                logger.error(f"Error evicting file {entry['path']}: {str(e)}")
+
+        return removed
+
+
+class StorageJanitor:
+    """Фоновая задача, периодически чистящая хранилище вне пути запроса"""
+
+    def __init__(self, output_store: OutputStore, workspaces: WorkspaceManager,
+                 interval_seconds: int, workspace_ttl_seconds: int, caches=()):
+        self.output_store = output_store
+        self.workspaces = workspaces
+        # Дополнительные хранилища с методом evict() (например, кеш анализа)
+        self.caches = list(caches)
+        self.interval_seconds = interval_seconds
+        self.workspace_ttl_seconds = workspace_ttl_seconds
+        self._task = None
+
+    def run_once(self) -> Dict[str, int]:
+        """Выполняет один проход очистки"""
+        evicted = self.output_store.evict()
+        swept = self.workspaces.sweep(self.workspace_ttl_seconds)
+        for cache in self.caches:
+            evicted.extend(cache.evict())
+        if evicted or swept:
+            logger.info(f"Janitor: evicted {len(evicted)} outputs, removed {len(swept)} stale workspaces")
+        return {"evicted_outputs": len(evicted), "removed_workspaces": len(swept)}
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"Janitor error: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """Запускает фоновый цикл очистки в текущем event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        """Останавливает фоновый цикл очистки"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
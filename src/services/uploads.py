@@ -0,0 +1,279 @@
+import os
+import re
+import json
+import math
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Tuple, Dict, Any, Optional, List
+
+import aiofiles
+from fastapi import UploadFile, HTTPException
+
+from .result_cache import new_content_hasher, HASH_CHUNK_SIZE
+from .storage import JobWorkspace, WorkspaceManager
+
+logger = logging.getLogger(__name__)
+
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size allowed: {max_size // (1024*1024)}MB"
+    )
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: int = HASH_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Читает multipart-файл блоками фиксированного размера"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def stream_to_file(chunks: AsyncIterator[bytes], path: str, max_size: int, on_progress=None) -> Tuple[str, int]:
+    """Пишет поток блоков в файл, считая хеш и проверяя лимит по мере поступления
+
+    Возвращает (sha256, размер). При превышении лимита частичный файл удаляется
+    и выбрасывается HTTPException 413. on_progress(записано_байт) вызывается
+    после каждого блока, когда данные уже видны другим читателям файла.
+    """
+    hasher = new_content_hasher()
+    size = 0
+
+    try:
+        async with aiofiles.open(path, "wb") as buffer:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise _too_large(max_size)
+                hasher.update(chunk)
+                await buffer.write(chunk)
+                if on_progress:
+                    await buffer.flush()
+                    on_progress(size)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+
+    return hasher.hexdigest(), size
+
+
+def check_content_length(content_length, max_size: int):
+    """Отклоняет запрос заранее, если заявленный размер превышает лимит"""
+    try:
+        declared = int(content_length) if content_length is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if declared is not None and declared > max_size:
+        raise _too_large(max_size)
+
+
+class ResumableUploadManager:
+    """Возобновляемые загрузки по частям (в духе протокола tus)
+
+    Файл создается в рабочей директории задачи сразу нужного размера, каждая
+    часть пишется потоком прямо по своему смещению, поэтому части можно
+    присылать параллельно и в любом порядке, а сборка не требует копирования.
+    Состояние хранится в upload.json рядом с файлом и переживает перезапуск.
+    Незавершенная загрузка активной не считается: если она простаивает дольше
+    WORKSPACE_TTL_HOURS, уборщик удаляет ее как брошенную.
+    """
+
+    MANIFEST_NAME = "upload.json"
+    _ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+    def __init__(self, workspaces: WorkspaceManager, max_size: int, default_chunk_size: int, max_chunk_size: int):
+        self.workspaces = workspaces
+        self.max_size = max_size
+        self.default_chunk_size = default_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Части, которые пишутся прямо сейчас: upload_id -> число
+        self._writers: Dict[str, int] = {}
+
+    def _lock(self, upload_id: str) -> asyncio.Lock:
+        lock = self._locks.get(upload_id)
+        if lock is None:
+            lock = self._locks[upload_id] = asyncio.Lock()
+        return lock
+
+    def _open(self, upload_id: str) -> Tuple[JobWorkspace, Dict[str, Any]]:
+        """Находит загрузку по идентификатору (в т.ч. после перезапуска сервера)"""
+        if not self._ID_PATTERN.match(upload_id):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        manifest_path = os.path.join(self.workspaces.root, upload_id, self.MANIFEST_NAME)
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return JobWorkspace(self.workspaces.root, upload_id), manifest
+
+    def _save_manifest(self, workspace: JobWorkspace, manifest: Dict[str, Any]):
+        path = workspace.file_path(self.MANIFEST_NAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _chunk_count(manifest: Dict[str, Any]) -> int:
+        return max(1, math.ceil(manifest["total_size"] / manifest["chunk_size"]))
+
+    @staticmethod
+    def _chunk_length(manifest: Dict[str, Any], index: int) -> int:
+        offset = index * manifest["chunk_size"]
+        return min(manifest["chunk_size"], manifest["total_size"] - offset)
+
+    def create(self, filename: str, total_size: int, chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """Создает загрузку и резервирует файл нужного размера"""
+        if total_size <= 0:
+            raise HTTPException(status_code=400, detail="Upload size must be positive")
+        if total_size > self.max_size:
+            raise _too_large(self.max_size)
+        chunk_size = chunk_size or self.default_chunk_size
+        if chunk_size <= 0 or chunk_size > self.max_chunk_size:
+            raise HTTPException(status_code=400, detail=f"Chunk size must be between 1 and {self.max_chunk_size} bytes")
+
+        workspace = JobWorkspace(self.workspaces.root)
+        filename = os.path.basename(filename) or "video.mp4"
+        with open(workspace.file_path(filename), "wb") as f:
+            f.truncate(total_size)
+
+        manifest = {
+            "upload_id": workspace.job_id,
+            "filename": filename,
+            "total_size": total_size,
+            "chunk_size": chunk_size,
+            "received": [],
+            "state": "uploading",
+            "created_at": time.time()
+        }
+        self._save_manifest(workspace, manifest)
+        logger.info(f"Created resumable upload {workspace.job_id}: {filename}, {total_size} bytes")
+        return self._describe(manifest)
+
+    def _describe(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """Сводка состояния загрузки: принятые диапазоны байт и недостающие части"""
+        chunk_count = self._chunk_count(manifest)
+        received = sorted(manifest["received"])
+        ranges = []
+        for index in received:
+            start = index * manifest["chunk_size"]
+            end = start + self._chunk_length(manifest, index)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+
+        received_set = set(received)
+        return {
+            "upload_id": manifest["upload_id"],
+            "filename": manifest["filename"],
+            "state": manifest["state"],
+            "total_size": manifest["total_size"],
+            "chunk_size": manifest["chunk_size"],
+            "chunk_count": chunk_count,
+            "received_bytes": sum(end - start for start, end in ranges),
+            "received_ranges": ranges,
+            "missing_chunks": [i for i in range(chunk_count) if i not in received_set]
+        }
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        """Возвращает состояние загрузки"""
+        workspace, manifest = self._open(upload_id)
+        return self._describe(manifest)
+
+    async def put_chunk(self, upload_id: str, index: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Пишет часть index потоком прямо по ее смещению в итоговом файле
+
+        Части одной загрузки пишутся параллельно, но не после начала finalize:
+        состояние проверяется и запись регистрируется под блокировкой загрузки,
+        а finalize не начинается, пока есть незавершенные записи. Иначе
+        повторная часть могла бы переписать файл, который уже хешируется.
+        """
+        async with self._lock(upload_id):
+            workspace, manifest = self._open(upload_id)
+            if manifest["state"] != "uploading":
+                raise HTTPException(status_code=409, detail="Upload is already finalized")
+            if index < 0 or index >= self._chunk_count(manifest):
+                raise HTTPException(status_code=416, detail="Chunk index out of range")
+            self._writers[upload_id] = self._writers.get(upload_id, 0) + 1
+
+        try:
+            expected = self._chunk_length(manifest, index)
+            written = 0
+            async with aiofiles.open(workspace.file_path(manifest["filename"]), "r+b") as f:
+                await f.seek(index * manifest["chunk_size"])
+                async for data in chunks:
+                    written += len(data)
+                    if written > expected:
+                        raise HTTPException(status_code=400, detail=f"Chunk {index} must be exactly {expected} bytes")
+                    await f.write(data)
+
+            if written != expected:
+                raise HTTPException(status_code=400, detail=f"Chunk {index} must be exactly {expected} bytes, got {written}")
+
+            # Манифест обновляем под блокировкой: части одной загрузки идут параллельно
+            async with self._lock(upload_id):
+                _, manifest = self._open(upload_id)
+                if index not in manifest["received"]:
+                    manifest["received"].append(index)
+                    self._save_manifest(workspace, manifest)
+        finally:
+            self._writers[upload_id] -= 1
+            if not self._writers[upload_id]:
+                del self._writers[upload_id]
+        return self._describe(manifest)
+
+    async def finalize(self, upload_id: str) -> Tuple[JobWorkspace, str, str, str]:
+        """Проверяет полноту загрузки и возвращает (workspace, путь, имя файла, хеш)"""
+        async with self._lock(upload_id):
+            workspace, manifest = self._open(upload_id)
+            if manifest["state"] != "uploading":
+                raise HTTPException(status_code=409, detail="Upload is already finalized")
+            if self._writers.get(upload_id):
+                raise HTTPException(status_code=409, detail="Chunks are still being written, retry finalize")
+            missing = self._describe(manifest)["missing_chunks"]
+            if missing:
+                raise HTTPException(status_code=409, detail=f"Upload incomplete, missing chunks: {missing[:20]}")
+            manifest["state"] = "finalized"
+            self._save_manifest(workspace, manifest)
+            # С этого момента директория принадлежит задаче обработки
+            workspace = self.workspaces.create(upload_id)
+
+        self._locks.pop(upload_id, None)
+        input_path = workspace.file_path(manifest["filename"])
+        content_hash = await asyncio.to_thread(hash_file, input_path)
+        return workspace, input_path, manifest["filename"], content_hash
+
+    def abort(self, upload_id: str):
+        """Отменяет загрузку и удаляет принятые данные"""
+        workspace, manifest = self._open(upload_id)
+        if manifest["state"] != "uploading":
+            raise HTTPException(status_code=409, detail="Upload is already finalized")
+        self._locks.pop(upload_id, None)
+        workspace.cleanup()
+
+    def evict(self) -> List[str]:
+        """Забывает блокировки загрузок, удаленных уборщиком как брошенные (для StorageJanitor)"""
+        removed = [
+            upload_id for upload_id in list(self._locks)
+            if not self._writers.get(upload_id) and not os.path.isdir(os.path.join(self.workspaces.root, upload_id))
+        ]
+        for upload_id in removed:
+            self._locks.pop(upload_id, None)
+        return removed
+
+
+def hash_file(path: str) -> str:
+    """Считает хеш содержимого уже записанного файла"""
+    hasher = new_content_hasher()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
@@ -1,170 +1,907 @@
 import os
-import tempfile
-import uuid
-from typing import Optional, Generator, Dict, Any
+import time
+import socket
+import asyncio
+import threading
+from functools import partial
+from typing import Optional, Generator, AsyncIterator, Dict, Any
 import cv2
 import numpy as np
+import aiofiles
 from fastapi import UploadFile, HTTPException
+from starlette.concurrency import run_in_threadpool
 import logging
 
-from ..dive_color_corrector.mobile_correct import correct_image_mobile, analyze_video_mobile, process_video_mobile
+from ..dive_color_corrector.mobile_correct import (
+    correct_image_mobile, analyze_video_mobile, process_video_mobile, analyze_image_mobile,
+    map_proxy_analysis, warm_up_worker, get_sample_step,
+    get_processing_params, get_analysis_params, get_engine_mode, ENGINE_VERSION
+)
+from ..config.settings import settings
+from .storage import JobWorkspace, WorkspaceManager, OutputStore, StorageJanitor, path_size
+from .result_cache import ResultCache
+from .uploads import iter_upload_file, stream_to_file, ResumableUploadManager
+from .analysis_cache import AnalysisCache
+from .jobs import JobRegistry
+from .job_queue import JobQueue
+from .previews import PreviewService
+from .scheduler import CostScheduler, ExecutionLane, analysis_cost, probe_video, video_cost
+from .runtime_model import RuntimeModel, job_features, remaining_seconds, with_eta
+from ..dive_color_corrector.progressive import ProgressiveAnalyzer
+from ..dive_color_corrector.writers import is_ffmpeg_available, parse_renditions, FFmpegHLSWriter
+from ..dive_color_corrector.variants import process_video_variants, parse_variants
+from ..dive_color_corrector.resources import get_governor, effective_cpu_count
+from ..dive_color_corrector.threads import configure_thread_budget
+from ..dive_color_corrector.frame_scheduler import get_frame_scheduler
 
 logger = logging.getLogger(__name__)
 
 class VideoProcessor:
-    def __init__(self, upload_dir: str = "uploads", output_dir: str = "outputs"):
+    def __init__(self, upload_dir: str = settings.UPLOAD_DIR, output_dir: str = settings.OUTPUT_DIR):
         self.upload_dir = upload_dir
         self.output_dir = output_dir
         self._ensure_directories()
-    
+        # Потоки OpenCV/BLAS и ffmpeg - из одного бюджета узла; кодировщиков
+        # одновременно столько же, сколько рендеров
+        configure_thread_budget(
+            settings.THREAD_BUDGET, settings.PIN_WORKERS, settings.MAX_CONCURRENT_JOBS, settings.THREAD_BUDGET_MAIN
+        )
+
+        self.workspaces = WorkspaceManager(self.upload_dir)
+        self.output_store = OutputStore(
+            self.output_dir,
+            ttl_seconds=settings.OUTPUT_TTL_HOURS * 3600,
+            max_bytes=settings.OUTPUT_MAX_SIZE
+        )
+        self.analysis_cache = AnalysisCache(
+            settings.ANALYSIS_CACHE_DIR,
+            max_bytes=settings.ANALYSIS_CACHE_MAX_SIZE
+        )
+        self.queue = JobQueue(
+            settings.QUEUE_DB_PATH,
+            lease_seconds=settings.QUEUE_LEASE_SECONDS,
+            max_attempts=settings.QUEUE_MAX_ATTEMPTS,
+            retry_backoff=settings.QUEUE_RETRY_BACKOFF,
+            retention_seconds=settings.QUEUE_RETENTION_HOURS * 3600
+        )
+        # Владелец аренды задач, которые выполняет этот процесс
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.recover_local_jobs()
+        # Статистика выполненных задач для прогноза длительности
+        self.runtime_model = RuntimeModel(
+            settings.JOB_STATS_DB_PATH,
+            min_samples=settings.ETA_MIN_SAMPLES,
+            window=settings.ETA_WINDOW,
+            max_samples=settings.ETA_MAX_SAMPLES
+        )
+        self.janitor = StorageJanitor(
+            self.output_store,
+            self.workspaces,
+            interval_seconds=settings.JANITOR_INTERVAL,
+            workspace_ttl_seconds=settings.WORKSPACE_TTL_HOURS * 3600,
+            caches=[self.analysis_cache, self.queue, self.runtime_model]
+        )
+        # Распределенная обработка: тяжелые задачи выполняют воркеры через Redis
+        self.remote_queue = None
+        if settings.DISTRIBUTED_WORKERS:
+            from .worker import create_queue
+            self.remote_queue = create_queue()
+        self.result_cache = ResultCache(self.output_store)
+        self.uploads = ResumableUploadManager(
+            self.workspaces,
+            max_size=settings.MAX_FILE_SIZE,
+            default_chunk_size=settings.UPLOAD_CHUNK_SIZE,
+            max_chunk_size=settings.MAX_UPLOAD_CHUNK_SIZE
+        )
+        # Блокировки брошенных загрузок уходят вместе с их директориями
+        self.janitor.caches.append(self.uploads)
+        self.jobs = JobRegistry(self.workspaces)
+        # Фоновые задачи с потоковым выводом: job_id -> asyncio.Task
+        self._stream_jobs: Dict[str, asyncio.Task] = {}
+        # Последнее событие прогресса выполняющихся задач (локальных и на воркерах): job_id -> событие
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        self.previews = PreviewService(
+            self.jobs,
+            self._prepare_video_data,
+            max_sessions=settings.PREVIEW_MAX_SESSIONS,
+            cache_size=settings.PREVIEW_CACHE_SIZE,
+            jpeg_quality=settings.PREVIEW_JPEG_QUALITY,
+            max_width=settings.PREVIEW_MAX_WIDTH
+        )
+        # Полосы выполнения: рендеры видео не занимают место интерактивных запросов.
+        # В каждой ограничены число и суммарная стоимость одновременных задач
+        self.lanes = {
+            "interactive": ExecutionLane("interactive", CostScheduler(
+                budget=settings.INTERACTIVE_COST_BUDGET,
+                max_concurrent=settings.INTERACTIVE_MAX_CONCURRENT,
+                max_queued_cost=settings.INTERACTIVE_MAX_QUEUED_COST,
+                aging_rate=settings.SCHEDULER_AGING_RATE,
+                initial_throughput=settings.SCHEDULER_THROUGHPUT,
+                name="interactive"
+            )),
+            "batch": ExecutionLane("batch", CostScheduler(
+                budget=settings.NODE_COST_BUDGET,
+                max_concurrent=settings.MAX_CONCURRENT_JOBS,
+                max_queued_cost=settings.MAX_QUEUED_COST,
+                aging_rate=settings.SCHEDULER_AGING_RATE,
+                initial_throughput=settings.SCHEDULER_THROUGHPUT,
+                name="batch",
+                # Рендеры видео сдерживаются по памяти контейнера
+                governor=get_governor()
+            ))
+        }
+
     def _ensure_directories(self):
         """Создает необходимые директории если они не существуют"""
         os.makedirs(self.upload_dir, exist_ok=True)
         os.makedirs(self.output_dir, exist_ok=True)
-    
-    def _get_temp_path(self, filename: str, suffix: str = "") -> str:
-        """Генерирует временный путь для файла"""
-        unique_id = str(uuid.uuid4())
-        name, ext = os.path.splitext(filename)
-        return os.path.join(self.upload_dir, f"{unique_id}_{name}{suffix}{ext}")
-    
-    def _get_output_path(self, filename: str, suffix: str = "_corrected") -> str:
-        """Генерирует путь для выходного файла"""
-        name, ext = os.path.splitext(filename)
-        
-        # Используем .mp4 для всех поддерживаемых кодеков
-        output_ext = '.mp4'
-            
-        return os.path.join(self.output_dir, f"{name}{suffix}{output_ext}")
-    
+
+    def _get_temp_path(self, workspace: JobWorkspace, filename: str) -> str:
+        """Генерирует путь для входного файла внутри рабочей директории задачи"""
+        return workspace.file_path(filename)
+
+    def _get_output_path(self, filename: str, job_id: str, suffix: str = "_corrected", output_ext: str = ".mp4") -> str:
+        """Генерирует уникальный для задачи путь выходного файла"""
+        name, _ = os.path.splitext(os.path.basename(filename))
+        return self.output_store.path_for(f"{name}_{job_id[:8]}{suffix}{output_ext}")
+
+    async def _save_upload(self, file: UploadFile, path: str) -> str:
+        """Сохраняет загруженный файл на диск блоками и возвращает хеш содержимого"""
+        content_hash, _ = await stream_to_file(iter_upload_file(file), path, settings.MAX_FILE_SIZE)
+        return content_hash
+
+    # Вид задач JobQueue, которые выполняет сам сервер (их не забирают воркеры
+    # scripts/setup_queue.py с задачами вида "video")
+    LOCAL_VIDEO_JOB = "video_render"
+
+    # Параметры задачи, от которых зависит результат (и ключ кеша результатов)
+    RESULT_OPTIONS = ("proxy_hash", "max_dimension", "start", "end", "stream", "hls", "variants")
+
+    def _cache_key(self, content_hash: str, kind: str, options: Optional[Dict[str, Any]] = None) -> str:
+        """Ключ кеша результата для загруженного файла"""
+        params = dict(get_processing_params(), kind=kind)
+        for name in self.RESULT_OPTIONS:
+            if options and options.get(name) is not None:
+                params[name] = options[name]
+        return ResultCache.make_key(content_hash, params, ENGINE_VERSION)
+
+    @staticmethod
+    def _output_suffix(options: Dict[str, Any]) -> str:
+        if options.get("variants"):
+            return "_variants"
+        suffix = "_review" if options.get("max_dimension") else "_corrected"
+        if options.get("hls"):
+            return suffix + "_hls"
+        return suffix + "_stream" if options.get("stream") else suffix
+
+    async def _run_job(self, func, *args, cost: int = settings.IMAGE_JOB_COST, lane: str = "batch",
+                       duration: Optional[float] = None):
+        """Выполняет тяжелую задачу в пуле потоков полосы, не блокируя event loop
+
+        cost - оценка стоимости в пиксель-кадрах для планировщика (по умолчанию - как изображение);
+        lane - "interactive" для быстрых запросов или "batch" для рендеров видео;
+        duration - прогноз длительности в секундах (порядок очереди и Retry-After).
+        """
+        return await self.lanes[lane].run(func, *args, cost=cost, duration=duration)
+
+    async def run_interactive(self, func, *args):
+        """Быстрый запрос (например, кадр предпросмотра) в интерактивной полосе"""
+        return await self._run_job(func, *args, lane="interactive")
+
+    def lane_stats(self) -> Dict[str, Any]:
+        """Метрики полос выполнения"""
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    async def _analysis_cost(self, input_path: str) -> int:
+        """Оценка стоимости анализа видео: анализируются только семплы, а не все кадры"""
+        probe = await run_in_threadpool(probe_video, input_path)
+        return analysis_cost(probe, get_sample_step(probe["fps"]))
+
+    def _job_features(self, input_path: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        """Признаки задачи для модели длительности (по метаданным, синхронно)"""
+        probe = probe_video(input_path, options.get("start"), options.get("end"))
+        return job_features(probe, JobRegistry.output_kind(options), get_engine_mode())
+
+    async def _estimate_job(self, input_path: str, options: Dict[str, Any]):
+        """(признаки, стоимость в пиксель-кадрах, прогноз длительности в секундах или None)"""
+        features = await run_in_threadpool(self._job_features, input_path, options)
+        predicted = await run_in_threadpool(self.runtime_model.predict, features)
+        return features, video_cost(features), predicted
+
+    def job_status(self, job_id: str) -> Dict[str, Any]:
+        """Запись задачи; для выполняющейся - последнее событие прогресса и оценка оставшегося времени"""
+        record = self.jobs.get(job_id)
+        if record["status"] != "processing":
+            return record
+        progress = self._progress.get(job_id)
+        if progress is not None:
+            record["progress"] = progress
+        estimate = record.get("estimate")
+        if progress is not None and progress.get("eta_seconds") is not None:
+            record["eta_seconds"] = progress["eta_seconds"]
+        elif estimate:
+            record["eta_seconds"] = remaining_seconds(
+                estimate["predicted_seconds"], time.time() - estimate["started_at"]
+            )
+        return record
+
+    @staticmethod
+    def _job_payload(input_path: str, output_path: str, content_hash: str, options: Dict[str, Any],
+                     estimate) -> Dict[str, Any]:
+        """Параметры задачи обработки видео для очереди
+
+        estimate - результат _estimate_job: признаки и прогноз передаются
+        исполнителю, чтобы он не читал метаданные и не строил прогноз повторно.
+        """
+        features, _, predicted = estimate
+        return {
+            "input_path": os.path.abspath(input_path),
+            "output_path": os.path.abspath(output_path),
+            "content_hash": content_hash,
+            # Предвычисленные фильтры живут только в памяти этого процесса
+            "options": {k: v for k, v in options.items() if k != "precomputed_filters"},
+            "features": features,
+            "predicted_seconds": predicted
+        }
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        while not done.wait(self.queue.lease_seconds / 3):
+            if not self.queue.heartbeat(job_id, self.worker_id):
+                logger.warning(f"Job {job_id}: lease lost")
+                return
+
+    def _execute_queued_job(self, payload: Dict[str, Any], options: Dict[str, Any], progress_callback=None) -> Dict[str, Any]:
+        """Записывает задачу в JobQueue и выполняет ее в этом процессе (синхронно, в потоке полосы)
+
+        Задача сразу захвачена этим процессом, аренда продлевается, пока идет
+        рендер. Повтора нет: ошибка (например, битый файл) сразу возвращается
+        клиенту, а не рендерится снова, занимая место в полосе. options -
+        параметры с предвычисленными фильтрами (в очереди их нет).
+        """
+        job_id = self.queue.enqueue(self.LOCAL_VIDEO_JOB, payload, max_attempts=1, worker_id=self.worker_id)
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, done), daemon=True)
+        heartbeat.start()
+        try:
+            result = self.run_video_job(
+                payload["input_path"], payload["output_path"], payload["content_hash"], options, progress_callback,
+                payload["features"], payload["predicted_seconds"]
+            )
+        except Exception as e:
+            self.queue.fail(job_id, self.worker_id, str(e))
+            raise
+        finally:
+            done.set()
+            heartbeat.join()
+        self.queue.complete(job_id, self.worker_id, result)
+        return result
+
+    def _owner_alive(self, owner: str) -> bool:
+        """Жив ли процесс-владелец аренды локальной задачи ("хост:pid")
+
+        Задачи других узлов не трогаем: их завершит истечение аренды. Свой pid
+        при старте означает прошлый запуск (pid в контейнере повторяются).
+        """
+        host, _, pid = owner.rpartition(":")
+        if host != socket.gethostname():
+            return True
+        if not pid.isdigit() or int(pid) == os.getpid():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def recover_local_jobs(self):
+        """Отмечает упавшими локальные задачи, брошенные прошлым запуском этого узла"""
+        return self.queue.fail_orphaned(self.LOCAL_VIDEO_JOB, self._owner_alive, "Processing was interrupted")
+
+    async def _run_local_job(self, input_path: str, output_path: str, content_hash: str, options: Dict[str, Any],
+                             estimate, progress_callback=None) -> Dict[str, Any]:
+        """Обработка видео через JobQueue в пакетной полосе этого процесса
+
+        Задача ставится в очередь, когда полоса ее допустила: отклоненная (429)
+        не остается в очереди без владельца. estimate - результат _estimate_job.
+        """
+        _, cost, predicted = estimate
+        payload = self._job_payload(input_path, output_path, content_hash, options, estimate)
+        return await self._run_job(
+            self._execute_queued_job, payload, options, progress_callback, cost=cost, duration=predicted
+        )
+
+    async def _run_remote_job(self, input_path: str, output_path: str, content_hash: str, options: Dict[str, Any],
+                              estimate, progress_callback=None) -> Dict[str, Any]:
+        """Ставит обработку видео в Redis и ждет результата воркера
+
+        Задача занимает место в пакетной полосе, пока ее выполняет воркер: узел API
+        не принимает больше работы, чем допускает бюджет (иначе - 429). Прогресс
+        воркера передается в progress_callback. estimate - результат _estimate_job.
+        """
+        _, cost, predicted = estimate
+        async with self.lanes["batch"].slot(cost, predicted):
+            payload = self._job_payload(input_path, output_path, content_hash, options, estimate)
+            job_id = await run_in_threadpool(self.remote_queue.enqueue, "video", payload)
+            deadline = asyncio.get_running_loop().time() + settings.REMOTE_JOB_TIMEOUT
+            while asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(settings.REMOTE_POLL_INTERVAL)
+                job = await run_in_threadpool(self.remote_queue.get, job_id)
+                if job is None:
+                    raise RuntimeError(f"Remote job {job_id} disappeared")
+                if job.get("progress") and progress_callback is not None:
+                    progress_callback(dict(job["progress"], remote_job_id=job_id))
+                if job["status"] == "completed":
+                    return job["result"]
+                if job["status"] == "failed":
+                    raise RuntimeError(job.get("error") or "Remote processing failed")
+            raise RuntimeError(f"Remote job {job_id} timed out")
+
+    def _analyze_video(self, input_path: str, output_path: str, content_hash: str, progress_callback=None, precomputed_filters=None,
+                       start: Optional[float] = None, end: Optional[float] = None, interactive: bool = False) -> Dict[str, Any]:
+        """Анализирует видео, переиспользуя сохраненный анализ того же файла (синхронно)
+
+        Для отрезка подходит и анализ всего файла, и анализ этого же отрезка.
+        interactive - анализ по запросу клиента (резерв интерактивных задач в пуле кадров).
+        """
+        params = get_analysis_params()
+        key = AnalysisCache.make_key(content_hash, params)
+        video_data = self.analysis_cache.load(key, input_path, output_path)
+        if video_data is not None:
+            return video_data
+
+        if start is not None or end is not None:
+            key = AnalysisCache.make_key(content_hash, dict(params, start=start, end=end))
+            video_data = self.analysis_cache.load(key, input_path, output_path)
+        if video_data is None:
+            video_data = analyze_video_mobile(
+                input_path, output_path, progress_callback, precomputed_filters, start, end, interactive=interactive
+            )
+            self.analysis_cache.save(key, video_data)
+        return video_data
+
+    def _prepare_video_data(self, input_path: str, output_path: str, content_hash: str, options: Dict[str, Any], progress_callback=None) -> Dict[str, Any]:
+        """Готовит video_data для рендера: анализ оригинала или перенос анализа прокси (синхронно)
+
+        options:
+            precomputed_filters - семплы, посчитанные во время загрузки
+            proxy_path, proxy_hash - уменьшенная копия, по которой выполняется анализ
+            max_dimension - рендер уменьшенной копии для просмотра
+            start, end - обрабатывается только этот отрезок (в секундах)
+            stream - фрагментированный MP4, доступный для чтения во время обработки
+            hls - лесенка качеств пакета HLS (строка вида "1080:5000k,720:2800k")
+        """
+        proxy_hash = options.get("proxy_hash")
+        if proxy_hash:
+            proxy_data = self._analyze_video(options.get("proxy_path") or "", "", proxy_hash, progress_callback)
+            return map_proxy_analysis(proxy_data, input_path, output_path)
+        return self._analyze_video(
+            input_path, output_path, content_hash, progress_callback, options.get("precomputed_filters"),
+            options.get("start"), options.get("end")
+        )
+
+    def run_video_job(self, input_path: str, output_path: str, content_hash: str, options: Dict[str, Any], progress_callback=None,
+                      features: Optional[Dict[str, Any]] = None, predicted: Optional[float] = None) -> Dict[str, Any]:
+        """Анализ и обработка видео (синхронно); точка входа для воркеров очередей
+
+        Время этапов записывается в статистику модели длительности; в события
+        прогресса добавляется eta_seconds. features и predicted - уже посчитанные
+        признаки и прогноз задачи; без них (или если задачу выполняет узел с
+        другим числом ядер) они считаются здесь.
+        """
+        if features is None:
+            features = self._job_features(input_path, options)
+            predicted = self.runtime_model.predict(features)
+        elif features["cpu_count"] != effective_cpu_count():
+            features = dict(features, cpu_count=effective_cpu_count())
+            predicted = self.runtime_model.predict(features)
+        started_at = time.monotonic()
+        progress_callback = with_eta(progress_callback, predicted, started_at)
+
+        video_data = self._prepare_video_data(input_path, output_path, content_hash, options, progress_callback)
+        analyzed_at = time.monotonic()
+        if options.get("variants"):
+            # Варианты - файлы <name>.mp4 в каталоге результата
+            os.makedirs(output_path, exist_ok=True)
+            variants = [dict(v, path=os.path.join(output_path, f"{v['name']}.mp4")) for v in options["variants"]]
+            result = process_video_variants(video_data, variants, options.get("start"), options.get("end"))
+        else:
+            result = process_video_mobile(
+                video_data, progress_callback, options.get("max_dimension"), options.get("start"), options.get("end"),
+                options.get("stream", False), parse_renditions(options["hls"]) if options.get("hls") else None,
+                # Быстрый рендер для просмотра получает вдвое больше процессов общего пула
+                priority=2 if options.get("max_dimension") else 1
+            )
+
+        finished_at = time.monotonic()
+        self.runtime_model.record(features, analyzed_at - started_at, finished_at - analyzed_at, predicted)
+        result.update({
+            "predicted_seconds": predicted,
+            "processing_seconds": round(finished_at - started_at, 1)
+        })
+        return result
+
     async def process_image(self, file: UploadFile) -> Dict[str, Any]:
         """Обрабатывает изображение для мобильного API"""
+        workspace = self.workspaces.create()
         try:
-            # Очищаем все старые файлы перед обработкой нового
-            cleaned_files = self.cleanup_all_files()
-            logger.info(f"Cleaned {len(cleaned_files)} old files before processing new image")
-            
-            # Сохраняем загруженный файл
-            input_path = self._get_temp_path(file.filename)
-            output_path = self._get_output_path(file.filename)
-            
-            with open(input_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
-            # Обрабатываем изображение
-            result = correct_image_mobile(input_path, output_path)
-            
-            # Удаляем временный файл
-            os.remove(input_path)
-            
-            # Добавляем информацию о файле
-            result.update({
-                "input_filename": file.filename,
-                "output_filename": os.path.basename(output_path),
-                "file_size": os.path.getsize(output_path) if os.path.exists(output_path) else 0,
-                "cleaned_files_count": len(cleaned_files)
-            })
-            
-            return result
-            
+            # Сохраняем загруженный файл в рабочую директорию задачи
+            input_path = self._get_temp_path(workspace, file.filename)
+            _, ext = os.path.splitext(file.filename)
+            output_path = self._get_output_path(file.filename, workspace.job_id, output_ext=ext or ".jpg")
+
+            content_hash = await self._save_upload(file, input_path)
+
+            async def compute():
+                # Обрабатываем изображение
+                self.output_store.pin(output_path)
+                try:
+                    result = await self._run_job(correct_image_mobile, input_path, output_path, lane="interactive")
+                finally:
+                    self.output_store.unpin(output_path)
+
+                # Добавляем информацию о файле
+                result.update({
+                    "output_filename": os.path.basename(output_path),
+                    "file_size": os.path.getsize(output_path) if os.path.exists(output_path) else 0,
+                    "content_hash": content_hash
+                })
+                return result
+
+            result, cache_status = await self.result_cache.get_or_compute(
+                self._cache_key(content_hash, "image"), compute
+            )
+            return dict(result, input_filename=file.filename, cache=cache_status)
+
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error processing image: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
-    
-    async def process_video(self, file: UploadFile) -> Generator[Dict[str, Any], None, None]:
-        """Обрабатывает видео для мобильного API с прогрессом"""
+        finally:
+            self.workspaces.release(workspace)
+
+    async def process_video_upload(self, file: UploadFile, proxy: Optional[UploadFile] = None, proxy_hash: Optional[str] = None,
+                                   options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Обрабатывает загруженное (multipart) видео целиком и возвращает результат
+
+        proxy - уменьшенная копия того же видео, анализ выполняется по ней;
+        proxy_hash - хеш прокси, уже проанализированной ранее (/api/mobile/analyze/video);
+        options - параметры рендера из render_options().
+        """
+        return await self.process_video_stream(
+            iter_upload_file(file), file.filename, proxy=proxy, proxy_hash=proxy_hash, options=options
+        )
+
+    @staticmethod
+    def render_options(review: bool = False, start: Optional[float] = None, end: Optional[float] = None,
+                       stream: bool = False, hls: bool = False, variants: Optional[str] = None) -> Dict[str, Any]:
+        """Проверяет и собирает параметры рендера из запроса
+
+        review - быстрый рендер уменьшенной копии, полное разрешение - по запросу;
+        start, end - обработать только отрезок (в секундах);
+        stream - вернуть задачу сразу и отдавать фрагментированный MP4 по мере обработки;
+        hls - упаковать результат в HLS с несколькими качествами (HLS_RENDITIONS);
+        variants - JSON-список вариантов результата, рендерятся за один проход.
+        """
+        if start is not None and start < 0:
+            raise HTTPException(status_code=400, detail="start must be non-negative")
+        if start is not None and end is not None and end <= start:
+            raise HTTPException(status_code=400, detail="end must be greater than start")
+        if stream and hls:
+            raise HTTPException(status_code=400, detail="stream and hls cannot be combined")
+        if (stream or hls) and not is_ffmpeg_available():
+            raise HTTPException(status_code=501, detail="Streaming and HLS output require ffmpeg on the server")
+        options = {}
+        if variants:
+            if review or stream or hls:
+                raise HTTPException(status_code=400, detail="variants cannot be combined with review, stream or hls")
+            try:
+                options["variants"] = parse_variants(
+                    variants, settings.MAX_VARIANTS, "h264" if is_ffmpeg_available() else "mp4v"
+                )
+            except (ValueError, TypeError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid variants: {str(e)}")
+            if any(v["codec"] == "h264" for v in options["variants"]) and not is_ffmpeg_available():
+                raise HTTPException(status_code=501, detail="Variants with codec h264 require ffmpeg on the server")
+        if review:
+            options["max_dimension"] = settings.REVIEW_MAX_DIMENSION
+        if start:
+            options["start"] = float(start)
+        if end is not None:
+            options["end"] = float(end)
+        if stream:
+            options["stream"] = True
+        if hls:
+            options["hls"] = settings.HLS_RENDITIONS
+        return options
+
+    async def _resolve_proxy(self, workspace: JobWorkspace, proxy: Optional[UploadFile], proxy_hash: Optional[str]) -> Dict[str, Any]:
+        """Сохраняет прокси в рабочую директорию или проверяет, что ее анализ уже есть в кеше"""
+        if proxy is not None:
+            proxy_path = workspace.file_path(f"proxy_{os.path.basename(proxy.filename or 'proxy.mp4')}")
+            return {"proxy_path": proxy_path, "proxy_hash": await self._save_upload(proxy, proxy_path)}
+        if proxy_hash:
+            key = AnalysisCache.make_key(proxy_hash, get_analysis_params())
+            if self.analysis_cache.load(key, "", "") is None:
+                raise HTTPException(status_code=404, detail="Proxy analysis not found, upload the proxy again")
+            return {"proxy_hash": proxy_hash}
+        return {}
+
+    async def process_video_stream(self, chunks: AsyncIterator[bytes], filename: str, expected_size: Optional[int] = None,
+                                   proxy: Optional[UploadFile] = None, proxy_hash: Optional[str] = None,
+                                   options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Принимает видео потоком блоков, сохраняет в рабочую директорию и обрабатывает
+
+        Если известен итоговый размер, анализ MP4/MOV начинается еще во время загрузки
+        (кроме обработки отрезка: там анализируется только он).
+        """
+        render_options = options or {}
+        workspace = self.workspaces.create()
         try:
-            # Очищаем все старые файлы перед обработкой нового
-            cleaned_files = self.cleanup_all_files()
-            logger.info(f"Cleaned {len(cleaned_files)} old files before processing new video")
-            
-            # Сохраняем загруженный файл
-            input_path = self._get_temp_path(file.filename)
-            output_path = self._get_output_path(file.filename)
-            
-            with open(input_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
-            # Функция для отправки прогресса
-            def progress_callback(progress_data):
-                yield progress_data
-            
-            # Анализируем видео
-            video_data = analyze_video_mobile(input_path, output_path, progress_callback)
-            
-            yield {
-                "status": "analyzing_complete",
-                "total_frames": video_data["frame_count"],
-                "fps": video_data["fps"],
-                "message": "Video analysis completed, starting processing"
-            }
-            
-            # Обрабатываем видео
-            result = process_video_mobile(video_data, progress_callback)
-            
-            # Удаляем временный файл
-            os.remove(input_path)
-            
-            # Добавляем информацию о файле
+            input_path = self._get_temp_path(workspace, filename)
+            options = await self._resolve_proxy(workspace, proxy, proxy_hash)
+            options.update(render_options)
+
+            analyzer = None
+            trimmed = "start" in options or "end" in options
+            if not options.get("proxy_hash") and not trimmed and settings.PROGRESSIVE_ANALYSIS and ProgressiveAnalyzer.supports(filename, expected_size):
+                analyzer = ProgressiveAnalyzer(input_path, expected_size)
+
+            try:
+                content_hash, _ = await stream_to_file(
+                    chunks, input_path, settings.MAX_FILE_SIZE,
+                    on_progress=analyzer.update if analyzer else None
+                )
+            except BaseException:
+                if analyzer:
+                    await run_in_threadpool(analyzer.finish, False)
+                raise
+
+            if analyzer:
+                options["precomputed_filters"] = await run_in_threadpool(analyzer.finish)
+            if options.get("stream"):
+                return self._start_stream_job(workspace, input_path, filename, content_hash, options)
+            return await self._finish_video_job(workspace, input_path, filename, content_hash, options)
+        except BaseException:
+            self.workspaces.release(workspace)
+            raise
+
+    async def analyze_video_stream(self, chunks: AsyncIterator[bytes], filename: str) -> Dict[str, Any]:
+        """Только анализ видео (без рендера): возвращает video_data и хеш содержимого"""
+        workspace = self.workspaces.create()
+        try:
+            input_path = self._get_temp_path(workspace, filename)
+            content_hash, _ = await stream_to_file(chunks, input_path, settings.MAX_FILE_SIZE)
+            video_data = await self._run_job(
+                partial(self._analyze_video, interactive=True), input_path, "", content_hash,
+                cost=await self._analysis_cost(input_path), lane="interactive"
+            )
+            return dict(video_data, content_hash=content_hash)
+        finally:
+            self.workspaces.release(workspace)
+
+    async def analyze_image(self, file: UploadFile) -> Dict[str, Any]:
+        """Только анализ изображения: матрица фильтра без коррекции"""
+        workspace = self.workspaces.create()
+        try:
+            input_path = self._get_temp_path(workspace, file.filename)
+            await self._save_upload(file, input_path)
+            return await self._run_job(analyze_image_mobile, input_path, lane="interactive")
+        finally:
+            self.workspaces.release(workspace)
+
+    async def process_resumable_upload(self, upload_id: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Завершает возобновляемую загрузку и запускает обработку собранного файла"""
+        options = dict(options or {})
+        workspace, input_path, filename, content_hash = await self.uploads.finalize(upload_id)
+        try:
+            if options.get("stream"):
+                return self._start_stream_job(workspace, input_path, filename, content_hash, options)
+            return await self._finish_video_job(workspace, input_path, filename, content_hash, options)
+        except BaseException:
+            self.workspaces.release(workspace)
+            raise
+
+    async def _finish_video_job(self, workspace: JobWorkspace, input_path: str, filename: str, content_hash: str, options: Dict[str, Any],
+                                estimate=None, on_progress=None) -> Dict[str, Any]:
+        """Обрабатывает видео и оставляет исходник задачи для отложенного рендера
+
+        При ошибке рабочую директорию освобождает вызывающий код.
+        """
+        result = await self._process_video_file(workspace, input_path, filename, content_hash, options, estimate, on_progress)
+        self.jobs.register(workspace, filename, content_hash, options, result)
+        self.workspaces.release(workspace, remove=False)
+
+        # Результат мог прийти из кеша другой задачи - ссылаемся на текущую
+        result = dict(result, job_id=workspace.job_id)
+        if options.get("max_dimension"):
             result.update({
-                "input_filename": file.filename,
-                "output_filename": os.path.basename(output_path),
-                "file_size": os.path.getsize(output_path) if os.path.exists(output_path) else 0,
-                "cleaned_files_count": len(cleaned_files)
+                "review": True,
+                "full_download_url": f"/api/jobs/{workspace.job_id}/download"
             })
-            
-            yield result
-            
+        return result
+
+    def _start_stream_job(self, workspace: JobWorkspace, input_path: str, filename: str, content_hash: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        """Запускает обработку в фоне и сразу возвращает ссылку на растущий файл"""
+        output_path = self._get_output_path(filename, workspace.job_id, self._output_suffix(options))
+        self.jobs.register(
+            workspace, filename, content_hash, options,
+            {"output_filename": os.path.basename(output_path)}, status="processing"
+        )
+        task = asyncio.get_running_loop().create_task(
+            self._run_stream_job(workspace, input_path, filename, content_hash, options)
+        )
+        self._stream_jobs[workspace.job_id] = task
+        task.add_done_callback(lambda _: self._stream_jobs.pop(workspace.job_id, None))
+        return {
+            "job_id": workspace.job_id,
+            "status": "processing",
+            "input_filename": filename,
+            "output_filename": os.path.basename(output_path),
+            "content_hash": content_hash,
+            "stream_url": f"/api/jobs/{workspace.job_id}/stream"
+        }
+
+    async def _run_stream_job(self, workspace: JobWorkspace, input_path: str, filename: str, content_hash: str, options: Dict[str, Any]):
+        try:
+            estimate = await self._estimate_job(input_path, options)
+            if estimate[2] is not None:
+                self.jobs.set_estimate(workspace, estimate[2])
+            result = await self._process_video_file(workspace, input_path, filename, content_hash, options, estimate)
+            # При попадании в кеш результат лежит в файле другой задачи
+            self.jobs.set_output(workspace, "stream", result["output_filename"])
+            self.jobs.set_status(workspace, "completed")
         except Exception as e:
+            logger.error(f"Error processing streamed video {workspace.job_id}: {str(e)}")
+            self.jobs.set_status(workspace, "failed", str(e))
+        finally:
+            self.workspaces.release(workspace, remove=False)
+
+    def _stream_status(self, job_id: str):
+        """(запись задачи, путь к файлу потока); задача, прерванная перезапуском, считается упавшей"""
+        record = self.jobs.get(job_id)
+        if "stream" not in record["outputs"]:
+            raise HTTPException(status_code=404, detail="Job has no streaming output")
+        if record["status"] == "processing" and job_id not in self._stream_jobs:
+            record = dict(record, status="failed", error="Processing was interrupted")
+        return record, self.output_store.path_for(record["outputs"]["stream"])
+
+    async def tail_stream(self, job_id: str) -> AsyncIterator[bytes]:
+        """Отдает фрагментированный MP4 по мере записи, пока обработка не закончится"""
+        record, path = self._stream_status(job_id)
+        if record["status"] == "failed":
+            raise HTTPException(status_code=500, detail=record.get("error", "Processing failed"))
+
+        async def generate():
+            nonlocal record, path
+            f = None
+            try:
+                while True:
+                    if f is None and os.path.exists(path):
+                        f = await aiofiles.open(path, "rb")
+                    chunk = await f.read(settings.STREAM_CHUNK_SIZE) if f else b""
+                    if chunk:
+                        yield chunk
+                        continue
+                    if record["status"] != "processing":
+                        if f is None and os.path.exists(path):
+                            continue
+                        break
+                    await asyncio.sleep(settings.STREAM_POLL_INTERVAL)
+                    record, new_path = self._stream_status(job_id)
+                    if f is None:
+                        path = new_path
+            finally:
+                if f is not None:
+                    await f.close()
+
+        return generate()
+
+    def variant_path(self, job_id: str, name: str) -> str:
+        """Путь к файлу варианта задачи с variants"""
+        record = self.jobs.get(job_id)
+        package = record["outputs"].get("variants")
+        names = [v["name"] for v in record["options"].get("variants", [])]
+        if not package or name not in names:
+            raise HTTPException(status_code=404, detail="Variant not found")
+        return os.path.join(self.output_store.path_for(package), f"{name}.mp4")
+
+    async def render_full_video(self, job_id: str) -> str:
+        """Рендер в полном разрешении по запросу (переиспользует сохраненный анализ)
+
+        Возвращает путь к готовому файлу в хранилище результатов.
+        """
+        record = self.jobs.get(job_id)
+        full_output = record["outputs"].get("full")
+        if not full_output and not record["options"].get("max_dimension") and record.get("status") == "completed":
+            # Поток в полном разрешении - это и есть полный результат
+            full_output = record["outputs"].get("stream")
+        if full_output and os.path.exists(self.output_store.path_for(full_output)):
+            return self.output_store.path_for(full_output)
+
+        workspace, record = self.jobs.acquire(job_id)
+        try:
+            options = {k: v for k, v in record["options"].items() if k not in ("max_dimension", "stream", "hls", "variants")}
+            result = await self._process_video_file(
+                workspace, workspace.file_path(record["filename"]), record["filename"], record["content_hash"], options
+            )
+            self.jobs.set_output(workspace, "full", result["output_filename"])
+            return self.output_store.path_for(result["output_filename"])
+        finally:
+            self.workspaces.release(workspace, remove=False)
+
+    async def _process_video_file(self, workspace: JobWorkspace, input_path: str, filename: str, content_hash: str,
+                                  options: Optional[Dict[str, Any]] = None, estimate=None,
+                                  on_progress=None) -> Dict[str, Any]:
+        """Обрабатывает уже сохраненное видео (с учетом кеша результатов)
+
+        estimate - результат _estimate_job, если он уже посчитан (иначе считается при промахе кеша);
+        on_progress - получает события прогресса (из потока полосы).
+        """
+        options = options or {}
+        # Пакет HLS и набор вариантов - каталоги в хранилище результатов
+        output_ext = "" if options.get("hls") or options.get("variants") else ".mp4"
+        output_path = self._get_output_path(filename, workspace.job_id, self._output_suffix(options), output_ext)
+
+        def progress_callback(progress_data):
+            # Последнее событие прогресса - в GET /api/jobs/{job_id}
+            self._progress[workspace.job_id] = progress_data
+            if on_progress is not None:
+                on_progress(progress_data)
+
+        async def compute():
+            self.output_store.pin(output_path)
+            try:
+                job_estimate = estimate or await self._estimate_job(input_path, options)
+                run = self._run_remote_job if self.remote_queue is not None else self._run_local_job
+                result = await run(input_path, output_path, content_hash, options, job_estimate, progress_callback)
+            finally:
+                self.output_store.unpin(output_path)
+                self._progress.pop(workspace.job_id, None)
+
+            result.update({
+                "job_id": workspace.job_id,
+                "output_filename": os.path.basename(output_path),
+                "file_size": path_size(output_path) if os.path.exists(output_path) else 0,
+                "content_hash": content_hash
+            })
+            if options.get("hls"):
+                result["hls_url"] = f"{settings.HLS_URL_PREFIX}/{os.path.basename(output_path)}/{FFmpegHLSWriter.MASTER_PLAYLIST}"
+            for variant in result.get("variants", []):
+                variant_path = variant.pop("output_path")
+                variant.update({
+                    "output_filename": f"{os.path.basename(output_path)}/{os.path.basename(variant_path)}",
+                    "file_size": os.path.getsize(variant_path) if os.path.exists(variant_path) else 0,
+                    "download_url": f"/api/jobs/{workspace.job_id}/variants/{variant['name']}"
+                })
+            return result
+
+        result, cache_status = await self.result_cache.get_or_compute(
+            self._cache_key(content_hash, "video", options), compute
+        )
+        return dict(result, input_filename=filename, cache=cache_status)
+
+    async def start_video(self, file: UploadFile) -> Dict[str, Any]:
+        """Сохраняет видео для process_video и проверяет допуск в пакетную полосу
+
+        Вызывается до ответа SSE: 413 (лимит загрузки) и 429 с Retry-After
+        доходят до клиента обычным ответом, а не обрывают начатый поток.
+        При попадании в кеш допуск не нужен.
+        """
+        workspace = self.workspaces.create()
+        try:
+            input_path = self._get_temp_path(workspace, file.filename)
+            content_hash = await self._save_upload(file, input_path)
+            estimate, fps = None, None
+            if self.result_cache.get(self._cache_key(content_hash, "video")) is None:
+                estimate = await self._estimate_job(input_path, {})
+                self.lanes["batch"].check(estimate[1], estimate[2])
+                fps = (await run_in_threadpool(probe_video, input_path))["fps"]
+            return {
+                "workspace": workspace,
+                "filename": file.filename,
+                "input_path": input_path,
+                "content_hash": content_hash,
+                "estimate": estimate,
+                "fps": fps
+            }
+        except BaseException:
+            self.workspaces.release(workspace)
+            raise
+
+    async def process_video(self, job: Dict[str, Any]) -> Generator[Dict[str, Any], None, None]:
+        """Обрабатывает видео для мобильного API с прогрессом
+
+        job - результат start_video. Обработка идет тем же путем, что и у
+        остальных загрузок (_finish_video_job: кеш результатов, JobQueue или
+        удаленные воркеры, запись задачи в JobRegistry); события прогресса
+        передаются в поток. job_id результата работает в /api/jobs/{job_id}.
+        """
+        workspace = job["workspace"]
+        try:
+            # События прогресса задачи; их получает только запрос, который ее выполняет
+            events: asyncio.Queue = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+
+            analyzed = False
+
+            def progress_callback(progress_data):
+                # Вызывается из потока полосы (для удаленной задачи - из цикла событий)
+                loop.call_soon_threadsafe(events.put_nowait, progress_data)
+
+            def with_analysis_event(event):
+                # Первое событие рендера: анализ закончен
+                nonlocal analyzed
+                if event.get("stage") != "processing" or analyzed:
+                    return [event]
+                analyzed = True
+                complete = {
+                    "status": "analyzing_complete",
+                    "total_frames": event.get("total_frames"),
+                    "fps": job["fps"],
+                    "message": "Video analysis completed, starting processing"
+                }
+                if event.get("eta_seconds") is not None:
+                    complete["eta_seconds"] = event["eta_seconds"]
+                return [complete, event]
+
+            # Повторная загрузка того же файла получает готовый результат, а
+            # одинаковые загрузки, пришедшие одновременно, ждут одну задачу
+            task = asyncio.ensure_future(self._finish_video_job(
+                workspace, job["input_path"], job["filename"], job["content_hash"], {}, job["estimate"], progress_callback
+            ))
+            try:
+                while not task.done():
+                    next_event = asyncio.ensure_future(events.get())
+                    await asyncio.wait({task, next_event}, return_when=asyncio.FIRST_COMPLETED)
+                    if next_event.done():
+                        for event in with_analysis_event(next_event.result()):
+                            yield event
+                    else:
+                        next_event.cancel()
+                while not events.empty():
+                    for event in with_analysis_event(events.get_nowait()):
+                        yield event
+                result = task.result()
+            finally:
+                task.cancel()
+        except BaseException as e:
+            # Задача не зарегистрирована (ошибка или клиент отключился) - ее директория не нужна
+            self.workspaces.release(workspace)
+            if isinstance(e, HTTPException) or not isinstance(e, Exception):
+                raise
             logger.error(f"Error processing video: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Error processing video: {str(e)}")
-    
+
+        yield result
+
     def get_file_info(self, file_path: str) -> Dict[str, Any]:
         """Получает информацию о файле"""
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
-        
+
         file_size = os.path.getsize(file_path)
         return {
             "file_path": file_path,
             "file_size": file_size,
             "exists": True
         }
-    
-    def cleanup_old_files(self, max_age_hours: int = 24):
-        """Удаляет старые файлы"""
-        import time
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
-        
-        for directory in [self.upload_dir, self.output_dir]:
-            for filename in os.listdir(directory):
-                file_path = os.path.join(directory, filename)
-                if os.path.isfile(file_path):
-                    file_age = current_time - os.path.getmtime(file_path)
-                    if file_age > max_age_seconds:
-                        os.remove(file_path)
-                        logger.info(f"Removed old file: {file_path}")
-    
-    def cleanup_all_files(self):
-        """Удаляет все файлы в директориях uploads и outputs"""
-        cleaned_files = []
-        
-        for directory in [self.upload_dir, self.output_dir]:
-            if os.path.exists(directory):
-                for filename in os.listdir(directory):
-                    file_path = os.path.join(directory, filename)
-                    if os.path.isfile(file_path):
-                        try:
-                            os.remove(file_path)
-                            cleaned_files.append(file_path)
-                            logger.info(f"Removed file: {file_path}")
-                        except Exception as e:
-                            logger.error(f"Error removing file {file_path}: {str(e)}")
-        
-        return cleaned_files
+
+    def start_frame_pool(self):
+        """Заранее запускает и прогревает пул процессов кадров (при старте сервиса)"""
+        get_frame_scheduler().start(
+            settings.WORKER_POOL_MIN, settings.WORKER_IDLE_TIMEOUT, warm_up_worker, settings.WORKER_POOL_INTERACTIVE_RESERVED
+        )
+
+    def stop_frame_pool(self):
+        """Завершает процессы пула кадров"""
+        get_frame_scheduler().shutdown()
+
+    def cleanup_old_files(self):
+        """Однократно запускает очистку хранилища (TTL, лимит размера, брошенные задачи)"""
+        return self.janitor.run_once()
 
 # Глобальный экземпляр процессора
 video_processor = VideoProcessor()
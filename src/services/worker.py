@@ -0,0 +1,139 @@
+"""
+Воркер распределенной обработки видео
+
+Забирает задачи из Redis (RedisJobQueue), выполняет анализ и коррекцию и
+публикует прогресс и результат обратно в Redis. API при DISTRIBUTED_WORKERS=true
+только принимает файлы, ставит задачи и отдает результаты, поэтому
+вычислительные узлы добавляются без изменений API. Узлы должны видеть те же
+каталоги UPLOAD_DIR, OUTPUT_DIR и ANALYSIS_CACHE_DIR (общие тома).
+
+Запуск: python -m src.services.worker [--name NAME]
+"""
+
+import os
+import signal
+import socket
+import logging
+import argparse
+import threading
+from typing import Dict, Any, Optional
+
+from ..config.settings import settings
+from ..dive_color_corrector.resources import get_governor
+from .redis_queue import RedisJobQueue
+
+logger = logging.getLogger(__name__)
+
+# Вид задачи: коррекция сохраненного видео
+VIDEO_JOB = "video"
+
+
+class VideoWorker:
+    """Цикл воркера: берет задачу, продлевает ее видимость, пока она выполняется"""
+
+    def __init__(self, queue: RedisJobQueue, name: Optional[str] = None, processor=None):
+        self.queue = queue
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        if processor is None:
+            from .video_processor import video_processor as processor
+        self.processor = processor
+        self.governor = get_governor()
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Завершает работу после текущей задачи"""
+        self._stop.set()
+
+    def _heartbeat(self, job: Dict[str, Any], done: threading.Event):
+        while not done.wait(self.queue.visibility_timeout / 3):
+            if not self.queue.heartbeat(job, self.name):
+                logger.warning(f"Job {job['id']} was reclaimed by another worker")
+                return
+
+    def handle(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Выполняет задачу и возвращает результат"""
+        if job["kind"] != VIDEO_JOB:
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+        payload = job["payload"]
+
+        def progress_callback(progress_data):
+            self.queue.progress(job["id"], progress_data)
+
+        return self.processor.run_video_job(
+            payload["input_path"], payload["output_path"], payload["content_hash"], payload["options"],
+            progress_callback, payload.get("features"), payload.get("predicted_seconds")
+        )
+
+    def run_once(self, block_ms: int = 1000) -> bool:
+        """Обрабатывает одну задачу; False - очередь пуста"""
+        job = self.queue.claim(self.name, block_ms=block_ms)
+        if job is None:
+            return False
+
+        logger.info(f"Worker {self.name}: job {job['id']} (attempt {job['attempts']})")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), daemon=True)
+        heartbeat.start()
+        try:
+            result = self.handle(job)
+            self.queue.complete(job, result)
+            logger.info(f"Worker {self.name}: job {job['id']} completed")
+        except Exception as e:
+            status = self.queue.fail(job, str(e))
+            logger.error(f"Worker {self.name}: job {job['id']} failed ({status}): {str(e)}")
+        finally:
+            done.set()
+            heartbeat.join()
+        return True
+
+    def run(self):
+        """Обрабатывает задачи до сигнала остановки"""
+        logger.info(f"Worker {self.name} started")
+        while not self._stop.is_set():
+            if self.governor.concurrency_limit(1) == 0:
+                # Мало памяти: новые задачи не берем, их заберут другие воркеры
+                self._stop.wait(5)
+                continue
+            try:
+                self.run_once()
+            except Exception as e:
+                # Redis недоступен - ждем и пробуем снова
+                logger.error(f"Worker {self.name}: queue error: {str(e)}")
+                self._stop.wait(5)
+        logger.info(f"Worker {self.name} stopped")
+
+
+def create_queue() -> RedisJobQueue:
+    """Очередь по настройкам REDIS_*"""
+    return RedisJobQueue.from_url(
+        settings.REDIS_URL,
+        prefix=settings.REDIS_QUEUE_PREFIX,
+        visibility_timeout=settings.REDIS_VISIBILITY_TIMEOUT,
+        max_attempts=settings.QUEUE_MAX_ATTEMPTS,
+        result_ttl_seconds=settings.REDIS_RESULT_TTL_HOURS * 3600
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed video processing worker')
+    parser.add_argument('--name', help='Consumer name (default: host:pid)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    if not settings.DISTRIBUTED_WORKERS:
+        # Без распределенной обработки API не ставит задачи в Redis
+        logger.info("DISTRIBUTED_WORKERS is disabled, worker exits")
+        return
+    worker = VideoWorker(create_queue(), name=args.name)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    # Процессы пула кадров прогреваются до первой задачи
+    worker.processor.start_frame_pool()
+    try:
+        worker.run()
+    finally:
+        worker.processor.stop_frame_pool()
+
+
+if __name__ == "__main__":
+    main()
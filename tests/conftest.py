@@ -0,0 +1,12 @@
+# test_api.py - сценарий проверки запущенного сервера (make test), а не тесты pytest
+collect_ignore = ["test_api.py"]
+
+import os
+import tempfile
+
+# Каталоги и базы сервиса для тестов API (src.api.main создает глобальный
+# VideoProcessor при импорте) - во временной директории, а не в рабочей копии
+_root = tempfile.mkdtemp(prefix="dive-tests-")
+for _name, _path in (("UPLOAD_DIR", "uploads"), ("OUTPUT_DIR", "outputs"), ("ANALYSIS_CACHE_DIR", "cache/analysis"),
+                     ("QUEUE_DB_PATH", "data/queue.db"), ("JOB_STATS_DB_PATH", "data/job_stats.db")):
+    os.environ.setdefault(_name, os.path.join(_root, _path))
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.services.analysis_cache import AnalysisCache
+
+
+def video_data(**overrides):
+    data = {
+        "input_video_path": "in.mp4",
+        "output_video_path": "out.mp4",
+        "fps": 29.97,
+        "frame_count": 300,
+        "filters": np.arange(40, dtype=np.float64).reshape(2, 20),
+        "filter_indices": [30, 60],
+        "rotation_angle": 90,
+        "original_bitrate": 2800000,
+        "original_audio_bitrate": None
+    }
+    data.update(overrides)
+    return data
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnalysisCache(str(tmp_path / "analysis"), max_bytes=1 << 20)
+
+
+def test_make_key_depends_on_content_and_params():
+    key = AnalysisCache.make_key("abc", {"sample_seconds": 1.0})
+    assert key == AnalysisCache.make_key("abc", {"sample_seconds": 1.0})
+    assert key != AnalysisCache.make_key("abc", {"sample_seconds": 2.0})
+    assert key != AnalysisCache.make_key("abd", {"sample_seconds": 1.0})
+
+
+def test_save_and_load_round_trip_uses_new_paths(cache):
+    cache.save("k", video_data())
+    loaded = cache.load("k", "other.mp4", "other_out.mp4")
+
+    assert loaded["input_video_path"] == "other.mp4"
+    assert loaded["output_video_path"] == "other_out.mp4"
+    assert loaded["fps"] == pytest.approx(29.97)
+    assert loaded["frame_count"] == 300
+    assert loaded["filter_indices"] == [30, 60]
+    assert loaded["rotation_angle"] == 90
+    assert loaded["original_bitrate"] == 2800000
+    assert loaded["original_audio_bitrate"] is None
+    np.testing.assert_array_equal(loaded["filters"], video_data()["filters"])
+
+
+def test_load_missing_returns_none(cache):
+    assert cache.load("missing", "in.mp4", "out.mp4") is None
+
+
+def test_corrupted_entry_is_removed(cache):
+    path = cache._path("k")
+    with open(path, "wb") as f:
+        f.write(b"not an npz")
+    assert cache.load("k", "in.mp4", "out.mp4") is None
+    assert not os.path.exists(path)
+
+
+def test_evict_removes_least_recently_used_over_limit(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "analysis"), max_bytes=1)
+    cache.save("old", video_data())
+    cache.save("new", video_data())
+    os.utime(cache._path("old"), (1000, 1000))
+
+    removed = cache.evict()
+
+    assert cache._path("old") in removed
+    assert not os.path.exists(cache._path("old"))
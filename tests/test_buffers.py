@@ -0,0 +1,56 @@
+import threading
+
+from src.dive_color_corrector.buffers import ByteBudget, ByteBoundedQueue
+
+
+def test_budget_tracks_used_and_peak():
+    budget = ByteBudget(100)
+    budget.acquire(60)
+    budget.acquire(40)
+    assert budget.used == 100 and budget.peak == 100
+    assert not budget.fits(1)
+    budget.release(60)
+    assert budget.used == 40 and budget.peak == 100
+    assert budget.fits(60)
+
+
+def test_oversized_item_passes_only_when_empty():
+    budget = ByteBudget(10)
+    assert budget.fits(50)
+    budget.acquire(50)
+    assert not budget.fits(1)
+    budget.release(50)
+    assert budget.used == 0
+
+
+def test_acquire_waits_for_release():
+    budget = ByteBudget(100)
+    budget.acquire(80)
+    acquired = threading.Event()
+
+    def producer():
+        budget.acquire(50)
+        acquired.set()
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    assert not acquired.wait(0.05)
+    budget.release(80)
+    assert acquired.wait(5)
+    assert budget.used == 50
+
+
+def test_queue_is_fifo_and_bounded_in_bytes():
+    q = ByteBoundedQueue(10)
+    q.put("a", 4)
+    q.put("b", 6)
+    assert q.budget.used == 10
+    blocked = threading.Thread(target=q.put, args=("c", 4), daemon=True)
+    blocked.start()
+    blocked.join(0.05)
+    assert blocked.is_alive()
+    assert q.get() == "a"
+    blocked.join(5)
+    assert not blocked.is_alive()
+    assert [q.get(), q.get()] == ["b", "c"]
+    assert q.budget.used == 0
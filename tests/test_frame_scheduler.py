@@ -0,0 +1,212 @@
+import time
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from src.dive_color_corrector import frame_scheduler, threads
+from src.dive_color_corrector.frame_scheduler import FrameBatchScheduler
+
+
+class StubExecutor:
+    """Вместо пула процессов: батчи завершает сам тест"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.submitted.append((fn, args, future))
+        return future
+
+    def finish(self, index=0):
+        fn, args, future = self.submitted.pop(index)
+        future.set_result(fn(*args))
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.fixture
+def stub():
+    return StubExecutor()
+
+
+def make_scheduler(stub, **kwargs):
+    scheduler = FrameBatchScheduler(**kwargs)
+    scheduler._executor = stub
+    return scheduler
+
+
+def test_batches_are_limited_by_pool_size(stub):
+    scheduler = make_scheduler(stub, max_workers=2)
+    job = scheduler.job("render")
+    futures = [job.submit(abs, -n) for n in range(4)]
+    assert len(stub.submitted) == 2
+    stub.finish()
+    assert futures[0].result() == 0
+    assert len(stub.submitted) == 2
+    while stub.submitted:
+        stub.finish()
+    assert [f.result() for f in futures] == [0, 1, 2, 3]
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_weights_split_pool_between_jobs(stub):
+    scheduler = make_scheduler(stub, max_workers=1)
+    review = scheduler.job("review", weight=2)
+    render = scheduler.job("render", weight=1)
+    for n in range(6):
+        review.submit(str, f"review{n}")
+        render.submit(str, f"render{n}")
+    order = []
+    while stub.submitted:
+        order.append(stub.submitted[0][1][1][0])
+        stub.finish()
+    # Первый батч ушел в пул до появления второй задачи
+    assert [name[:-1] for name in order[1:7]].count("review") == 4
+
+
+def test_reserved_workers_are_left_to_interactive_jobs(stub):
+    scheduler = make_scheduler(stub, max_workers=3, reserved_workers=1)
+    render = scheduler.job("render")
+    for n in range(4):
+        render.submit(abs, n)
+    assert len(stub.submitted) == 2
+    assert scheduler.stats()["batch_in_flight"] == 2
+
+    analysis = scheduler.job("analysis", interactive=True)
+    analysis.submit(abs, -1)
+    assert len(stub.submitted) == 3
+    assert stub.submitted[-1][1][1] == (-1,)
+    # Пакетный батч завершился - его место занимает следующий пакетный
+    stub.finish(0)
+    assert len(stub.submitted) == 3
+    assert scheduler.stats()["batch_in_flight"] == 2
+
+
+def test_processes_are_counted_by_reported_pids(stub):
+    # Счет процессов не зависит от внутренностей ProcessPoolExecutor
+    assert not hasattr(stub, "_processes")
+    scheduler = make_scheduler(stub, max_workers=2)
+    assert scheduler.stats()["processes"] == 0
+    job = scheduler.job("render")
+    for n in range(3):
+        job.submit(abs, n)
+    while stub.submitted:
+        stub.finish()
+    # Все батчи выполнил один процесс (здесь - процесс тестов)
+    assert scheduler.stats()["processes"] == 1
+
+    # Ответ пула, замененного после сжатия, не учитывается
+    job.submit(abs, 4)
+    scheduler._executor = StubExecutor()
+    scheduler._pids = set()
+    stub.finish()
+    assert scheduler.stats()["processes"] == 0
+
+
+def test_reserve_never_takes_whole_pool(stub):
+    scheduler = make_scheduler(stub, max_workers=1, reserved_workers=4)
+    assert scheduler.reserved_workers == 0
+    scheduler.job("render").submit(abs, 1)
+    assert len(stub.submitted) == 1
+
+
+def test_closed_job_cancels_pending_batches(stub):
+    scheduler = make_scheduler(stub, max_workers=1)
+    job = scheduler.job("render")
+    running = job.submit(abs, 1)
+    queued = job.submit(abs, 2)
+    job.close()
+    assert queued.cancelled()
+    stub.finish()
+    assert running.result() == 1
+    assert scheduler.stats()["jobs"] == []
+
+
+class InlineExecutor(StubExecutor):
+    """Пул, у которого батч уже выполнен к моменту возврата из submit"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def test_already_finished_batches_do_not_deadlock():
+    scheduler = make_scheduler(InlineExecutor(), max_workers=2)
+    job = scheduler.job("render")
+    result = []
+    worker = threading.Thread(target=lambda: result.extend(job.map(abs, range(-20, 0))), daemon=True)
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive(), "scheduler deadlocked on an already finished batch"
+    assert result == list(range(20, 0, -1))
+    assert scheduler.stats()["in_flight"] == 0
+
+
+class FakeGovernor:
+    def __init__(self, size):
+        self.size = size
+
+    def pool_size(self, requested=None):
+        return self.size
+
+
+def test_pool_size_is_rechecked_when_pool_is_rebuilt(monkeypatch):
+    governor = FakeGovernor(4)
+    monkeypatch.setattr(frame_scheduler, "get_governor", lambda: governor)
+    scheduler = FrameBatchScheduler(min_workers=2, reserved_workers=1)
+    assert scheduler.max_workers == 4
+
+    # Памяти стало меньше - новый пул меньше, резерв и прогрев в его пределах
+    governor.size = 1
+    scheduler._resize()
+    assert (scheduler.max_workers, scheduler.min_workers, scheduler.reserved_workers) == (1, 1, 0)
+    # Память освободилась - заданные значения восстанавливаются
+    governor.size = 6
+    scheduler._resize()
+    assert (scheduler.max_workers, scheduler.min_workers, scheduler.reserved_workers) == (6, 2, 1)
+
+
+def test_explicit_pool_size_is_kept(monkeypatch):
+    monkeypatch.setattr(frame_scheduler, "get_governor", lambda: FakeGovernor(1))
+    scheduler = FrameBatchScheduler(max_workers=3)
+    scheduler._resize()
+    assert scheduler.max_workers == 3
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.05)
+
+
+def test_pool_starts_processes_on_demand_and_shrinks(monkeypatch):
+    # Бюджет потоков не трогает потоки процесса тестов
+    monkeypatch.setattr(threads, "limit_threads", lambda count: None)
+    scheduler = FrameBatchScheduler(max_workers=3)
+    try:
+        scheduler.start(min_workers=1, idle_timeout=3600)
+        wait_for(lambda: scheduler.stats()["processes"] == 1)
+        assert scheduler.stats()["start_method"] in ("forkserver", "spawn")
+
+        job = scheduler.job("render")
+        futures = [job.submit(time.sleep, 1.0) for _ in range(3)]
+        for future in futures:
+            future.result(timeout=30)
+        assert scheduler.stats()["processes"] == 3
+        job.close()
+
+        # Пул не простаивал idle_timeout - не сжимается
+        assert not scheduler.scale_down_if_idle()
+        scheduler.idle_timeout = 0
+        assert scheduler.scale_down_if_idle()
+        wait_for(lambda: scheduler.stats()["processes"] == 1)
+        assert scheduler.stats()["scale_downs"] == 1
+        # Пул уже из min_workers процессов - сжимать нечего
+        assert not scheduler.scale_down_if_idle()
+    finally:
+        scheduler.shutdown()
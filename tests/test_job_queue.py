@@ -0,0 +1,144 @@
+import time
+
+import pytest
+
+from src.services.job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "queue.db"), lease_seconds=60, max_attempts=2, retry_backoff=5)
+
+
+def expire_lease(queue, job_id):
+    queue._connection().execute("UPDATE jobs SET lease_expires = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+def make_available(queue, job_id):
+    queue._connection().execute("UPDATE jobs SET available_at = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+def test_claim_takes_highest_priority_first(queue):
+    low = queue.enqueue("video", {"n": 1})
+    high = queue.enqueue("video", {"n": 2}, priority=5)
+    job = queue.claim("w1")
+    assert job["id"] == high
+    assert job["status"] == "running" and job["attempts"] == 1 and job["payload"] == {"n": 2}
+    assert queue.claim("w2")["id"] == low
+    assert queue.claim("w3") is None
+
+
+def test_claim_filters_by_kind_and_job_id(queue):
+    image = queue.enqueue("image", {})
+    video = queue.enqueue("video", {})
+    other = queue.enqueue("video", {})
+    assert queue.claim("w", kinds=["video"], job_id=other)["id"] == other
+    assert queue.claim("w", kinds=["video"])["id"] == video
+    assert queue.claim("w", kinds=["video"]) is None
+    assert queue.claim("w")["id"] == image
+
+
+def test_heartbeat_and_complete_only_by_lease_owner(queue):
+    job_id = queue.enqueue("video", {})
+    queue.claim("w1")
+    assert queue.heartbeat(job_id, "w1")
+    assert not queue.heartbeat(job_id, "w2")
+    assert not queue.complete(job_id, "w2", {"ok": True})
+    assert queue.complete(job_id, "w1", {"ok": True})
+    job = queue.get(job_id)
+    assert job["status"] == "completed" and job["result"] == {"ok": True}
+    assert not queue.heartbeat(job_id, "w1")
+
+
+def test_fail_retries_with_backoff_then_fails(queue):
+    job_id = queue.enqueue("video", {})
+    queue.claim("w")
+    before = time.time()
+    assert queue.fail(job_id, "w", "boom") == "queued"
+    job = queue.get(job_id)
+    assert job["status"] == "queued" and job["error"] == "boom"
+    assert job["available_at"] >= before + queue.retry_delay(1)
+    # Повтор еще не наступил
+    assert queue.claim("w") is None
+
+    make_available(queue, job_id)
+    assert queue.claim("w")["attempts"] == 2
+    assert queue.fail(job_id, "w", "boom again") == "failed"
+    assert queue.get(job_id)["status"] == "failed"
+    assert queue.fail(job_id, "w", "late") is None
+
+
+def test_retry_delay_doubles_up_to_limit(tmp_path):
+    queue = JobQueue(str(tmp_path / "q.db"), retry_backoff=5, max_retry_delay=30)
+    assert [queue.retry_delay(n) for n in (1, 2, 3, 4)] == [5, 10, 20, 30]
+
+
+def test_expired_lease_is_requeued_with_backoff(queue):
+    job_id = queue.enqueue("video", {})
+    queue.claim("w1")
+    expire_lease(queue, job_id)
+    before = time.time()
+    # Захват возвращает задачу в очередь, но не раньше retry_delay
+    assert queue.claim("w2") is None
+    job = queue.get(job_id)
+    assert job["status"] == "queued" and job["lease_owner"] is None
+    assert job["available_at"] >= before + queue.retry_delay(1)
+    assert not queue.heartbeat(job_id, "w1")
+
+    make_available(queue, job_id)
+    assert queue.claim("w2")["lease_owner"] == "w2"
+
+
+def test_expired_lease_after_last_attempt_fails(queue):
+    job_id = queue.enqueue("video", {}, max_attempts=1)
+    queue.claim("w1")
+    expire_lease(queue, job_id)
+    assert queue.claim("w2") is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and "Lease expired" in job["error"]
+
+
+def test_stats_and_list_jobs(queue):
+    done = queue.enqueue("video", {})
+    queued = queue.enqueue("video", {})
+    queue.claim("w", job_id=done)
+    queue.complete(done, "w")
+    assert queue.stats() == {"queued": 1, "running": 0, "completed": 1, "failed": 0}
+    assert [job["id"] for job in queue.list_jobs("queued")] == [queued]
+    assert [job["id"] for job in queue.list_jobs("completed")] == [done]
+
+
+def test_evict_removes_old_finished_and_abandoned_jobs(queue):
+    old = queue.enqueue("video", {})
+    queue.claim("w", job_id=old)
+    queue.complete(old, "w")
+    abandoned = queue.enqueue("video", {})
+    fresh = queue.enqueue("video", {})
+    past = time.time() - queue.retention_seconds - 1
+    conn = queue._connection()
+    conn.execute("UPDATE jobs SET finished_at = ? WHERE id = ?", (past, old))
+    conn.execute("UPDATE jobs SET available_at = ? WHERE id = ?", (past, abandoned))
+    assert sorted(queue.evict()) == sorted([old, abandoned])
+    assert queue.get(fresh) is not None
+
+
+def test_enqueue_claimed_by_worker(queue):
+    job_id = queue.enqueue("video_render", {}, max_attempts=1, worker_id="host:1")
+    job = queue.get(job_id)
+    assert job["status"] == "running" and job["attempts"] == 1 and job["lease_owner"] == "host:1"
+    # Другим воркерам задача недоступна
+    assert queue.claim("w") is None
+    assert queue.heartbeat(job_id, "host:1")
+    # Одна попытка: ошибка сразу переводит задачу в failed
+    assert queue.fail(job_id, "host:1", "corrupt input") == "failed"
+    assert queue.get(job_id)["error"] == "corrupt input"
+
+
+def test_fail_orphaned_marks_jobs_of_dead_owners(queue):
+    dead = queue.enqueue("video_render", {}, worker_id="host:1")
+    alive = queue.enqueue("video_render", {}, worker_id="host:2")
+    other_kind = queue.enqueue("video", {}, worker_id="host:1")
+    assert queue.fail_orphaned("video_render", lambda owner: owner == "host:2", "interrupted") == [dead]
+    assert queue.get(dead)["status"] == "failed" and queue.get(dead)["error"] == "interrupted"
+    assert queue.get(alive)["status"] == "running"
+    assert queue.get(other_kind)["status"] == "running"
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from src.dive_color_corrector.lut import filter_to_lut, filter_to_cube, MAX_LUT_SIZE
+from src.dive_color_corrector.mobile_correct import apply_filter_cpu
+
+IDENTITY = [1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1, 0]
+# Фильтр как у подводного кадра: усиление красного с примесью зеленого и синего
+UNDERWATER = [1.4, 0.3, 0.2, 0, -0.05, 0, 1.1, 0, 0, -0.02, 0, 0, 1.05, 0, -0.03, 0, 0, 0, 1, 0]
+
+
+def test_identity_filter_gives_identity_lut():
+    table = filter_to_lut(IDENTITY, size=5)
+    levels = np.linspace(0, 1, 5)
+    # Порядок .cube: быстрее всего меняется R, медленнее всего B
+    expected = np.array([[r, g, b] for b in levels for g in levels for r in levels])
+    np.testing.assert_allclose(table, expected, atol=1e-6)
+
+
+def test_lut_matches_apply_filter_on_grid_points():
+    size = 16  # шаг 17 - узлы сетки целые, как пиксели
+    table = filter_to_lut(UNDERWATER, size=size)
+    levels = np.linspace(0, 255, size)
+    grid = np.array([[[r, g, b] for b in levels for g in levels for r in levels]], dtype=np.uint8)
+    expected = apply_filter_cpu(grid, UNDERWATER)[0] / 255.0
+    np.testing.assert_allclose(table, expected, atol=1.5 / 255)
+
+
+@pytest.mark.parametrize("requested, actual", [(1, 2), (17, 17), (1000, MAX_LUT_SIZE)])
+def test_lut_size_is_clamped(requested, actual):
+    assert len(filter_to_lut(IDENTITY, size=requested)) == actual ** 3
+
+
+def test_cube_text_format():
+    lines = filter_to_cube(IDENTITY, size=3, title="Test").splitlines()
+    assert lines[:4] == ['TITLE "Test"', "LUT_3D_SIZE 3", "DOMAIN_MIN 0.0 0.0 0.0", "DOMAIN_MAX 1.0 1.0 1.0"]
+    assert len(lines) == 4 + 27
+    assert lines[4] == "0.000000 0.000000 0.000000"
+    assert lines[5] == "0.500000 0.000000 0.000000"
+    assert lines[-1] == "1.000000 1.000000 1.000000"
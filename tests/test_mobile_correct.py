@@ -0,0 +1,191 @@
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+import pytest
+
+from src.dive_color_corrector import mobile_correct
+from src.dive_color_corrector.frame_scheduler import FrameBatchScheduler
+from src.dive_color_corrector.resources import ResourceGovernor
+
+FRAMES = 24
+
+
+class InlineExecutor:
+    """Батчи выполняются в этом же процессе"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class FakeGovernor:
+    """Память на пределе для первых paused батчей"""
+
+    def __init__(self, paused=0):
+        self.paused = paused
+        self.waits = 0
+
+    def job_budget(self, requested, frame_bytes, workers):
+        return requested
+
+    def in_flight_limit(self, requested):
+        if self.paused:
+            self.paused -= 1
+            return 0
+        return requested
+
+    def wait_while_paused(self):
+        self.waits += 1
+        return 0.0
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / "in.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 24, (64, 48))
+    for n in range(FRAMES):
+        frame = np.full((48, 64, 3), (160, 110 + n, 40), dtype=np.uint8)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def governor(monkeypatch):
+    monkeypatch.setattr(mobile_correct, "BATCH_SIZE", 4)
+    scheduler = FrameBatchScheduler(max_workers=2)
+    scheduler._executor = InlineExecutor()
+    monkeypatch.setattr(mobile_correct, "get_frame_scheduler", lambda: scheduler)
+    governor = FakeGovernor()
+    monkeypatch.setattr(mobile_correct, "get_governor", lambda: governor)
+    return governor
+
+
+def render(video, tmp_path, events):
+    video_data = mobile_correct.analyze_video_mobile(video, str(tmp_path / "out.mp4"))
+    return mobile_correct.process_video_mobile(video_data, events.append)
+
+
+def test_render_reports_progress_once_per_batch(video, tmp_path, governor):
+    events = []
+    render(video, tmp_path, events)
+    assert len(events) == FRAMES // mobile_correct.BATCH_SIZE
+    assert all(event["stage"] == "processing" for event in events)
+    assert [event["frames_processed"] for event in events] == list(range(4, FRAMES + 1, 4))
+    assert events[-1]["progress"] == 100 and events[-1]["total_frames"] == FRAMES
+    assert events[0]["progress"] > 50
+
+
+def test_render_waits_while_memory_is_paused(video, tmp_path, governor):
+    governor.paused = 2
+    events = []
+    result = render(video, tmp_path, events)
+    assert governor.waits == 2
+    assert result["frame_range"] == (1, FRAMES)
+    assert events[-1]["frames_processed"] == FRAMES
+
+
+def test_wait_while_paused_backs_off_until_state_changes(monkeypatch):
+    governor = ResourceGovernor.__new__(ResourceGovernor)
+    states = iter(["pause", "pause", "pause", "throttle"])
+    monkeypatch.setattr(governor, "state", lambda: next(states))
+    sleeps = []
+    monkeypatch.setattr("src.dive_color_corrector.resources.time.sleep", sleeps.append)
+    governor.wait_while_paused(initial=0.1, max_delay=0.3, timeout=60)
+    assert sleeps == [0.1, 0.2, 0.3]
+
+
+def test_wait_while_paused_gives_up_after_timeout(monkeypatch):
+    governor = ResourceGovernor.__new__(ResourceGovernor)
+    monkeypatch.setattr(governor, "state", lambda: "pause")
+    assert governor.wait_while_paused(initial=0.01, max_delay=0.01, timeout=0.05) >= 0.05
+
+
+def fake_probe(monkeypatch, fps, frame_count):
+    monkeypatch.setattr(mobile_correct, "probe_video_mobile", lambda path: {
+        "fps": fps, "frame_count": frame_count, "width": 1920, "height": 1080, "rotation_angle": 90,
+        "original_bitrate": 8_000_000, "original_audio_bitrate": 128_000,
+    })
+
+
+def proxy(fps, frame_count, filter_indices):
+    return {
+        "fps": fps,
+        "frame_count": frame_count,
+        "filter_indices": filter_indices,
+        "filters": [np.full(20, n, dtype=np.float32) for n in filter_indices],
+    }
+
+
+def test_proxy_samples_map_onto_original_frames_by_time(monkeypatch):
+    # Оригинал 60 fps, прокси 30 fps: та же секунда - вдвое больший номер кадра
+    fake_probe(monkeypatch, 60, 600)
+    data = mobile_correct.map_proxy_analysis(proxy(30, 300, [1, 31, 61, 300]), "in.mp4", "out.mp4")
+    assert data["filter_indices"] == [1, 61, 121, 599]
+    assert [int(f[0]) for f in data["filters"]] == [1, 31, 61, 300]
+    assert data["fps"] == 60 and data["frame_count"] == 600
+    assert data["rotation_angle"] == 90 and data["original_bitrate"] == 8_000_000
+    assert data["analysis_source"] == "proxy"
+
+
+def test_proxy_samples_are_clamped_to_original_frame_count(monkeypatch):
+    # Прокси на кадр длиннее оригинала с другим fps: последний кадр прокси
+    # попадает за конец оригинала и переносится на его последний кадр
+    fake_probe(monkeypatch, 25, 250)
+    data = mobile_correct.map_proxy_analysis(proxy(30, 301, [1, 31, 91, 301]), "in.mp4", "out.mp4")
+    assert data["filter_indices"] == [1, 26, 76, 250]
+
+
+def test_proxy_samples_on_same_original_frame_keep_the_last(monkeypatch):
+    fake_probe(monkeypatch, 10, 100)
+    data = mobile_correct.map_proxy_analysis(proxy(30, 300, [1, 2, 31]), "in.mp4", "out.mp4")
+    assert data["filter_indices"] == [1, 11]
+    assert [int(f[0]) for f in data["filters"]] == [2, 31]
+
+
+def test_proxy_with_other_duration_is_rejected(monkeypatch):
+    fake_probe(monkeypatch, 30, 300)
+    # Расхождение в пределах секунды допустимо
+    mobile_correct.map_proxy_analysis(proxy(30, 320, [1]), "in.mp4", "out.mp4")
+    with pytest.raises(ValueError, match="Прокси не соответствует оригиналу"):
+        mobile_correct.map_proxy_analysis(proxy(30, 200, [1]), "in.mp4", "out.mp4")
+
+
+def test_frame_range_converts_seconds_to_frames():
+    assert mobile_correct.get_frame_range(30, 300) == (1, 300)
+    assert mobile_correct.get_frame_range(30, 300, start=2, end=5) == (61, 150)
+    assert mobile_correct.get_frame_range(30, 300, start=0, end=5) == (1, 150)
+    # Конец за последним кадром обрезается по длине видео
+    assert mobile_correct.get_frame_range(30, 300, start=8, end=60) == (241, 300)
+
+
+@pytest.mark.parametrize("start, end", [(5, 5), (20, None)])
+def test_empty_frame_range_is_rejected(start, end):
+    with pytest.raises(ValueError, match="Пустой отрезок"):
+        mobile_correct.get_frame_range(30, 300, start=start, end=end)
+
+
+def analyzed_samples(video, tmp_path, **kwargs):
+    return mobile_correct.analyze_video_mobile(video, str(tmp_path / "out.mp4"), **kwargs)["filter_indices"]
+
+
+def test_trimmed_analysis_keeps_one_sample_margin(video, tmp_path, governor, monkeypatch):
+    monkeypatch.setattr(mobile_correct, "get_sample_step", lambda fps: 2)
+    assert analyzed_samples(video, tmp_path) == list(range(2, FRAMES + 1, 2))
+    # Кадры 7-12 и по одному шагу семплирования с каждой стороны
+    assert analyzed_samples(video, tmp_path, start=0.25, end=0.5) == [6, 8, 10, 12, 14]
+    # Без запаса за концом файла и с концом за последним кадром
+    assert analyzed_samples(video, tmp_path, start=0.5, end=60) == list(range(12, FRAMES + 1, 2))
+
+
+def test_trimmed_analysis_skips_decode_when_samples_are_precomputed(video, tmp_path, governor, monkeypatch):
+    monkeypatch.setattr(mobile_correct, "get_sample_step", lambda fps: 2)
+    precomputed = {n: np.full(20, n, dtype=np.float32) for n in range(2, FRAMES + 1, 2)}
+    monkeypatch.setattr(mobile_correct, "_process_frame_for_analysis", None)
+    # Учитываются только заранее посчитанные кадры отрезка с запасом
+    assert analyzed_samples(video, tmp_path, start=0.25, end=0.5, precomputed_filters=precomputed) == [6, 8, 10, 12, 14]
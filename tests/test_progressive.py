@@ -0,0 +1,64 @@
+import struct
+
+import pytest
+
+from src.dive_color_corrector.progressive import (
+    inspect_mp4_layout, LAYOUT_PROGRESSIVE, LAYOUT_MOOV_AT_END, LAYOUT_UNSUPPORTED
+)
+
+
+def box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def large_box(box_type, payload=b""):
+    return struct.pack(">I4sQ", 16 + len(payload), box_type, 16 + len(payload)) + payload
+
+
+def write(tmp_path, data):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_moov_before_mdat_is_progressive(tmp_path):
+    data = box(b"ftyp", b"isom") + box(b"moov", b"x" * 32) + box(b"mdat", b"y" * 64)
+    assert inspect_mp4_layout(write(tmp_path, data), len(data)) == LAYOUT_PROGRESSIVE
+
+
+def test_moov_not_fully_received_yet(tmp_path):
+    data = box(b"ftyp", b"isom") + box(b"moov", b"x" * 32) + box(b"mdat", b"y" * 64)
+    assert inspect_mp4_layout(write(tmp_path, data), 20) is None
+
+
+def test_mdat_before_moov_is_moov_at_end(tmp_path):
+    data = box(b"ftyp", b"isom") + box(b"mdat", b"y" * 64) + box(b"moov", b"x" * 32)
+    assert inspect_mp4_layout(write(tmp_path, data), len(data)) == LAYOUT_MOOV_AT_END
+
+
+def test_fragmented_moof_counts_as_moov_at_end(tmp_path):
+    data = box(b"ftyp", b"isom") + box(b"moof", b"z" * 16)
+    assert inspect_mp4_layout(write(tmp_path, data), len(data)) == LAYOUT_MOOV_AT_END
+
+
+def test_64bit_box_size_is_followed(tmp_path):
+    data = large_box(b"free", b"f" * 8) + box(b"moov", b"x" * 8)
+    assert inspect_mp4_layout(write(tmp_path, data), len(data)) == LAYOUT_PROGRESSIVE
+
+
+def test_box_to_end_of_file(tmp_path):
+    data = box(b"ftyp", b"isom") + struct.pack(">I4s", 0, b"mdat") + b"y" * 16
+    assert inspect_mp4_layout(write(tmp_path, data), len(data)) == LAYOUT_MOOV_AT_END
+
+
+@pytest.mark.parametrize("data", [
+    b"\x00\x00\x00\x10\x01\x02\x03\x04" + b"\x00" * 8,  # тип атома не ASCII
+    struct.pack(">I4s", 4, b"ftyp") + b"\x00" * 8,       # размер меньше заголовка
+])
+def test_not_an_mp4_is_unsupported(tmp_path, data):
+    assert inspect_mp4_layout(write(tmp_path, data), len(data)) == LAYOUT_UNSUPPORTED
+
+
+def test_too_little_data(tmp_path):
+    data = box(b"ftyp", b"isom")
+    assert inspect_mp4_layout(write(tmp_path, data), 4) is None
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from src.services.redis_queue import RedisJobQueue
+from src.services.worker import VideoWorker
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def queue(client):
+    return RedisJobQueue(client, prefix="test", visibility_timeout=0.05, max_attempts=2)
+
+
+def pending(queue):
+    return queue.client.xpending(queue.stream, queue.GROUP)["pending"]
+
+
+def test_claim_delivers_job_to_one_worker(queue):
+    job_id = queue.enqueue("video", {"input_path": "a.mp4"})
+    assert queue.get(job_id)["status"] == "queued"
+
+    job = queue.claim("w1", block_ms=10)
+    assert job["id"] == job_id
+    assert job["payload"] == {"input_path": "a.mp4"}
+    assert job["status"] == "running" and job["consumer"] == "w1" and job["attempts"] == 1
+    assert pending(queue) == 1
+    # Новых сообщений нет, а взятое еще не просрочено
+    assert queue.claim("w2", block_ms=10) is None
+
+
+def test_complete_acks_and_stores_result(queue):
+    job_id = queue.enqueue("video", {})
+    job = queue.claim("w1", block_ms=10)
+    queue.complete(job, {"output_filename": "out.mp4"})
+
+    stored = queue.get(job_id)
+    assert stored["status"] == "completed"
+    assert stored["result"] == {"output_filename": "out.mp4"}
+    assert pending(queue) == 0
+    assert queue.client.xlen(queue.stream) == 0
+    assert queue.client.ttl(queue._job_key(job_id)) > 0
+
+
+def test_stale_job_is_reclaimed_by_xautoclaim(queue):
+    job_id = queue.enqueue("video", {})
+    first = queue.claim("w1", block_ms=10)
+    time.sleep(0.1)
+
+    job = queue.claim("w2", block_ms=10)
+    assert job["id"] == job_id and job["consumer"] == "w2" and job["attempts"] == 2
+    # Пропавший воркер больше не владеет задачей
+    assert not queue.heartbeat(first, "w1")
+    assert queue.heartbeat(job, "w2")
+
+
+def test_reclaim_after_max_attempts_fails_job(queue):
+    job_id = queue.enqueue("video", {})
+    queue.claim("w1", block_ms=10)
+    time.sleep(0.1)
+    queue.claim("w2", block_ms=10)
+    time.sleep(0.1)
+
+    assert queue.claim("w3", block_ms=10) is None
+    stored = queue.get(job_id)
+    assert stored["status"] == "failed" and "Visibility timeout" in stored["error"]
+    assert pending(queue) == 0
+
+
+def test_fail_requeues_until_attempts_exhausted(queue):
+    job_id = queue.enqueue("video", {})
+    job = queue.claim("w1", block_ms=10)
+    assert queue.fail(job, "boom") == "queued"
+    assert queue.get(job_id)["status"] == "queued"
+    assert pending(queue) == 0
+
+    retry = queue.claim("w2", block_ms=10)
+    assert retry["id"] == job_id and retry["attempts"] == 2
+    assert queue.fail(retry, "boom again") == "failed"
+    stored = queue.get(job_id)
+    assert stored["status"] == "failed" and stored["error"] == "boom again"
+    assert queue.client.xlen(queue.stream) == 0
+
+
+def test_progress_and_stats(queue):
+    job_id = queue.enqueue("video", {})
+    job = queue.claim("w1", block_ms=10)
+    queue.progress(job_id, {"progress": 40, "eta_seconds": 12})
+    assert queue.get(job_id)["progress"] == {"progress": 40, "eta_seconds": 12}
+
+    stats = queue.stats()
+    assert stats["pending"] == 1
+    assert [c["name"] for c in stats["consumers"]] == ["w1"]
+    queue.complete(job, {})
+    assert queue.stats()["pending"] == 0
+
+
+class FakeProcessor:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def run_video_job(self, input_path, output_path, content_hash, options, progress_callback=None,
+                      features=None, predicted=None):
+        self.calls.append((input_path, output_path, content_hash, options, features, predicted))
+        progress_callback({"progress": 100})
+        if self.error:
+            raise RuntimeError(self.error)
+        return {"output_path": output_path}
+
+
+def test_worker_runs_job_and_publishes_progress(queue):
+    processor = FakeProcessor()
+    worker = VideoWorker(queue, name="w1", processor=processor)
+    features = {"width": 64, "height": 48, "frames": 10, "cpu_count": 2}
+    job_id = queue.enqueue("video", {"input_path": "in.mp4", "output_path": "out.mp4", "content_hash": "abc",
+                                     "options": {}, "features": features, "predicted_seconds": 3.5})
+
+    assert worker.run_once(block_ms=10)
+    # Признаки и прогноз, посчитанные API, передаются воркеру
+    assert processor.calls == [("in.mp4", "out.mp4", "abc", {}, features, 3.5)]
+    stored = queue.get(job_id)
+    assert stored["status"] == "completed" and stored["result"] == {"output_path": "out.mp4"}
+    assert stored["progress"] == {"progress": 100}
+    assert not worker.run_once(block_ms=10)
+
+
+def test_worker_failure_goes_to_retry(queue):
+    worker = VideoWorker(queue, name="w1", processor=FakeProcessor(error="decode error"))
+    job_id = queue.enqueue("video", {"input_path": "in.mp4", "output_path": "out.mp4",
+                                     "content_hash": "abc", "options": {}})
+    assert worker.run_once(block_ms=10)
+    stored = queue.get(job_id)
+    assert stored["status"] == "queued" and stored["error"] == "decode error"
@@ -0,0 +1,108 @@
+import pytest
+
+from src.dive_color_corrector import resources
+from src.dive_color_corrector.resources import ResourceGovernor, read_cgroup_limits, MIN_JOB_BUDGET
+
+MB = 1024 * 1024
+
+
+def write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+@pytest.fixture
+def cgroup_paths(monkeypatch):
+    """Подменяет /proc/self/cgroup: {контроллер: путь группы}"""
+    paths = {}
+    monkeypatch.setattr(resources, "_cgroup_paths", lambda: paths)
+    return paths
+
+
+def make_v2(root, cpu_max="max", memory_max="max", current=None, inactive=0):
+    write(root / "cgroup.controllers", "cpu memory")
+    write(root / "cpu.max", cpu_max)
+    write(root / "memory.max", memory_max)
+    if current is not None:
+        write(root / "memory.current", str(current))
+        write(root / "memory.stat", f"anon {current}\ninactive_file {inactive}\n")
+
+
+def test_no_cgroup(tmp_path, cgroup_paths):
+    assert read_cgroup_limits(str(tmp_path)) == {
+        "version": None, "cpu_quota": None, "memory_limit": None, "memory_usage": None
+    }
+
+
+def test_v2_limits_and_usage_without_inactive_cache(tmp_path, cgroup_paths):
+    make_v2(tmp_path, cpu_max="150000 100000", memory_max=str(512 * MB), current=300 * MB, inactive=100 * MB)
+    limits = read_cgroup_limits(str(tmp_path))
+    assert limits == {"version": 2, "cpu_quota": 1.5, "memory_limit": 512 * MB, "memory_usage": 200 * MB}
+
+
+def test_v2_unlimited(tmp_path, cgroup_paths):
+    make_v2(tmp_path, current=10 * MB)
+    limits = read_cgroup_limits(str(tmp_path))
+    assert limits["version"] == 2
+    assert limits["cpu_quota"] is None and limits["memory_limit"] is None
+    assert limits["memory_usage"] == 10 * MB
+
+
+def test_v2_takes_strictest_limit_up_the_hierarchy(tmp_path, cgroup_paths):
+    cgroup_paths[""] = "/system.slice/docker-abc.scope"
+    make_v2(tmp_path)
+    write(tmp_path / "system.slice" / "cpu.max", "200000 100000")
+    write(tmp_path / "system.slice" / "memory.max", str(256 * MB))
+    group = tmp_path / "system.slice" / "docker-abc.scope"
+    write(group / "cpu.max", "400000 100000")
+    write(group / "memory.max", "max")
+    write(group / "memory.current", str(64 * MB))
+    write(group / "memory.stat", "inactive_file 0\n")
+
+    limits = read_cgroup_limits(str(tmp_path))
+    assert limits["cpu_quota"] == 2.0
+    assert limits["memory_limit"] == 256 * MB
+    # Потребление - у группы процесса
+    assert limits["memory_usage"] == 64 * MB
+
+
+def test_v1_limits(tmp_path, cgroup_paths):
+    write(tmp_path / "cpu,cpuacct" / "cpu.cfs_quota_us", "250000")
+    write(tmp_path / "cpu,cpuacct" / "cpu.cfs_period_us", "100000")
+    write(tmp_path / "memory" / "memory.limit_in_bytes", str(1024 * MB))
+    write(tmp_path / "memory" / "memory.usage_in_bytes", str(400 * MB))
+    write(tmp_path / "memory" / "memory.stat", f"cache 0\ntotal_inactive_file {150 * MB}\n")
+    limits = read_cgroup_limits(str(tmp_path))
+    assert limits == {"version": 1, "cpu_quota": 2.5, "memory_limit": 1024 * MB, "memory_usage": 250 * MB}
+
+
+def test_v1_unlimited_quota_and_memory(tmp_path, cgroup_paths):
+    write(tmp_path / "cpu" / "cpu.cfs_quota_us", "-1")
+    write(tmp_path / "cpu" / "cpu.cfs_period_us", "100000")
+    write(tmp_path / "memory" / "memory.limit_in_bytes", "9223372036854771712")
+    limits = read_cgroup_limits(str(tmp_path))
+    assert limits["version"] == 1
+    assert limits["cpu_quota"] is None and limits["memory_limit"] is None
+
+
+def test_governor_uses_quota_and_memory(tmp_path, cgroup_paths, monkeypatch):
+    monkeypatch.setattr(resources, "_affinity_cpu_count", lambda: 16)
+    monkeypatch.setattr(resources, "process_tree_rss", lambda pid=None: None)
+    make_v2(tmp_path, cpu_max="150000 100000", memory_max=str(1024 * MB), current=0)
+    governor = ResourceGovernor(str(tmp_path), sample_interval=0)
+    # Квота 1.5 ядра округляется вверх
+    assert governor.cpu_count == 2
+    assert governor.pool_size() == 2
+    assert governor.state() == "ok"
+    assert governor.concurrency_limit(4) == 4
+
+    write(tmp_path / "memory.current", str(800 * MB))
+    write(tmp_path / "memory.stat", "inactive_file 0\n")
+    assert governor.state() == "throttle"
+    assert governor.in_flight_limit(8) == 1 and governor.concurrency_limit(4) == 1
+    assert governor.job_budget(512 * MB, 1920 * 1080 * 3, 2) == MIN_JOB_BUDGET
+
+    write(tmp_path / "memory.current", str(950 * MB))
+    assert governor.state() == "pause"
+    assert governor.in_flight_limit(8) == 0 and governor.concurrency_limit(4) == 0
+    assert governor.pool_size() == 1
@@ -0,0 +1,132 @@
+import os
+import asyncio
+
+import pytest
+
+from src.services.storage import OutputStore
+from src.services.result_cache import ResultCache
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OutputStore(str(tmp_path / "outputs"), ttl_seconds=3600, max_bytes=1 << 30)
+
+
+def write_output(store, name, data=b"video"):
+    path = store.path_for(name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_make_key_depends_on_input_params_and_engine():
+    key = ResultCache.make_key("abc", {"quality": 80}, "1.0.0")
+    assert key == ResultCache.make_key("abc", {"quality": 80}, "1.0.0")
+    assert key != ResultCache.make_key("abd", {"quality": 80}, "1.0.0")
+    assert key != ResultCache.make_key("abc", {"quality": 81}, "1.0.0")
+    assert key != ResultCache.make_key("abc", {"quality": 80}, "1.0.1")
+
+
+def test_put_and_get_round_trip(store):
+    cache = ResultCache(store)
+    write_output(store, "out.mp4")
+    cache.put("k", {"output_filename": "out.mp4", "status": "success"})
+    assert cache.get("k") == {"output_filename": "out.mp4", "status": "success"}
+
+
+def test_get_drops_entry_when_output_was_evicted(store):
+    cache = ResultCache(store)
+    path = write_output(store, "out.mp4")
+    cache.put("k", {"output_filename": "out.mp4"})
+    os.remove(path)
+    assert cache.get("k") is None
+    assert not os.path.exists(cache._index_path("k"))
+
+
+def test_get_or_compute_coalesces_concurrent_requests(store):
+    cache = ResultCache(store)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        write_output(store, "out.mp4")
+        return {"output_filename": "out.mp4", "status": "success"}
+
+    async def run():
+        first = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)))
+        second = await cache.get_or_compute("k", compute)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert calls == 1
+    assert sorted(status for _, status in first) == ["coalesced", "coalesced", "miss"]
+    assert second[1] == "hit"
+
+
+def test_get_or_compute_shares_failure_and_does_not_cache_it(store):
+    cache = ResultCache(store)
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.get("k") is None
+    assert not cache._inflight
+
+
+def test_cancelled_owner_hands_job_to_waiting_request(store):
+    cache = ResultCache(store)
+    calls = []
+
+    def make_compute(name, delay):
+        async def compute():
+            calls.append(name)
+            await asyncio.sleep(delay)
+            write_output(store, f"{name}.mp4")
+            return {"output_filename": f"{name}.mp4", "status": "success"}
+        return compute
+
+    async def run():
+        owner = asyncio.ensure_future(cache.get_or_compute("k", make_compute("owner", 10)))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(cache.get_or_compute("k", make_compute(f"w{n}", 0.05))) for n in range(2)]
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        results = await asyncio.gather(*waiters)
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return results
+
+    results = asyncio.run(run())
+    # Задачу заново запустил первый ожидающий, второй присоединился к нему
+    assert calls == ["owner", "w0"]
+    assert [status for _, status in results] == ["miss", "coalesced"]
+    assert all(result["output_filename"] == "w0.mp4" for result, _ in results)
+    assert cache.get("k")["output_filename"] == "w0.mp4"
+
+
+def test_cancelled_waiter_does_not_cancel_shared_job(store):
+    cache = ResultCache(store)
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        write_output(store, "out.mp4")
+        return {"output_filename": "out.mp4", "status": "success"}
+
+    async def run():
+        owner = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await owner
+
+    result, status = asyncio.run(run())
+    assert status == "miss" and result["output_filename"] == "out.mp4"
@@ -0,0 +1,204 @@
+import os
+import json
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI, HTTPException, WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from src.api.routes import router
+from src.config.settings import settings
+from src.services.live import LiveSession
+from src.services.video_processor import video_processor
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "sample.mp4")
+
+
+@pytest.fixture
+def client():
+    # Только роуты: без фоновых задач и пула процессов кадров из src.api.main
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def busy(*args, **kwargs):
+    raise HTTPException(status_code=429, detail="Server is busy, retry later", headers={"Retry-After": "7"})
+
+
+def test_process_image_keeps_429(client, monkeypatch):
+    monkeypatch.setattr(video_processor, "process_image", busy)
+    response = client.post("/api/process/image", files={"file": ("a.jpg", b"jpeg", "image/jpeg")})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+
+
+def test_process_video_is_admitted_before_stream(client, monkeypatch):
+    monkeypatch.setattr(video_processor.lanes["batch"], "check", busy)
+    with open(SAMPLE, "rb") as f:
+        response = client.post("/api/process/video", files={"file": ("sample.mp4", f, "video/mp4")})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+    # Рабочая директория отклоненной задачи удалена
+    assert os.listdir(video_processor.workspaces.root) == []
+
+
+def sse_events(response):
+    return [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+
+
+def post_sample(client, url="/api/process/video"):
+    with open(SAMPLE, "rb") as f:
+        return client.post(url, files={"file": ("sample.mp4", f, "video/mp4")})
+
+
+def test_process_video_fails_fast_through_job_queue(client, monkeypatch):
+    calls = []
+
+    def broken(*args):
+        calls.append(args)
+        raise ValueError("corrupt input")
+
+    monkeypatch.setattr(video_processor.result_cache, "get", lambda key: None)
+    monkeypatch.setattr(video_processor, "run_video_job", broken)
+    response = post_sample(client)
+    assert response.status_code == 200
+    error = sse_events(response)[-1]
+    assert error["status"] == "error" and error["status_code"] == 500 and "corrupt input" in error["detail"]
+    # Одна попытка, задача в очереди - failed, а не ждет повтора
+    assert len(calls) == 1
+    job = video_processor.queue.list_jobs("failed", limit=1)[0]
+    assert job["kind"] == video_processor.LOCAL_VIDEO_JOB and job["error"] == "corrupt input"
+    assert video_processor.queue.list_jobs("queued") == []
+
+
+def test_process_video_streams_progress_and_result(client):
+    response = post_sample(client)
+    assert response.status_code == 200
+    events = sse_events(response)
+    statuses = [event.get("status") or event.get("stage") for event in events]
+    assert "analyzing_complete" in statuses
+    assert statuses.index("analyzing") < statuses.index("analyzing_complete") < statuses.index("processing")
+    result = events[-1]
+    assert result["cache"] == "miss" and result["input_filename"] == "sample.mp4"
+    assert os.path.exists(video_processor.output_store.path_for(result["output_filename"]))
+    assert video_processor.queue.list_jobs("completed", limit=1)[0]["kind"] == video_processor.LOCAL_VIDEO_JOB
+    # Задача записана в JobRegistry и ее директория сохранена
+    job = client.get(f"/api/jobs/{result['job_id']}")
+    assert job.status_code == 200 and job.json()["data"]["status"] == "completed"
+    assert client.get(f"/api/jobs/{result['job_id']}/download").status_code == 200
+
+    # Повтор из кеша - своя задача, тоже доступная по job_id
+    cached = sse_events(post_sample(client))[-1]
+    assert cached["cache"] == "hit" and cached["job_id"] != result["job_id"]
+    assert client.get(f"/api/jobs/{cached['job_id']}/download").status_code == 200
+
+
+def test_files_lists_directory_outputs(client):
+    package = video_processor.output_store.path_for("listing_hls")
+    os.makedirs(package, exist_ok=True)
+    with open(os.path.join(package, "master.m3u8"), "wb") as f:
+        f.write(b"#EXTM3U\n")
+    files = {entry["filename"]: entry for entry in client.get("/api/files").json()["files"]}
+    assert files["listing_hls"]["is_dir"] and files["listing_hls"]["size"] == 8
+    # Индекс кеша результатов - служебный
+    assert ".results" not in files
+
+    assert client.delete("/api/files/listing_hls").status_code == 200
+    assert not os.path.exists(package)
+    assert client.delete("/api/files/.results").status_code == 404
+
+
+@pytest.fixture
+def sample_job():
+    """Завершенная задача с исходником sample.mp4 (без рендера)"""
+    workspace = video_processor.workspaces.create()
+    shutil.copy(SAMPLE, workspace.file_path("sample.mp4"))
+    video_processor.jobs.register(workspace, "sample.mp4", "preview-sample", {}, {"output_filename": "preview.mp4"})
+    video_processor.workspaces.release(workspace, remove=False)
+    return workspace.job_id
+
+
+@pytest.mark.parametrize("query", ["t=-1", "mode=sepia"])
+def test_preview_rejects_invalid_query(client, sample_job, query):
+    assert client.get(f"/api/jobs/{sample_job}/preview?{query}").status_code == 400
+
+
+def test_preview_of_unknown_job_is_404(client):
+    assert client.get("/api/jobs/0123456789abcdef0123456789abcdef/preview").status_code == 404
+
+
+def test_preview_returns_nearest_frame_and_caches_it(client, sample_job, monkeypatch):
+    response = client.get(f"/api/jobs/{sample_job}/preview?t=1&width=320&mode=full")
+    assert response.status_code == 200 and response.headers["content-type"] == "image/jpeg"
+    fps = video_processor.previews._sessions[sample_job].video_data["fps"]
+    assert response.headers["x-frame-number"] == str(int(round(fps)) + 1)
+    assert float(response.headers["x-frame-timestamp"]) == pytest.approx(round(fps) / fps, abs=1e-3)
+    image = cv2.imdecode(np.frombuffer(response.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape[1] == 320
+
+    # Тот же кадр (метка округляется до ближайшего) отдается из LRU без декодирования
+    seeker = video_processor.previews._sessions[sample_job].seeker
+    monkeypatch.setattr(seeker, "read", lambda frame_number: pytest.fail("frame decoded again"))
+    cached = client.get(f"/api/jobs/{sample_job}/preview?t=1.001&width=320&mode=full")
+    assert cached.status_code == 200 and cached.content == response.content
+    assert cached.headers["x-frame-number"] == response.headers["x-frame-number"]
+
+
+def test_preview_past_the_end_shows_last_frame(client, sample_job):
+    response = client.get(f"/api/jobs/{sample_job}/preview?t=3600&width=160")
+    assert response.status_code == 200
+    frame_count = video_processor.previews._sessions[sample_job].video_data["frame_count"]
+    assert response.headers["x-frame-number"] == str(frame_count)
+
+
+def jpeg(width=64, height=48):
+    frame = np.full((height, width, 3), (150, 110, 40), dtype=np.uint8)
+    return cv2.imencode(".jpg", frame)[1].tobytes()
+
+
+def test_live_corrects_jpeg_frames_and_reports_stats(client):
+    with client.websocket_connect("/api/mobile/live") as ws:
+        ws.send_bytes(jpeg())
+        corrected = cv2.imdecode(np.frombuffer(ws.receive_bytes(), dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert corrected.shape == (48, 64, 3)
+        stats = json.loads(ws.receive_text())
+        assert stats["type"] == "stats" and stats["seq"] == 1 and stats["processed"] == 1
+        assert stats["latency_ms"] >= stats["process_ms"] >= 0
+
+        # Битый кадр - ошибка с его номером, соединение продолжает работать
+        ws.send_bytes(b"not a jpeg")
+        assert json.loads(ws.receive_text()) == {"type": "error", "seq": 2, "error": "Invalid frame"}
+        ws.send_text(json.dumps({"type": "reset"}))
+        ws.send_bytes(jpeg())
+        ws.receive_bytes()
+        assert json.loads(ws.receive_text())["seq"] == 3
+    assert LiveSession.active == 0
+
+
+def test_live_raw_frames_keep_size(client):
+    with client.websocket_connect("/api/mobile/live?format=raw&width=8&height=6") as ws:
+        ws.send_bytes(bytes(range(144)))
+        assert len(ws.receive_bytes()) == 8 * 6 * 3
+        assert json.loads(ws.receive_text())["type"] == "stats"
+        # Размер не совпадает с width x height
+        ws.send_bytes(b"\x00" * 10)
+        assert json.loads(ws.receive_text())["type"] == "error"
+
+
+@pytest.mark.parametrize("query", ["format=png", "format=raw", "format=raw&width=8"])
+def test_live_rejects_invalid_format(client, query):
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect(f"/api/mobile/live?{query}") as ws:
+            ws.receive_bytes()
+    assert error.value.code == 1003
+
+
+def test_live_refuses_sessions_over_limit(client, monkeypatch):
+    monkeypatch.setattr(LiveSession, "active", settings.LIVE_MAX_SESSIONS)
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect("/api/mobile/live") as ws:
+            ws.receive_bytes()
+    assert error.value.code == 1013
@@ -0,0 +1,93 @@
+import pytest
+
+from src.dive_color_corrector.resources import effective_cpu_count
+from src.services.runtime_model import RuntimeModel, job_features, remaining_seconds, with_eta
+
+PROBE = {"width": 1920, "height": 1080, "frames": 300, "codec": "h264"}
+
+
+@pytest.fixture
+def model(tmp_path):
+    return RuntimeModel(str(tmp_path / "stats.db"), min_samples=3, window=50, max_samples=10)
+
+
+def features(frames=300, mode="full", codec="h264", cpu_count=4):
+    return job_features(dict(PROBE, frames=frames, codec=codec), mode, "cpu", cpu_count)
+
+
+def test_job_features_default_to_effective_cpu_count():
+    assert job_features(PROBE, "full", "cpu")["cpu_count"] == effective_cpu_count()
+    assert job_features(dict(PROBE, codec=None), "review", "gpu", 8) == {
+        "width": 1920, "height": 1080, "frames": 300, "codec": "unknown",
+        "mode": "review", "engine": "gpu", "cpu_count": 8
+    }
+
+
+def test_remaining_seconds():
+    assert remaining_seconds(None, 5) is None
+    assert remaining_seconds(60, 20) == 40
+    assert remaining_seconds(10, 30) == 0
+    # Только по прогрессу: половина за 10 секунд - еще 10
+    assert remaining_seconds(None, 10, 50) == 10
+    # При 90% прогресса оценка ближе к фактической скорости (10 с), чем к прогнозу (110 с)
+    assert remaining_seconds(200, 90, 90) < 40
+
+
+def test_with_eta_adds_eta_to_events():
+    events = []
+    callback = with_eta(events.append, 100)
+    callback({"progress": 0})
+    assert events[0]["eta_seconds"] == pytest.approx(100, abs=0.5)
+    assert with_eta(None, 100) is None
+    with_eta(events.append, None)({"status": "analyzing"})
+    assert "eta_seconds" not in events[1]
+
+
+def test_no_history_no_prediction(model):
+    assert model.predict(features()) is None
+
+
+def test_few_samples_use_average_rate(model):
+    model.record(features(frames=300), 2.0, 8.0)
+    assert model.predict(features(frames=300)) == pytest.approx(10.0)
+    assert model.predict(features(frames=600)) == pytest.approx(20.0)
+
+
+def test_regression_after_min_samples(model):
+    for frames in (100, 200, 300, 400):
+        model.record(features(frames=frames), 1.0, frames / 100)
+    predicted = model.predict(features(frames=1000))
+    assert predicted == pytest.approx(11.0, rel=0.05)
+
+
+def test_prediction_falls_back_to_wider_group(model):
+    for frames in (100, 200, 300):
+        model.record(features(frames=frames, codec="hevc"), 0.0, frames / 10)
+    # Кодека av1 в статистике нет - берется группа того же режима и движка
+    assert model.predict(features(frames=200, codec="av1")) == pytest.approx(20.0, rel=0.05)
+
+
+def test_prediction_is_refitted_after_new_records(model):
+    for frames in (100, 200, 300):
+        model.record(features(frames=frames), 0.0, frames / 100)
+    first = model.predict(features(frames=300))
+    for frames in (100, 200, 300):
+        model.record(features(frames=frames), 0.0, frames / 10)
+    assert model.predict(features(frames=300)) > first
+
+
+def test_stats_report_samples_and_error(model):
+    model.record(features(mode="full"), 1.0, 9.0, predicted_seconds=5.0)
+    model.record(features(mode="review"), 1.0, 1.0)
+    stats = model.stats()
+    assert stats["samples"] == 2
+    assert stats["modes"] == {"full": 1, "review": 1}
+    assert stats["mean_error_pct"] == 50.0
+
+
+def test_evict_keeps_last_max_samples(model):
+    for n in range(15):
+        model.record(features(frames=100 + n), 0.0, 1.0)
+    assert len(model.evict()) == 5
+    assert model.stats()["samples"] == 10
+    assert model.evict() == []
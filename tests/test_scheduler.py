@@ -0,0 +1,303 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from src.services.scheduler import CostScheduler, ExecutionLane, analysis_cost, video_cost
+
+
+def make_scheduler(**overrides):
+    params = dict(budget=100, max_concurrent=4, max_queued_cost=1000, aging_rate=0, initial_throughput=10)
+    params.update(overrides)
+    return CostScheduler(**params)
+
+
+class FakeGovernor:
+    def __init__(self, limit):
+        self.limit = limit
+
+    def concurrency_limit(self, requested):
+        return min(self.limit, requested)
+
+
+def test_video_cost_is_pixel_frames():
+    assert video_cost({"width": 1920, "height": 1080, "frames": 30}) == 1920 * 1080 * 30
+    assert video_cost({"width": 0, "height": 0, "frames": 0}) == 1
+
+
+def test_jobs_within_budget_start_immediately():
+    async def scenario():
+        scheduler = make_scheduler()
+        await scheduler.acquire(60)
+        await scheduler.acquire(40)
+        assert scheduler.running == 2 and scheduler.running_cost == 100
+        scheduler.release(60)
+        scheduler.release(40)
+        assert scheduler.running == 0 and scheduler.running_cost == 0
+        assert scheduler.admitted == 2
+
+    asyncio.run(scenario())
+
+
+def test_job_over_budget_runs_alone_and_takes_whole_budget():
+    async def scenario():
+        scheduler = make_scheduler()
+        await scheduler.acquire(500)
+        assert scheduler.running_cost == 100
+        waiter = asyncio.ensure_future(scheduler.acquire(1))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        scheduler.release(500)
+        await waiter
+        assert scheduler.running == 1 and scheduler.running_cost == 1
+
+    asyncio.run(scenario())
+
+
+def test_cheapest_waiter_is_dispatched_first():
+    async def scenario():
+        scheduler = make_scheduler()
+        await scheduler.acquire(100)
+        order = []
+
+        async def job(cost):
+            await scheduler.acquire(cost)
+            order.append(cost)
+
+        tasks = [asyncio.ensure_future(job(cost)) for cost in (80, 30, 50)]
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 3
+        scheduler.release(100)
+        await asyncio.sleep(0)
+        # 30 и 50 помещаются в бюджет вместе, 80 ждет
+        assert order == [30, 50]
+        scheduler.release(30)
+        scheduler.release(50)
+        await asyncio.gather(*tasks)
+        assert order == [30, 50, 80]
+
+    asyncio.run(scenario())
+
+
+def test_aging_lets_expensive_waiter_go_first():
+    async def scenario():
+        scheduler = make_scheduler(aging_rate=1e6)
+        await scheduler.acquire(100)
+        order = []
+
+        async def job(cost):
+            await scheduler.acquire(cost)
+            order.append(cost)
+
+        expensive = asyncio.ensure_future(job(90))
+        await asyncio.sleep(0.05)
+        cheap = asyncio.ensure_future(job(20))
+        await asyncio.sleep(0)
+        scheduler.release(100)
+        await asyncio.sleep(0)
+        assert order == [90]
+        scheduler.release(90)
+        await asyncio.gather(expensive, cheap)
+
+    asyncio.run(scenario())
+
+
+def test_max_concurrent_limits_running_jobs():
+    async def scenario():
+        scheduler = make_scheduler(max_concurrent=2)
+        await scheduler.acquire(1)
+        await scheduler.acquire(1)
+        waiter = asyncio.ensure_future(scheduler.acquire(1))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        scheduler.release(1)
+        await waiter
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        scheduler = make_scheduler(max_queued_cost=150)
+        await scheduler.acquire(100)
+        waiter = asyncio.ensure_future(scheduler.acquire(100))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as error:
+            await scheduler.acquire(100)
+        assert error.value.status_code == 429
+        # running 100 + очередь 100 + новая 100 при 10 пиксель-кадрах в секунду
+        assert error.value.headers["Retry-After"] == "30"
+        assert scheduler.rejected == 1
+        waiter.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_check_rejects_without_taking_budget():
+    async def scenario():
+        scheduler = make_scheduler(max_queued_cost=150)
+        # Свободный узел: проверка ничего не занимает
+        scheduler.check(100)
+        assert scheduler.running == 0 and scheduler.stats()["queued"] == 0
+        await scheduler.acquire(100)
+        waiter = asyncio.ensure_future(scheduler.acquire(100))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as error:
+            scheduler.check(100)
+        assert error.value.status_code == 429
+        assert "Retry-After" in error.value.headers
+        assert scheduler.stats()["queued"] == 1
+        waiter.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_uses_predicted_duration():
+    scheduler = make_scheduler()
+    assert scheduler.retry_after(100) == 10
+    assert scheduler.retry_after(100, duration=3.2) == 4
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        scheduler = make_scheduler()
+        await scheduler.acquire(100)
+        waiter = asyncio.ensure_future(scheduler.acquire(50))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["queued"] == 0
+        scheduler.release(100)
+        assert scheduler.running == 0
+
+    asyncio.run(scenario())
+
+
+def test_governor_pause_rejects_and_throttle_limits_concurrency():
+    async def scenario():
+        governor = FakeGovernor(0)
+        scheduler = make_scheduler(governor=governor)
+        with pytest.raises(HTTPException) as error:
+            await scheduler.acquire(1)
+        assert error.value.status_code == 429
+
+        governor.limit = 1
+        await scheduler.acquire(1)
+        assert scheduler.stats()["concurrency"] == 1
+        waiter = asyncio.ensure_future(scheduler.acquire(1))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        scheduler.release(1)
+        await waiter
+
+    asyncio.run(scenario())
+
+
+def test_release_updates_throughput():
+    async def scenario():
+        scheduler = make_scheduler(initial_throughput=10)
+        async with scheduler.slot(100):
+            pass
+        assert scheduler.throughput > 10
+        assert scheduler.running == 0
+
+    asyncio.run(scenario())
+
+
+def test_analysis_cost_counts_only_sampled_frames():
+    probe = {"width": 1920, "height": 1080, "frames": 300}
+    assert analysis_cost(probe, 30) == 1920 * 1080 * 10
+    assert analysis_cost(probe, 7) == 1920 * 1080 * 43
+    assert analysis_cost(dict(probe, frames=0), 30) == 1
+
+
+def make_lane(name="test", **overrides):
+    return ExecutionLane(name, make_scheduler(name=name, **overrides))
+
+
+def test_lane_runs_in_own_threads_and_records_metrics():
+    async def scenario():
+        lane = make_lane()
+        thread_name = await lane.run(lambda: threading.current_thread().name, cost=10)
+        assert thread_name.startswith("lane-test")
+        assert await lane.run(lambda a, b: a + b, 2, 3, cost=10) == 5
+        stats = lane.stats()
+        assert stats["completed"] == 2 and stats["failed"] == 0 and stats["running"] == 0
+        assert set(stats["latency_ms"]) == {"p50", "p95", "p99"}
+
+    asyncio.run(scenario())
+
+
+def test_lane_counts_failures_and_releases_budget():
+    def boom():
+        raise ValueError("boom")
+
+    async def scenario():
+        lane = make_lane()
+        with pytest.raises(ValueError):
+            await lane.run(boom, cost=10)
+        stats = lane.stats()
+        assert stats["failed"] == 1 and stats["completed"] == 0
+        assert stats["running"] == 0 and stats["running_cost"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_run_keeps_budget_until_thread_finishes():
+    release = threading.Event()
+
+    async def scenario():
+        lane = make_lane()
+        job = asyncio.ensure_future(lane.run(release.wait, 5, cost=10))
+        await asyncio.sleep(0.01)
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        # Поток еще работает - место в бюджете занято
+        assert lane.stats()["running"] == 1 and lane.stats()["running_cost"] == 10
+        release.set()
+        while lane.stats()["running"]:
+            await asyncio.sleep(0.01)
+        stats = lane.stats()
+        assert stats["running_cost"] == 0
+        assert stats["failed"] == 1 and stats["completed"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_lane_slot_holds_budget_for_external_work():
+    async def scenario():
+        lane = make_lane(max_concurrent=1)
+        async with lane.slot(10):
+            assert lane.stats()["running"] == 1
+            waiter = asyncio.ensure_future(lane.run(lambda: "done", cost=10))
+            await asyncio.sleep(0.01)
+            assert not waiter.done()
+        assert await waiter == "done"
+        assert lane.stats()["completed"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_lanes_do_not_share_budget():
+    async def scenario():
+        batch = make_lane("batch", max_concurrent=1)
+        interactive = make_lane("interactive", max_concurrent=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def render():
+            started.set()
+            release.wait(5)
+            return "render"
+
+        render_task = asyncio.ensure_future(batch.run(render, cost=100))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        # Рендер занял пакетную полосу, а изображение проходит сразу
+        assert await asyncio.wait_for(interactive.run(lambda: "image", cost=1), 5) == "image"
+        release.set()
+        assert await render_task == "render"
+
+    asyncio.run(scenario())
@@ -0,0 +1,97 @@
+import os
+import time
+
+from src.services import storage
+from src.services.storage import WorkspaceManager, OutputStore, path_size
+
+HOUR = 3600
+
+
+def write(path, size):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def age(path, seconds):
+    """Сдвигает время обращения и изменения в прошлое"""
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_sweep_removes_only_stale_inactive_workspaces(tmp_path):
+    manager = WorkspaceManager(str(tmp_path / "uploads"))
+    active = manager.create()
+    stale = manager.create()
+    fresh = manager.create()
+    manager.release(stale, remove=False)
+    manager.release(fresh, remove=False)
+    for workspace in (active, stale):
+        age(workspace.path, 2 * HOUR)
+
+    assert manager.sweep(HOUR) == [stale.path]
+    assert os.path.isdir(active.path) and os.path.isdir(fresh.path)
+    assert not os.path.exists(stale.path)
+
+
+def test_release_removes_workspace_by_default(tmp_path):
+    manager = WorkspaceManager(str(tmp_path / "uploads"))
+    workspace = manager.create()
+    write(workspace.file_path("clip.mp4"), 10)
+    manager.release(workspace)
+    assert not os.path.exists(workspace.path)
+
+
+def test_evict_expired_outputs_but_not_pinned(tmp_path):
+    store = OutputStore(str(tmp_path / "outputs"), ttl_seconds=HOUR, max_bytes=1 << 20)
+    expired = write(store.path_for("old.mp4"), 10)
+    pinned = write(store.path_for("rendering.mp4"), 10)
+    fresh = write(store.path_for("new.mp4"), 10)
+    age(expired, 2 * HOUR)
+    age(pinned, 2 * HOUR)
+    store.pin(pinned)
+
+    assert store.evict() == [expired]
+    assert os.path.exists(pinned) and os.path.exists(fresh)
+
+
+def test_evict_least_recently_used_over_size_limit(tmp_path):
+    store = OutputStore(str(tmp_path / "outputs"), ttl_seconds=100 * HOUR, max_bytes=25)
+    oldest = write(store.path_for("a.mp4"), 10)
+    pinned = write(store.path_for("b.mp4"), 10)
+    newest = write(store.path_for("c.mp4"), 10)
+    age(oldest, 3 * HOUR)
+    age(pinned, 2 * HOUR)
+    store.pin(pinned)
+
+    # 30 байт при лимите 25: уходит самый давний незащищенный
+    assert store.evict() == [oldest]
+    assert os.path.exists(pinned) and os.path.exists(newest)
+
+
+def test_directory_output_is_counted_and_evicted_whole(tmp_path):
+    store = OutputStore(str(tmp_path / "outputs"), ttl_seconds=HOUR, max_bytes=1 << 20)
+    package = store.path_for("clip_hls")
+    os.makedirs(os.path.join(package, "v720p"))
+    write(os.path.join(package, "master.m3u8"), 5)
+    write(os.path.join(package, "v720p", "segment_000.ts"), 20)
+    assert path_size(package) == 25
+    age(package, 2 * HOUR)
+    assert store.evict() == [package]
+    assert not os.path.exists(package)
+
+
+def test_entries_skip_outputs_removed_during_sweep(tmp_path, monkeypatch):
+    store = OutputStore(str(tmp_path / "outputs"), ttl_seconds=HOUR, max_bytes=1 << 20)
+    write(store.path_for("gone.mp4"), 10)
+    kept = write(store.path_for("kept.mp4"), 10)
+    real_path_size = storage.path_size
+
+    def racing_path_size(path):
+        # Файл удалила задача, пока хранилище обходилось
+        if path.endswith("gone.mp4"):
+            os.remove(path)
+        return real_path_size(path)
+
+    monkeypatch.setattr(storage, "path_size", racing_path_size)
+    assert [entry["path"] for entry in store._entries()] == [kept]
@@ -0,0 +1,58 @@
+import pytest
+
+from src.dive_color_corrector import threads
+from src.dive_color_corrector.threads import ThreadBudget, split_cores
+
+
+@pytest.fixture(autouse=True)
+def no_limits(monkeypatch):
+    """pool_initializer ограничивает потоки основного процесса - в тестах не нужно"""
+    monkeypatch.setattr(threads, "limit_threads", lambda count: None)
+
+
+def test_split_cores_contiguous_sets():
+    assert split_cores(list(range(8)), 3) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+
+
+def test_split_cores_fewer_cores_than_parts():
+    assert split_cores([0, 1], 4) == [[0], [1]]
+
+
+def test_split_cores_single_set():
+    assert split_cores([0, 1, 2], 0) == [[0, 1, 2]]
+
+
+def test_default_budget_pool_takes_all_cores():
+    budget = ThreadBudget(total=8)
+    initializer, (worker_threads, core_sets, _) = budget.pool_initializer(8)
+    assert initializer is threads.init_pool_worker
+    assert worker_threads == 1
+    assert core_sets == []
+    assert budget.pool_threads() == 8
+    assert budget.main_threads() == 1
+
+
+def test_main_reserve_is_taken_from_pool():
+    budget = ThreadBudget(total=8, encoders=2, main_reserve=2)
+    budget.pool_initializer(3)
+    assert budget.pool_threads() == 6
+    assert budget.worker_threads() == 2
+    assert budget.main_threads() == 2
+    assert budget.ffmpeg_threads() == 1
+
+
+def test_main_reserve_leaves_one_thread_to_pool():
+    budget = ThreadBudget(total=4, main_reserve=10)
+    assert budget.main_reserve == 3
+    assert budget.pool_threads() == 1
+
+
+def test_stats():
+    budget = ThreadBudget(total=8, main_reserve=2)
+    budget.pool_initializer(6)
+    stats = budget.stats()
+    assert stats["workers"] == 6
+    assert stats["worker_threads"] == 1
+    assert stats["main_reserve"] == 2
+    assert stats["main_threads"] == 2
+    assert stats["threadpoolctl"] == (threads.threadpool_limits is not None)
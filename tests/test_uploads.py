@@ -0,0 +1,185 @@
+import os
+import shutil
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+
+from src.services.storage import WorkspaceManager
+from src.services.uploads import ResumableUploadManager, stream_to_file, check_content_length, hash_file
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return ResumableUploadManager(
+        WorkspaceManager(str(tmp_path / "uploads")), max_size=1000, default_chunk_size=4, max_chunk_size=8
+    )
+
+
+def test_create_describes_missing_chunks(manager):
+    upload = manager.create("../clip.mp4", total_size=10)
+    assert upload["filename"] == "clip.mp4"
+    assert upload["chunk_count"] == 3
+    assert upload["missing_chunks"] == [0, 1, 2]
+    assert upload["received_bytes"] == 0
+
+
+@pytest.mark.parametrize("total_size, chunk_size, status", [(0, None, 400), (1001, None, 413), (10, 9, 400)])
+def test_create_rejects_invalid_sizes(manager, total_size, chunk_size, status):
+    with pytest.raises(HTTPException) as error:
+        manager.create("clip.mp4", total_size=total_size, chunk_size=chunk_size)
+    assert error.value.status_code == status
+
+
+def test_chunks_in_any_order_then_finalize(manager):
+    data = b"0123456789"
+    upload_id = manager.create("clip.mp4", total_size=len(data))["upload_id"]
+
+    async def run():
+        await asyncio.gather(
+            manager.put_chunk(upload_id, 2, chunks(data[8:])),
+            manager.put_chunk(upload_id, 0, chunks(data[:2], data[2:4])),
+        )
+        status = manager.status(upload_id)
+        assert status["missing_chunks"] == [1]
+        assert status["received_ranges"] == [[0, 4], [8, 10]]
+        with pytest.raises(HTTPException) as error:
+            await manager.finalize(upload_id)
+        assert error.value.status_code == 409
+
+        await manager.put_chunk(upload_id, 1, chunks(data[4:8]))
+        return await manager.finalize(upload_id)
+
+    workspace, path, filename, content_hash = asyncio.run(run())
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert filename == "clip.mp4"
+    assert content_hash == hashlib.sha256(data).hexdigest()
+    assert manager.status(upload_id)["state"] == "finalized"
+
+
+def test_chunk_with_wrong_length_is_rejected(manager):
+    upload_id = manager.create("clip.mp4", total_size=10)["upload_id"]
+
+    async def put(index, *parts):
+        await manager.put_chunk(upload_id, index, chunks(*parts))
+
+    for index, parts, status in [(0, [b"012"], 400), (0, [b"01234"], 400), (3, [b"0"], 416)]:
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(put(index, *parts))
+        assert error.value.status_code == status
+    assert manager.status(upload_id)["missing_chunks"] == [0, 1, 2]
+
+
+def test_unknown_and_aborted_uploads_are_not_found(manager):
+    with pytest.raises(HTTPException) as error:
+        manager.status("0" * 32)
+    assert error.value.status_code == 404
+
+    upload_id = manager.create("clip.mp4", total_size=10)["upload_id"]
+    manager.abort(upload_id)
+    with pytest.raises(HTTPException) as error:
+        manager.status(upload_id)
+    assert error.value.status_code == 404
+
+
+def test_chunk_after_finalize_does_not_rewrite_file(manager):
+    data = b"0123456789"
+    upload_id = manager.create("clip.mp4", total_size=len(data))["upload_id"]
+
+    async def run():
+        for index in range(3):
+            await manager.put_chunk(upload_id, index, chunks(data[index * 4:index * 4 + 4]))
+        result = await manager.finalize(upload_id)
+        # Повтор части после finalize отклоняется до записи
+        with pytest.raises(HTTPException) as error:
+            await manager.put_chunk(upload_id, 0, chunks(b"XXXX"))
+        assert error.value.status_code == 409
+        return result
+
+    _, path, _, content_hash = asyncio.run(run())
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert content_hash == hashlib.sha256(data).hexdigest()
+
+
+def test_finalize_waits_for_chunks_being_written(manager):
+    data = b"0123"
+    upload_id = manager.create("clip.mp4", total_size=len(data))["upload_id"]
+
+    async def run():
+        proceed = asyncio.Event()
+
+        async def slow_chunk():
+            yield data[:2]
+            await proceed.wait()
+            yield data[2:]
+
+        writer = asyncio.ensure_future(manager.put_chunk(upload_id, 0, slow_chunk()))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as error:
+            await manager.finalize(upload_id)
+        assert error.value.status_code == 409
+        assert manager.status(upload_id)["state"] == "uploading"
+        proceed.set()
+        await writer
+        return await manager.finalize(upload_id)
+
+    _, _, _, content_hash = asyncio.run(run())
+    assert content_hash == hashlib.sha256(data).hexdigest()
+    assert not manager._writers
+
+
+def test_evict_forgets_locks_of_swept_uploads(manager):
+    kept = manager.create("a.mp4", total_size=4)["upload_id"]
+    swept = manager.create("b.mp4", total_size=4)["upload_id"]
+    manager._lock(kept)
+    manager._lock(swept)
+    # Уборщик удалил брошенную загрузку
+    shutil.rmtree(os.path.join(manager.workspaces.root, swept))
+    assert manager.evict() == [swept]
+    assert set(manager._locks) == {kept}
+
+
+def test_stream_to_file_hashes_while_writing(tmp_path):
+    path = str(tmp_path / "clip.mp4")
+    parts = [b"abc", b"", b"defgh"]
+    progress = []
+    content_hash, size = asyncio.run(stream_to_file(chunks(*parts), path, max_size=100, on_progress=progress.append))
+    assert size == 8 and progress == [3, 3, 8]
+    assert content_hash == hashlib.sha256(b"abcdefgh").hexdigest() == hash_file(path)
+
+
+def test_stream_to_file_over_limit_removes_partial_file(tmp_path):
+    path = str(tmp_path / "clip.mp4")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(stream_to_file(chunks(b"12345", b"678"), path, max_size=6))
+    assert error.value.status_code == 413
+    assert not os.path.exists(path)
+
+
+def test_stream_to_file_interrupted_removes_partial_file(tmp_path):
+    path = str(tmp_path / "clip.mp4")
+
+    async def broken():
+        yield b"1234"
+        raise ConnectionError("client disconnected")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(stream_to_file(broken(), path, max_size=100))
+    assert not os.path.exists(path)
+
+
+def test_check_content_length():
+    check_content_length(None, 10)
+    check_content_length("10", 10)
+    for value, status in [("11", 413), ("ten", 400)]:
+        with pytest.raises(HTTPException) as error:
+            check_content_length(value, 10)
+        assert error.value.status_code == status
@@ -0,0 +1,123 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from src.dive_color_corrector import variants as variants_module
+from src.dive_color_corrector.variants import blend_transform, parse_variants, process_video_variants
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "sample.mp4")
+
+
+def test_parse_variants_fills_defaults():
+    parsed = parse_variants('[{"name": "full"}, {"max_dimension": 720, "bitrate": "2.5M", "strength": 0.7}]', 4)
+    assert parsed == [
+        {"name": "full", "max_dimension": None, "codec": "h264", "bitrate": None, "strength": 1.0},
+        {"name": "v2", "max_dimension": 720, "codec": "h264", "bitrate": 2500000, "strength": 0.7},
+    ]
+    assert parse_variants([{"name": "share"}], 4, default_codec="mp4v")[0]["codec"] == "mp4v"
+
+
+@pytest.mark.parametrize("spec", [
+    "not json",
+    "[]",
+    '{"name": "full"}',
+    '["full"]',
+    '[{"name": "a/b"}]',
+    '[{"name": ""}]',
+    '[{"name": "full"}, {"name": "full"}]',
+    '[{"name": "x", "codec": "vp9"}]',
+    '[{"name": "x", "max_dimension": 8}]',
+    '[{"name": "x", "codec": "mp4v", "bitrate": "2M"}]',
+    '[{"name": "x", "bitrate": "fast"}]',
+    '[{"name": "x", "strength": -0.1}]',
+    '[{"name": "x", "strength": 1.5}]',
+    '[{"name": "a"}, {"name": "b"}, {"name": "c"}]',
+])
+def test_parse_variants_rejects_invalid_spec(spec):
+    with pytest.raises(ValueError):
+        parse_variants(spec, 2)
+
+
+def test_blend_transform_mixes_with_identity():
+    transform = np.hstack([np.eye(3, dtype=np.float32) * 1.4, np.full((3, 1), 20, dtype=np.float32)])
+    assert blend_transform(transform, 1.0) is transform
+    np.testing.assert_allclose(blend_transform(transform, 0.0), variants_module._IDENTITY_TRANSFORM)
+    half = blend_transform(transform, 0.5)
+    np.testing.assert_allclose(np.diag(half[:, :3]), [1.2, 1.2, 1.2], rtol=1e-6)
+    np.testing.assert_allclose(half[:, 3], [10, 10, 10], rtol=1e-6)
+
+
+def read_frames(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def test_variants_are_rendered_from_one_decode_pass(tmp_path, monkeypatch):
+    captures = []
+
+    open_video = cv2.VideoCapture
+
+    class CountingCapture:
+        """Считает прочитанные кадры, остальное - как у cv2.VideoCapture"""
+
+        def __init__(self, path):
+            self.capture = open_video(path)
+            self.reads = 0
+
+        def read(self):
+            self.reads += 1
+            return self.capture.read()
+
+        def __getattr__(self, name):
+            return getattr(self.capture, name)
+
+    def open_capture(path):
+        capture = CountingCapture(path)
+        captures.append(capture)
+        return capture
+
+    probe = cv2.VideoCapture(SAMPLE)
+    fps, frame_count = probe.get(cv2.CAP_PROP_FPS), int(probe.get(cv2.CAP_PROP_FRAME_COUNT))
+    probe.release()
+    # Фильтр, осветляющий все каналы в 1.5 раза
+    brighten = np.zeros(20, dtype=np.float32)
+    brighten[[0, 6, 12]] = 1.5
+    video_data = {
+        "input_video_path": SAMPLE, "fps": fps, "frame_count": frame_count,
+        "filters": np.array([brighten]), "filter_indices": [1], "rotation_angle": 0,
+    }
+    requested = parse_variants([
+        {"name": "full"},
+        {"name": "share", "max_dimension": 320, "strength": 0.5},
+        {"name": "original", "max_dimension": 320, "strength": 0},
+    ], 4, default_codec="mp4v")
+    for variant in requested:
+        variant["path"] = str(tmp_path / f"{variant['name']}.mp4")
+
+    monkeypatch.setattr(variants_module.cv2, "VideoCapture", open_capture)
+    result = process_video_variants(video_data, requested, start=1, end=2)
+    monkeypatch.undo()
+
+    first, last = result["frame_range"]
+    assert (first, last) == (61, int(round(2 * fps)))
+    # Одно открытие и одно чтение каждого кадра отрезка на все варианты
+    assert len(captures) == 1 and captures[0].reads == last - first + 1
+    rendered = {v["name"]: v for v in result["variants"]}
+    assert all(v["frames"] == last - first + 1 for v in rendered.values())
+    assert rendered["full"]["output_dimensions"] == (704, 1264)
+    assert rendered["share"]["output_dimensions"] == rendered["original"]["output_dimensions"]
+    assert max(rendered["share"]["output_dimensions"]) == 320
+
+    frames = {name: read_frames(v["output_path"]) for name, v in rendered.items()}
+    assert all(len(f) == last - first + 1 for f in frames.values())
+    brightness = {name: float(np.mean(f[0])) for name, f in frames.items()}
+    assert brightness["original"] < brightness["share"] < brightness["full"]
@@ -0,0 +1,102 @@
+import os
+import socket
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.config.settings import settings
+from src.services.video_processor import VideoProcessor, video_processor
+
+
+def test_recover_local_jobs_fails_jobs_of_previous_run():
+    queue, kind = video_processor.queue, video_processor.LOCAL_VIDEO_JOB
+    host = socket.gethostname()
+    # Тот же pid после перезапуска контейнера и pid, которого уже нет
+    same_pid = queue.enqueue(kind, {}, max_attempts=1, worker_id=f"{host}:{os.getpid()}")
+    exited = queue.enqueue(kind, {}, max_attempts=1, worker_id=f"{host}:999999999")
+    alive = queue.enqueue(kind, {}, max_attempts=1, worker_id=f"{host}:{os.getppid()}")
+    other_node = queue.enqueue(kind, {}, max_attempts=1, worker_id="other-node:1")
+    assert sorted(video_processor.recover_local_jobs()) == sorted([same_pid, exited])
+    assert queue.get(exited)["error"] == "Processing was interrupted"
+    assert queue.get(alive)["status"] == "running"
+    assert queue.get(other_node)["status"] == "running"
+    for job_id in (alive, other_node):
+        queue.fail(job_id, queue.get(job_id)["lease_owner"], "cleanup")
+
+
+@pytest.mark.parametrize("start, end", [(5, 5), (5, 2), (-1, None)])
+def test_render_options_reject_invalid_range(start, end):
+    with pytest.raises(HTTPException) as error:
+        VideoProcessor.render_options(start=start, end=end)
+    assert error.value.status_code == 400
+
+
+def test_render_options_keep_range():
+    assert VideoProcessor.render_options(start=1.5, end=4) == {"start": 1.5, "end": 4.0}
+    assert VideoProcessor.render_options(start=0, end=4) == {"end": 4.0}
+
+
+def stream_job(name, status="processing", running=True):
+    """Задача stream=true с растущим файлом name в хранилище результатов"""
+    workspace = video_processor.workspaces.create()
+    video_processor.jobs.register(workspace, "in.mp4", "hash", {"stream": True}, {"output_filename": name}, status=status)
+    if running:
+        # Достаточно записи о фоновой задаче: tail_stream проверяет только ее наличие
+        video_processor._stream_jobs[workspace.job_id] = None
+    return workspace, video_processor.output_store.path_for(name)
+
+
+def test_tail_stream_serves_growing_file_until_job_finishes(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "STREAM_CHUNK_SIZE", 4)
+    workspace, path = stream_job("growing_stream.mp4")
+    fragments = [b"ftyp", b"moof-mdat-1", b"moof-mdat-2"]
+
+    async def write():
+        # Файла еще нет, когда клиент начинает читать
+        await asyncio.sleep(0.05)
+        for fragment in fragments:
+            with open(path, "ab") as f:
+                f.write(fragment)
+            await asyncio.sleep(0.05)
+        video_processor._stream_jobs.pop(workspace.job_id)
+        video_processor.jobs.set_status(workspace, "completed")
+
+    async def read():
+        chunks = await video_processor.tail_stream(workspace.job_id)
+        writer = asyncio.create_task(write())
+        received = [chunk async for chunk in chunks]
+        await writer
+        return received
+
+    received = asyncio.run(read())
+    assert b"".join(received) == b"".join(fragments)
+    assert max(len(chunk) for chunk in received) <= 4
+
+
+def test_tail_stream_of_interrupted_job_returns_failure():
+    # Запись "processing" без фоновой задачи - процесс перезапустился во время обработки
+    workspace, path = stream_job("interrupted_stream.mp4", running=False)
+    with open(path, "wb") as f:
+        f.write(b"partial")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(video_processor.tail_stream(workspace.job_id))
+    assert error.value.status_code == 500
+    assert error.value.detail == "Processing was interrupted"
+
+
+def test_tail_stream_of_failed_job_returns_error():
+    workspace, _ = stream_job("failed_stream.mp4", running=False)
+    video_processor.jobs.set_status(workspace, "failed", "decoder error")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(video_processor.tail_stream(workspace.job_id))
+    assert (error.value.status_code, error.value.detail) == (500, "decoder error")
+
+
+def test_tail_stream_requires_streaming_output():
+    workspace = video_processor.workspaces.create()
+    video_processor.jobs.register(workspace, "in.mp4", "hash", {}, {"output_filename": "plain.mp4"})
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(video_processor.tail_stream(workspace.job_id))
+    assert error.value.status_code == 404
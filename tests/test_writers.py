@@ -0,0 +1,88 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from src.dive_color_corrector.writers import FFmpegPipeWriter, is_ffmpeg_available, parse_renditions, select_renditions
+
+LADDER = [(1080, "5000k"), (720, "2800k"), (360, "800k")]
+
+
+def test_parse_renditions_sorts_from_highest():
+    assert parse_renditions("360:800k, 1080:5000k,720:2800k,") == LADDER
+
+
+def test_parse_renditions_without_bitrate():
+    assert parse_renditions("720") == [(720, None)]
+
+
+def test_parse_renditions_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_renditions("hd:5000k")
+
+
+def test_select_renditions_skips_steps_above_source():
+    selected = select_renditions(LADDER, 1280, 720)
+    assert [r["name"] for r in selected] == ["720p", "360p"]
+    assert (selected[0]["width"], selected[0]["height"]) == (1280, 720)
+    assert (selected[1]["width"], selected[1]["height"]) == (640, 360)
+    assert selected[1]["bitrate"] == "800k"
+
+
+def test_select_renditions_uses_short_side_for_portrait():
+    selected = select_renditions(LADDER, 1080, 1920)
+    assert [r["name"] for r in selected] == ["1080p", "720p", "360p"]
+    assert (selected[1]["width"], selected[1]["height"]) == (720, 1280)
+
+
+def test_select_renditions_sizes_are_even():
+    for r in select_renditions(LADDER, 1918, 1078):
+        assert r["width"] % 2 == 0 and r["height"] % 2 == 0
+
+
+def test_small_source_gets_single_rendition_at_source_size():
+    selected = select_renditions(LADDER, 321, 241)
+    assert selected == [{"name": "241p", "width": 320, "height": 240, "bitrate": "800k"}]
+
+
+needs_ffmpeg = pytest.mark.skipif(not is_ffmpeg_available(), reason="ffmpeg is not installed")
+
+
+def frame(n, width=65, height=49):
+    return np.full((height, width, 3), (n * 8 % 256, 100, 50), dtype=np.uint8)
+
+
+@needs_ffmpeg
+def test_pipe_writer_flushes_fragments_before_release(tmp_path):
+    path = str(tmp_path / "out.mp4")
+    writer = FFmpegPipeWriter(path, 10, (65, 49), fragment_seconds=1.0, threads=1)
+    assert writer.isOpened()
+    for n in range(30):
+        writer.write(frame(n))
+    # Готовые фрагменты попадают на диск, пока ffmpeg еще принимает кадры
+    deadline = time.monotonic() + 30
+    while not (os.path.exists(path) and b"moof" in open(path, "rb").read()):
+        assert time.monotonic() < deadline, "no fragment was flushed"
+        time.sleep(0.1)
+    assert writer.isOpened()
+    writer.release()
+
+    cap = cv2.VideoCapture(path)
+    frames = 0
+    while cap.read()[0]:
+        frames += 1
+    # Нечетный размер дополняется до четного
+    assert (cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) == (66, 50)
+    cap.release()
+    assert frames == 30
+
+
+@needs_ffmpeg
+def test_pipe_writer_reports_ffmpeg_failure(tmp_path):
+    writer = FFmpegPipeWriter(str(tmp_path / "missing" / "out.mp4"), 10, (64, 48), threads=1)
+    with pytest.raises(RuntimeError, match="ffmpeg"):
+        for n in range(1000):
+            writer.write(frame(n, 64, 48))
+        writer.release()